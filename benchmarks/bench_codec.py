@@ -0,0 +1,92 @@
+"""Benchmark of the json codecs on exchange traffic
+
+Decodes websocket frames as WebsocketClient does and encodes Trade events as
+Event.json() does, once with every installed codec.
+
+Run with:
+
+    python benchmarks/bench_codec.py [frames.txt]
+
+where frames.txt optionally holds one raw frame per line. By default a sample
+of Bitfinex, GDAX and Poloniex frames is used.
+"""
+import sys
+import timeit
+
+from numismatic.events import Trade
+from numismatic.libs import codec
+
+
+BITFINEX_FRAMES = [
+    '{"event":"subscribed","channel":"trades","chanId":17,"pair":"BTCUSD"}',
+    '[17,[[75165521,1508424154000,0.0169,5609.2],[75165520,1508424153000,'
+    '-0.37219841,5609.1],[75165519,1508424151000,0.22,5609.2],[75165518,'
+    '1508424150000,-0.01,5609.1],[75165517,1508424148000,0.4,5609.2]]]',
+    '[17,"hb"]',
+    '[17,"te",[75165522,1508424155000,-0.0449,5609.1]]',
+    '[17,"tu",[75165522,1508424155000,-0.0449,5609.1]]',
+    ]
+
+GDAX_FRAMES = [
+    '{"type":"ticker","sequence":4270467089,"product_id":"BTC-USD",'
+    '"price":"5609.99000000","open_24h":"5660.00000000","volume_24h":'
+    '"9768.71256523","low_24h":"5609.99000000","high_24h":"5770.00000000",'
+    '"volume_30d":"371838.43006291","best_bid":"5609.98","best_ask":"5609.99"'
+    ',"side":"buy","time":"2017-10-19T14:43:12.250000Z","trade_id":22146547,'
+    '"last_size":"0.01340000"}',
+    '{"type":"heartbeat","last_trade_id":22146547,"product_id":"BTC-USD",'
+    '"sequence":4270467090,"time":"2017-10-19T14:43:13.003000Z"}',
+    ]
+
+POLONIEX_FRAMES = [
+    '[1010]',
+    '[148,394056638,[["o",0,"0.07615527","0.34317849"],["o",1,"0.07600000",'
+    '"0.00000000"],["t","9394200",1,"0.07615527","0.00009541",1508060546]]]',
+    '[148,394056639,[["o",1,"0.07598110","1.20418620"]]]',
+    ]
+
+SAMPLE_FRAMES = BITFINEX_FRAMES + GDAX_FRAMES + POLONIEX_FRAMES
+
+TRADE = Trade(exchange='Bitfinex', symbol='BTCUSD', price=5609.2,
+              volume=0.0169, timestamp=1508424154.0, id='75165521')
+
+
+def bench(name, frames, number):
+    codec.set_codec(name)
+    loads = codec.loads
+    decode = min(timeit.repeat(lambda: [loads(frame) for frame in frames],
+                               number=number, repeat=3))
+    encode = min(timeit.repeat(TRADE.json, number=number*len(frames),
+                               repeat=3))
+    return decode, encode
+
+
+def main(path=None, number=10000):
+    if path is None:
+        frames = SAMPLE_FRAMES
+    else:
+        with open(path) as f:
+            frames = [line.rstrip('\n') for line in f if line.strip()]
+        number = max(1, number*len(SAMPLE_FRAMES)//len(frames))
+    total = number*len(frames)
+    print(f'{len(frames)} frames x {number} iterations')
+    print(f'{"codec":>10} {"decode us/frame":>16} {"encode us/event":>16}')
+    results = {}
+    for name in codec.CODECS:
+        try:
+            codec.CODECS[name]()
+        except ImportError:
+            print(f'{name:>10} {"not installed":>16}')
+            continue
+        decode, encode = bench(name, frames, number)
+        results[name] = decode, encode
+        print(f'{name:>10} {decode/total*1e6:>16.3f} {encode/total*1e6:>16.3f}')
+    baseline = results['json']
+    for name, (decode, encode) in results.items():
+        if name!='json':
+            print(f'{name} vs json: decode {baseline[0]/decode:.1f}x, '
+                  f'encode {baseline[1]/encode:.1f}x')
+
+
+if __name__=='__main__':
+    main(*sys.argv[1:2])
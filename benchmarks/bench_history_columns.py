@@ -0,0 +1,78 @@
+"""Benchmark of writing and loading candles as text and as NumPy files
+
+Writes a year of synthetic minute candles the way coin history does, as one
+str(dict) per line, and with libs.columns.save() as .npz and .npy files, and
+then loads each of them back.
+
+Run with:
+
+    python benchmarks/bench_history_columns.py [--candles 525600]
+"""
+import argparse
+import ast
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from numismatic.libs import columns
+
+
+def make_candles(number):
+    start = 1483228800
+    return [{'asset': 'BTC', 'currency': 'USD', 'time': start+60*i,
+             'close': 1000.0+i, 'high': 1001.0+i, 'low': 999.0+i,
+             'open': 1000.5+i, 'volumefrom': 1.5, 'volumeto': 1500.0}
+            for i in range(number)]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter()-start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--candles', type=int, default=525600)
+    args = parser.parse_args()
+
+    candles = make_candles(args.candles)
+    history = {('BTC', 'USD'): columns.to_columns(candles)}
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, 'history.txt')
+        npz_path = os.path.join(directory, 'history.npz')
+        npy_path = os.path.join(directory, 'history.npy')
+
+        def write_text():
+            with open(text_path, 'wt') as file:
+                for candle in candles:
+                    file.write(str(candle)+'\n')
+
+        def load_text():
+            with open(text_path, 'rt') as file:
+                return [ast.literal_eval(line) for line in file]
+
+        def load_npz():
+            with np.load(npz_path) as npz:
+                return {key: npz[key] for key in npz.files}
+
+        results = [
+            ('text write', *timed(write_text)),
+            ('npz write', *timed(lambda: columns.save(npz_path, history))),
+            ('npy write', *timed(lambda: columns.save(npy_path, history))),
+            ('text load', *timed(load_text)),
+            ('npz load', *timed(load_npz)),
+            ('npy mmap load', *timed(lambda: np.load(npy_path,
+                                                     mmap_mode='r'))),
+            ]
+        for name, seconds, _ in results:
+            print(f'{name:>16}: {seconds*1000:10.1f} ms')
+        for path in (text_path, npz_path, npy_path):
+            print(f'{os.path.basename(path):>16}: '
+                  f'{os.path.getsize(path)/2**20:10.1f} MB')
+
+
+if __name__=='__main__':
+    main()
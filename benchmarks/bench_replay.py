@@ -0,0 +1,54 @@
+"""Offline throughput benchmark of the feed parsers and collectors
+
+Replays a recording made with `coin listen ... record -o traffic.rec run`
+through the recorded websocket clients and reports frames and events per
+second.
+
+Run with:
+
+    python benchmarks/bench_replay.py traffic.rec [--speed 0]
+        [--collector file] [--format json] [--output /dev/null]
+"""
+import argparse
+import asyncio
+
+from streamz import union
+
+from numismatic.collectors import Collector
+from numismatic.recording import Replayer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='multiple of real time, 0 for max speed')
+    parser.add_argument('--collector', default=None,
+                        choices=sorted(Collector._get_subclasses()))
+    parser.add_argument('--format', default='text', choices=['text', 'json'])
+    parser.add_argument('--output', default='/dev/null')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    replayer = Replayer(path=args.path, speed=args.speed)
+    event_streams = [subscription.event_stream for subscription in
+                     replayer.subscriptions.values()]
+    events = [0]
+
+    def count(event):
+        events[0] += 1
+
+    for event_stream in event_streams:
+        event_stream.sink(count)
+    if args.collector:
+        Collector.factory(args.collector, event_stream=union(*event_streams),
+                          path=args.output, format=args.format)
+    stats = loop.run_until_complete(replayer.run())
+    elapsed = stats['elapsed']
+    print(f'{stats["frames"]} frames, {events[0]} events in {elapsed:.3f}s')
+    print(f'{stats["frames"]/elapsed:.0f} frames/s, '
+          f'{events[0]/elapsed:.0f} events/s')
+
+
+if __name__=='__main__':
+    main()
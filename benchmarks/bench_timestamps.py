@@ -0,0 +1,67 @@
+"""Benchmark of timestamp parsing on exchange timestamp formats
+
+Compares parse_timestamp with datetime.strptime and dateutil on the ISO-8601
+timestamps sent by GDAX and checks that they agree.
+
+Run with:
+
+    python benchmarks/bench_timestamps.py [--number 100000]
+"""
+import argparse
+import timeit
+from datetime import datetime, timezone
+
+from dateutil.parser import parse
+
+from numismatic.libs.utils import parse_timestamp
+
+
+TIMESTAMPS = [
+    '2017-10-19T14:42:34.512000Z',
+    '2017-10-19T14:42:34.5Z',
+    '2017-10-19T14:42:35Z',
+    '2017-10-19T23:59:59.999999Z',
+    ]
+
+
+def strptime_utc(timestamp):
+    fmt = '%Y-%m-%dT%H:%M:%S.%fZ' if '.' in timestamp else '%Y-%m-%dT%H:%M:%SZ'
+    return datetime.strptime(timestamp, fmt).replace(
+        tzinfo=timezone.utc).timestamp()
+
+
+def dateutil_utc(timestamp):
+    return parse(timestamp).timestamp()
+
+
+PARSERS = [
+    ('parse_timestamp', parse_timestamp),
+    ('strptime', strptime_utc),
+    ('dateutil', dateutil_utc),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    for timestamp in TIMESTAMPS:
+        expected = strptime_utc(timestamp)
+        for name, parse_func in PARSERS:
+            result = parse_func(timestamp)
+            assert abs(result-expected)<1e-6, (name, timestamp, result)
+
+    timings = {}
+    for name, parse_func in PARSERS:
+        seconds = min(timeit.repeat(
+            lambda: [parse_func(timestamp) for timestamp in TIMESTAMPS],
+            number=args.number//len(TIMESTAMPS), repeat=3))
+        timings[name] = seconds
+        print(f'{name:>16}: {args.number/seconds:12.0f} timestamps/s')
+    speedup = timings['strptime']/timings['parse_timestamp']
+    print(f'parse_timestamp is {speedup:.1f}x faster than strptime')
+
+
+if __name__=='__main__':
+    main()
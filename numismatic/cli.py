@@ -1,17 +1,28 @@
 import logging
+import atexit
 import click
 from itertools import chain
 from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
 import asyncio
 
+from dateutil.parser import parse
 from tornado.platform.asyncio import AsyncIOMainLoop
 from streamz import Stream, union, combine_latest, zip_latest
 import attr
 
-from .events import PriceUpdate
+from .events import PriceUpdate, TradeSnapshot
+from .orderbook import OrderBook
 from .collectors import Collector
 from .feeds import Feed
+from .feeds.base import WebsocketClient
+from .workers import WorkerPool
+from .recording import Recorder, Replayer
+from .requesters import AsyncRequester
 from .config import config
+from .libs import codec, columns
+from .libs.metrics import latency as latency_monitor
 
 logger = logging.getLogger(__name__)
 
@@ -23,15 +34,58 @@ ENVVAR_PREFIX = 'NUMISMATIC'
 
 pass_state = click.make_pass_decorator(dict, ensure=True)
 
+
+class Date(click.ParamType):
+    '''A date string that dateutil can parse'''
+    name = 'date'
+
+    def convert(self, value, param, ctx):
+        if value is None:
+            return value
+        try:
+            # dateutil would take a period count like -5 as the 5th
+            if str(value).lstrip()[:1] in '+-':
+                raise ValueError(value)
+            parse(value)
+        except (ValueError, OverflowError, TypeError):
+            self.fail(f'{value!r} is not a date', param, ctx)
+        return value
+
+DATE = Date()
+
+
+class DateOrPeriods(Date):
+    '''A date, or an int number of --freq periods relative to the end date'''
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            pass
+        try:
+            return super().convert(value, param, ctx)
+        except click.BadParameter:
+            self.fail(f'{value!r} is neither a date nor a number of periods',
+                      param, ctx)
+
+DATE_OR_PERIODS = DateOrPeriods()
+
+
 @click.group(chain=True)
 @click.option('--cache-dir', '-d', default=None)
-@click.option('--requester', '-r', default='base',
-              type=click.Choice(['base', 'caching']))
+@click.option('--requester', '-r', default=None,
+              type=click.Choice(['base', 'caching', 'async']),
+              help='Default is base, or async for listen if available')
 @click.option('--log-level', '-l', default='info', 
               type=click.Choice(['debug', 'info', 'warning', 'error',
                                  'critical']))
+@click.option('--codec', 'codec_name', default=config['DEFAULT']['codec'],
+              type=click.Choice(['auto'] + list(codec.CODECS)),
+              help='JSON codec for decoding packets and encoding events')
 @pass_state
-def coin(state, cache_dir, requester, log_level):
+def coin(state, cache_dir, requester, log_level, codec_name):
     '''Numismatic Command Line Interface
 
     Examples:
@@ -58,6 +112,10 @@ def coin(state, cache_dir, requester, log_level):
 
         coin history -a ETH -c BTC -o ETH-BTH-history.json
 
+        coin history -a BTC,ETH --freq m -s 2017-01-01 -o history.npz
+
+        coin history -a BTC,ETH -s -3000 --dry-run
+
         coin listen collect run
 
         coin listen -a BTC,ETH,XMR,ZEC collect -t Trade run -t 30
@@ -66,17 +124,34 @@ def coin(state, cache_dir, requester, log_level):
 
         coin listen -f bitfinex -f gdax collect --raw run
 
+        coin listen -f gdax -C level2 collect --book run
+
         coin listen -f cryptocompare collect run
 
+        coin listen -f luno -C prices collect run
+
         coin listen -f cryptocompare -e kraken collect run
 
         coin listen -f bitfinex -f gdax compare run
 
+        coin listen -f bitfinex -a BTC,ETH,XMR,ZEC,LTC,DSH -w 4 collect run
+
+        coin listen -f bitfinex -w 4 --raw collect --raw run
+
+        coin listen -f bitfinex -f gdax record -o traffic.rec run -t 60
+
+        coin replay -i traffic.rec -s 0 collect run
+
+        coin listen -f bitfinex -f gdax latency -i 10 run -t 60
+
+        coin listen -f gdax --stale-timeout 30 collect run
+
         coin listen -f cryptocompare -C tickers -e cexio listen -f \\
             cryptocompare -C prices -e kraken listen -f bitfinex compare \\
             run
     '''
     logging.basicConfig(level=getattr(logging, log_level.upper()))
+    codec.set_codec(codec_name)
     state['cache_dir'] = cache_dir
     state['requester'] = requester
     state['output_stream'] = Stream()
@@ -154,24 +229,55 @@ def tickers(state, feed, exchange, assets, currencies, raw, output):
               type=click.Choice(Feed._get_subclasses().keys()))
 @click.option('--exchange', '-e', default=None)
 @click.option('--freq', default='d', type=click.Choice(list('dhms')))
-@click.option('--start-date', '-s', default=-30)
-@click.option('--end-date', '-e', default=None)
+@click.option('--start-date', '-s', default=-30, type=DATE_OR_PERIODS,
+              help='Date, or number of periods before the end date')
+@click.option('--end-date', default=None, type=DATE,
+              help='Date, default is now')
 @click.option('--assets', '-a', multiple=True,
               envvar=f'{ENVVAR_PREFIX}_ASSETS')
 @click.option('--currencies', '-c', multiple=True,
               envvar=f'{ENVVAR_PREFIX}_CURRENCIES')
-@click.option('--output', '-o', type=click.File('wt'), default='-')
+@click.option('--output', '-o', default='-',
+              type=click.Path(dir_okay=False, allow_dash=True),
+              help='.npz and .npy files get NumPy arrays')
+@click.option('--dry-run', is_flag=True,
+              help='Only list the requests that would be made')
 @pass_state
 def history(state, feed, exchange, assets, currencies, freq, start_date,
-            end_date, output):
+            end_date, output, dry_run):
     'Historic asset prices and volumes'
     feed_client = Feed.factory(feed, cache_dir=state['cache_dir'],
                                requester=state['requester'])
-    data = feed_client.get_historical_data(assets, currencies, freq=freq,
-                                           start_date=start_date,
-                                           end_date=end_date, 
-                                           exchange=exchange)
-    write(data, output)
+    if dry_run:
+        chunks = feed_client.plan_historical_data(assets, currencies,
+                                                  freq=freq,
+                                                  start_date=start_date,
+                                                  end_date=end_date,
+                                                  exchange=exchange)
+        for chunk in chunks:
+            series = chunk.series
+            candles = 'all' if chunk.all_data else chunk.limit+1
+            click.echo(f'{series.asset}/{series.currency}: {candles} '
+                       f'candles to {datetime.utcfromtimestamp(chunk.toTs)}')
+        click.echo(f'{len(chunks)} requests')
+        return
+    if Path(output).suffix in ('.npz', '.npy'):
+        data = feed_client.get_historical_data(assets, currencies, freq=freq,
+                                               start_date=start_date,
+                                               end_date=end_date,
+                                               exchange=exchange,
+                                               columnar=True)
+        columns.save(output, data)
+        return
+    # write every chunk as soon as it arrives rather than all at the end
+    chunks = feed_client.iter_historical_data(assets, currencies, freq=freq,
+                                              start_date=start_date,
+                                              end_date=end_date,
+                                              exchange=exchange)
+    with click.open_file(output, 'wt') as file:
+        for chunk in chunks:
+            write(chunk, file)
+            file.flush()
 
 
 # FIXME: Do we still want this?
@@ -199,12 +305,39 @@ def tabulate(data):
 @click.option('--interval', '-i', default=1.0, type=float,
               help='Interval between requests for RestClient subscriptions')
 @click.option('--channels', '-C', multiple=True)
+@click.option('--max-channels', default=None, type=int,
+              help='Maximum channels per websocket connection')
+@click.option('--workers', '-w', default=1, type=int,
+              help='Number of worker processes to shard subscriptions over')
+@click.option('--raw', is_flag=True,
+              help='Also send the raw packets back from the --workers '
+                   'processes, for collect --raw')
+@click.option('--stale-timeout', default=None, type=float,
+              help='Resubscribe websocket subscriptions that are silent for '
+                   'this many seconds. 0 disables, default from config.')
 @pass_state
-def listen(state, feed, exchange, assets, currencies, interval, channels):
+def listen(state, feed, exchange, assets, currencies, interval, channels,
+           max_channels, workers, raw, stale_timeout):
     'Listen to live events from a feed'
-    feed_client = Feed.factory(feed) 
-    subscriptions = feed_client.subscribe(assets, currencies, channels,
-                                          exchange=exchange, interval=interval)
+    requester = state['requester']
+    if requester is None:
+        # poll REST feeds without holding up the websockets
+        requester = 'async' if AsyncRequester.available() else 'base'
+    if workers>1:
+        pool = WorkerPool(feed=feed, workers=workers, requester=requester,
+                          cache_dir=state['cache_dir'], raw=raw)
+        subscriptions = pool.subscribe(assets, currencies, channels,
+                                       exchange=exchange, interval=interval,
+                                       max_channels=max_channels,
+                                       stale_timeout=stale_timeout)
+    else:
+        feed_client = Feed.factory(feed, max_channels=max_channels,
+                                   cache_dir=state['cache_dir'],
+                                   requester=requester)
+        subscriptions = feed_client.subscribe(assets, currencies, channels,
+                                              exchange=exchange,
+                                              interval=interval,
+                                              stale_timeout=stale_timeout)
     state['subscriptions'].update(subscriptions)
 
 
@@ -212,13 +345,17 @@ def listen(state, feed, exchange, assets, currencies, interval, channels):
 @click.option('--market', '-m', default='all')
 @click.option('--event', 'stream', flag_value='event', default=True)
 @click.option('--raw', 'stream', flag_value='raw')
+@click.option('--book', 'stream', flag_value='book',
+              help='Collect BookUpdates from an order book per market')
 @click.option('--collector', '-c', default='file', 
               type=click.Choice(Collector._get_subclasses().keys()))
 @click.option('--output', '-o', default='-', type=click.Path())
 @click.option('--filter', '-f', default='', type=str, multiple=True)
 @click.option('--type', '-t', default=None, multiple=True,
               type=click.Choice(['None', 'Trade', 'Heartbeat', 'LimitOrder',
-                                 'CancelOrder']))
+                                 'CancelOrder', 'Reconnect', 'Order',
+                                 'BookUpdate', 'TradeSnapshot',
+                                 'BookSnapshot']))
 @click.option('--text', 'format', flag_value='text', default=True)
 @click.option('--json', 'format', flag_value='json')
 @click.option('--interval', '-i', default=None, type=float)
@@ -226,18 +363,22 @@ def listen(state, feed, exchange, assets, currencies, interval, channels):
 def collect(state, market, stream, collector, filter, type, output, format, interval):
     'Collect events and write them to an output sink'
     subscriptions = state['subscriptions']
+    if market!='all':
+        subscriptions = {market: subscriptions[market]}
     if stream=='event':
-        stream_name = 'event_stream'
+        all_streams = [sub.event_stream for sub in subscriptions.values()]
     elif stream=='raw':
-        stream_name = 'raw_stream'
+        if any(isinstance(sub.client, WorkerPool) and not sub.client.raw
+               for sub in subscriptions.values()):
+            raise click.UsageError('collect --raw needs listen --raw to get '
+                                   'the raw packets from --workers')
+        all_streams = [sub.raw_stream for sub in subscriptions.values()]
+    elif stream=='book':
+        all_streams = [OrderBook(event_stream=sub.event_stream).book_stream
+                       for sub in subscriptions.values()]
     else:
         raise ValueError(stream)
-    if market=='all':
-        all_streams = [getattr(sub, stream_name) for sub in
-                       subscriptions.values()]
-        collect_stream = union(*all_streams)
-    else:
-        collect_stream = getattr(subscriptions[market], stream_name)
+    collect_stream = union(*all_streams)
     collector_name = collector
     collector = Collector.factory(collector_name, event_stream=collect_stream,
                                   path=output, format=format, types=type,
@@ -253,7 +394,7 @@ def collect(state, market, stream, collector, filter, type, output, format, inte
 def compare(state, collector, output, interval):
     'Compare prices events and write them to an output sink'
     subscriptions = state['subscriptions']
-    streams = [sub.event_stream.filter(lambda ev: isinstance(ev, PriceUpdate)) 
+    streams = [price_updates(sub.event_stream)
                for sub in subscriptions.values()]
     compare_stream = combine_latest(*streams).map(
         lambda trades: {(t.exchange+'--'+t.symbol):t.price for t in trades})
@@ -262,6 +403,71 @@ def compare(state, collector, output, interval):
                                   path=output, interval=interval)
 
 
+def price_updates(event_stream):
+    '''The PriceUpdates of event_stream, taking the latest Trade of every
+    TradeSnapshot'''
+    return event_stream.map(
+        lambda ev: ev.latest() if isinstance(ev, TradeSnapshot) else ev
+        ).filter(lambda ev: isinstance(ev, PriceUpdate))
+
+
+@coin.command()
+@click.option('--output', '-o', required=True, type=click.Path())
+@pass_state
+def record(state, output):
+    'Record the raw websocket traffic of the subscriptions to a file'
+    clients = []
+    for subscription in state['subscriptions'].values():
+        client = subscription.client
+        if not isinstance(client, WebsocketClient):
+            logger.warning(f'Can only record websocket subscriptions. '
+                           f'Skipping {subscription.market_name!r}.')
+        elif client not in clients:
+            clients.append(client)
+    state['recorder'] = Recorder(path=output, clients=clients)
+
+
+@coin.command()
+@click.option('--input', '-i', 'path', required=True,
+              type=click.Path(exists=True))
+@click.option('--speed', '-s', default=1.0, type=float,
+              help='Multiple of real time. 0 replays as fast as possible.')
+@pass_state
+def replay(state, path, speed):
+    'Replay a recording made with the record command'
+    replayer = Replayer(path=path, speed=speed)
+    state['subscriptions'].update(replayer.subscriptions)
+    asyncio.ensure_future(replayer.run())
+
+
+@coin.command()
+@click.option('--output', '-o', type=click.File('wt'), default='-')
+@click.option('--interval', '-i', default=None, type=float,
+              help='Seconds between dumps. Default is to dump on exit.')
+@pass_state
+def latency(state, output, interval):
+    'Dump the latency histograms of the websocket subscriptions'
+    def dump():
+        write(format_latency(latency_monitor.summary()), output)
+        output.flush()
+
+    async def dump_periodically():
+        while True:
+            await asyncio.sleep(interval)
+            dump()
+
+    if interval:
+        asyncio.ensure_future(dump_periodically())
+    atexit.register(dump)
+
+
+def format_latency(summary):
+    for key, stats in summary.items():
+        percentiles = ' '.join(f'{name}={stats[name]*1000:.3f}ms' for name in
+                               ('min', 'p50', 'p90', 'p99', 'max'))
+        yield f'{key} count={stats["count"]} {percentiles}'
+
+
 @coin.command()
 @click.option('--timeout', '-t', default=0)
 @pass_state
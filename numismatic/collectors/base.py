@@ -10,8 +10,18 @@ class Collector:
 
     def __attrs_post_init__(self):
         if self.types:
-            self.event_stream = self.event_stream.filter(
-                lambda ev: ev.__class__.__name__ in set(self.types))
+            self.event_stream = self.event_stream.filter(self._is_type)
+        if self.filters:
+            # the filters are expressions about a single event so they are
+            # applied to the rows of snapshots
+            self.event_stream = self.event_stream.map(
+                lambda ev: ev.rows() if hasattr(ev, 'rows') else [ev]).concat()
         for _filter in self.filters:
             self.event_stream = self.event_stream.filter(
-                lambda x: eval(_filter, attr.asdict(x)))
+                lambda x, _filter=_filter: eval(_filter, attr.asdict(x)))
+
+    def _is_type(self, event):
+        # a snapshot stands in for the rows of its row_type
+        row_type = getattr(event, 'row_type', None)
+        return event.__class__.__name__ in self.types or \
+            row_type is not None and row_type.__name__ in self.types
@@ -5,6 +5,8 @@ from functools import partial
 import attr
 
 from .base import Collector
+from ..events import Event
+from ..libs import codec
 
 
 @attr.s
@@ -15,6 +17,8 @@ class FileCollector(Collector):
     interval = attr.ib(default=None)
 
     def __attrs_post_init__(self):
+        # filter by type and expression first
+        super().__attrs_post_init__()
         # paths
         if self.path=='-':
             self._opener = lambda: sys.stdout
@@ -28,7 +32,8 @@ class FileCollector(Collector):
                 lambda ev: str(ev)+'\n')
         elif self.format=='json':
             self.event_stream = self.event_stream.map(
-                lambda ev: str(ev.json())+'\n')
+                lambda ev: (ev.json() if isinstance(ev, Event) else
+                            codec.dumps(ev))+'\n')
         else:
             raise NotImplementedError(f'format={self.format!r}')
         # construct data_stream
@@ -1,11 +1,13 @@
 import logging
 import sys
 from functools import partial
+from itertools import chain
 
 import attr
+from streamz import union
 
 from .base import Collector
-from ..events import OrderType, Trade, Order
+from ..events import OrderType, Trade, Order, TradeSnapshot, BookSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +23,9 @@ except ImportError:
 
 from sqlalchemy import create_engine, MetaData, Table, Column, Integer, \
     Float, String
-TYPE_MAPPING = {int:Integer, float:Float, str:String, OrderType:String}
+# attributes without a converter (e.g. sequence) are stored as strings
+TYPE_MAPPING = {int:Integer, float:Float, str:String, OrderType:String,
+                None:String}
 
 
 @attr.s
@@ -32,12 +36,14 @@ class SqlCollector(Collector):
     interval = attr.ib(default=None)
 
     def __attrs_post_init__(self):
+        # filter by type and expression first
+        super().__attrs_post_init__()
         engine = create_engine(self.path, echo=False)
 
         metadata = MetaData()
 
-        self._store_events_of_type(Trade, engine, metadata)
-        self._store_events_of_type(Order, engine, metadata)
+        self._store_events_of_type(Trade, engine, metadata, TradeSnapshot)
+        self._store_events_of_type(Order, engine, metadata, BookSnapshot)
 
     @staticmethod
     def _make_table_from_attrs(attrs_cls, table_name=None, metadata=None):
@@ -49,19 +55,26 @@ class SqlCollector(Collector):
         table_obj = Table(table_name, metadata, *columns)
         return table_obj
 
-    def _store_events_of_type(self, event_type, engine, metadata):
+    def _store_events_of_type(self, event_type, engine, metadata,
+                              snapshot_type=None):
         # filter events of the type
         event_type_stream = \
             self.event_stream.filter(lambda ev: isinstance(ev, event_type))
 
-        # construct data_stream
-        json_stream = event_type_stream.map(attr.asdict)
+        # construct a stream of lists of rows, snapshots are stored as the
+        # rows they contain in a single insert
+        json_stream = event_type_stream.map(lambda ev: [attr.asdict(ev)])
+        if snapshot_type is not None:
+            snapshot_stream = self.event_stream.filter(
+                lambda ev: isinstance(ev, snapshot_type))
+            json_stream = union(json_stream, snapshot_stream.map(
+                lambda snapshot: [attr.asdict(row) for row in snapshot.rows()]))
 
         if self.interval:
-            data_stream = json_stream.timed_window(interval=self.interval)
+            data_stream = json_stream.timed_window(interval=self.interval).map(
+                lambda batches: list(chain.from_iterable(batches)))
         else:
-            # ensure downstream receives lists rather than elements
-            data_stream = json_stream.partition(1)
+            data_stream = json_stream
 
         # create the necessary tables
         events_table = \
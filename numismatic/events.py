@@ -1,10 +1,11 @@
 import time
-import json     # TOOD: use a faster json library if necessary
 from enum import Enum
 import math
 
 import attr
 
+from .libs import codec
+
 
 class OrderType(str, Enum):
     TRADE = 'TRADE'
@@ -18,7 +19,8 @@ class OrderType(str, Enum):
 @attr.s
 class Event:
     def json(self):
-        return json.dumps(attr.asdict(self))
+        # events are flat so there is nothing for asdict to recurse into
+        return codec.dumps(attr.asdict(self, recurse=False))
 
 
 @attr.s(slots=True)
@@ -28,6 +30,14 @@ class Heartbeat(Event):
     timestamp = attr.ib(default=attr.Factory(time.time))
 
 
+@attr.s(slots=True)
+class Reconnect(Event):
+    exchange = attr.ib()
+    symbol = attr.ib()
+    attempts = attr.ib(default=1)
+    timestamp = attr.ib(default=attr.Factory(time.time))
+
+
 @attr.s(slots=True)
 class PriceUpdate(Event):
     exchange = attr.ib(convert=str)
@@ -68,3 +78,83 @@ class Order(Event):
     def _validate_id(self, attribute, value):
         if not value:
             self.id = self.price
+
+
+@attr.s(slots=True)
+class BookUpdate(Event):
+    exchange = attr.ib(convert=str)
+    symbol = attr.ib(convert=str)
+    best_bid = attr.ib(convert=float, default=math.nan)
+    bid_volume = attr.ib(convert=float, default=math.nan)
+    best_ask = attr.ib(convert=float, default=math.nan)
+    ask_volume = attr.ib(convert=float, default=math.nan)
+    timestamp = attr.ib(convert=float, default=attr.Factory(time.time))
+    sequence = attr.ib(default=None)
+
+
+@attr.s(slots=True)
+class Snapshot(Event):
+    '''A whole snapshot message as parallel columns
+
+    Emitting one Snapshot instead of an event per row keeps large snapshots
+    from stalling the event loop. rows() gives the equivalent per row events
+    for consumers that want them.
+    '''
+    exchange = attr.ib(convert=str)
+    symbol = attr.ib(convert=str)
+    prices = attr.ib(default=attr.Factory(list))
+    volumes = attr.ib(default=attr.Factory(list))
+    ids = attr.ib(default=attr.Factory(list))
+    sides = attr.ib(default=attr.Factory(list))
+    timestamp = attr.ib(convert=float, default=attr.Factory(time.time))
+    sequence = attr.ib(default=None)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def append(self, price, volume, id='', side='TRADE'):
+        self.prices.append(float(price))
+        self.volumes.append(float(volume))
+        self.ids.append(str(id))
+        self.sides.append(side)
+
+
+@attr.s(slots=True)
+class TradeSnapshot(Snapshot):
+    # the type of the events in rows()
+    row_type = Trade
+    # trades in a snapshot happened at different times
+    timestamps = attr.ib(default=attr.Factory(list))
+
+    def append(self, price, volume, id='', side='TRADE', timestamp=None):
+        Snapshot.append(self, price, volume, id, side)
+        self.timestamps.append(self.timestamp if timestamp is None else
+                               float(timestamp))
+
+    def rows(self):
+        for price, volume, id, side, timestamp in zip(
+                self.prices, self.volumes, self.ids, self.sides,
+                self.timestamps):
+            yield Trade(exchange=self.exchange, symbol=self.symbol,
+                        price=price, volume=volume, type=side,
+                        timestamp=timestamp, sequence=self.sequence, id=id)
+
+    def latest(self):
+        '''The most recent Trade of the snapshot or None if it is empty'''
+        return max(self.rows(), key=lambda trade: trade.timestamp,
+                   default=None)
+
+
+@attr.s(slots=True)
+class BookSnapshot(Snapshot):
+    '''The full order book, replacing any earlier state'''
+
+    row_type = Order
+
+    def rows(self):
+        for price, volume, id, side in zip(self.prices, self.volumes,
+                                           self.ids, self.sides):
+            yield Order(exchange=self.exchange, symbol=self.symbol,
+                        price=price, volume=volume, type=side,
+                        timestamp=self.timestamp, sequence=self.sequence,
+                        id=id)
@@ -2,11 +2,13 @@ import logging
 import time
 import asyncio
 import abc
+import random
 from pathlib import Path
 import gzip
 from itertools import product
 from functools import partial
-import json
+from collections import defaultdict
+import zlib
 
 from streamz import Stream
 import attr
@@ -15,13 +17,23 @@ from websockets.client import WebSocketClientProtocol
 
 from ..requesters import Requester
 from ..config import ConfigMixin
-from ..events import Event
+from ..events import Event, Reconnect, Trade, Order
+from ..libs import codec
+from ..libs.metrics import latency
+from ..libs.sequence import SequenceTracker, SequenceGap
+from ..libs.queues import PacketQueue
+from ..libs.watchdog import Watchdog
 
 logger = logging.getLogger(__name__)
 
 
 STOP_HANDLERS = object()        # sentinel to signal end of handler processing
 
+# Websocket clients shared by all Feeds, keyed by client class. Subscriptions
+# for an exchange are multiplexed onto these connections and a new one is only
+# opened once the existing ones have reached their channel limit.
+_websocket_client_pool = defaultdict(list)
+
 # TODO:
 #   * Websocket Client vs Subscription --> clarify and unify
 #   * Rename symbol to pair
@@ -44,6 +56,7 @@ class Subscription:
     raw_stream = attr.ib(default=attr.Factory(Stream))
     event_stream = attr.ib(default=attr.Factory(Stream))
     handlers = attr.ib(default=attr.Factory(list))
+    sequencer = attr.ib(default=None, repr=False)
 
     @property
     def market_name(self):
@@ -59,12 +72,16 @@ class Feed(abc.ABC, ConfigMixin):
 
     _rest_client_class = None
     _websocket_client_class = None
+    # channels that are polled through the rest client even though the feed
+    # has a websocket client
+    _rest_channels = ()
 
     rest_client = attr.ib(default=None)
     websocket_client = attr.ib(default=None)
     cache_dir = attr.ib(default=None)
     requester = attr.ib(default='base')
     websocket = attr.ib(default=None)
+    max_channels = attr.ib(default=None)
 
     @rest_client.validator
     def _rest_client_validator(self, attribute, value):
@@ -75,8 +92,45 @@ class Feed(abc.ABC, ConfigMixin):
     @websocket_client.validator
     def _websocket_client_validator(self, attribute, value):
         self.websocket_client = None if self._websocket_client_class is None \
-            else self._websocket_client_class()
-        
+            else self._get_websocket_client()
+
+    def _get_max_channels(self):
+        '''Channels allowed per connection
+
+        This is the smaller of the configured max_channels and the exchange's
+        own per connection limit. None means unlimited.
+        '''
+        limits = [self._websocket_client_class._max_channels]
+        max_channels = self.max_channels if self.max_channels is not None \
+            else self.get_config_item('max_channels')
+        if max_channels and int(max_channels) > 0:
+            limits.append(int(max_channels))
+        limits = [limit for limit in limits if limit]
+        return min(limits) if limits else None
+
+    def _get_websocket_client(self, symbol=None, channel=None):
+        '''Returns a pooled websocket client with a free channel
+
+        Only opens a new connection once all the pooled connections for this
+        exchange are at their channel limit, or already carry symbol on
+        channel, as when separate Feeds subscribe to the same market.
+        '''
+        max_channels = self._get_max_channels()
+        pool = _websocket_client_pool[self._websocket_client_class]
+        for client in pool:
+            if (max_channels is None or
+                    len(client.subscriptions) < max_channels) and \
+                    not (symbol and client._is_subscribed(symbol, channel)):
+                return client
+        logger.info(f'Opening websocket connection {len(pool)+1} for '
+                    f'{self._websocket_client_class.exchange} ...')
+        client = self._websocket_client_class(
+            queue_size=int(self.get_config_item('queue_size')),
+            overflow=self.get_config_item('overflow'),
+            snapshot_rows=self.get_config().getboolean('snapshot_rows'))
+        pool.append(client)
+        return client
+
     @staticmethod
     def get_symbol(asset, currency):
         return f'{asset}{currency}'
@@ -98,28 +152,59 @@ class Feed(abc.ABC, ConfigMixin):
         return
 
     def subscribe(self, assets, currencies, channels, exchange=None,
-                  interval=1.0):
+                  interval=1.0, shard=None, stale_timeout=None):
+        '''Subscribes to the channels for all asset/currency pairs
+
+        shard=(index, count) only subscribes to the pairs that hash to shard
+        index out of count, see numismatic.workers.
+
+        Websocket subscriptions that are silent for stale_timeout seconds
+        are resubscribed, see numismatic.libs.watchdog. 0 disables this.
+        '''
         assets = self._validate_parameter('assets', assets)
         currencies = self._validate_parameter('currencies', currencies)
         channels = self._validate_parameter('channels', channels)
+        if stale_timeout is None:
+            stale_timeout = float(self.get_config_item('stale_timeout'))
+        watchdog = Watchdog.get(stale_timeout) if stale_timeout>0 else None
         subscriptions = {}
-        for symbol, channel in product(self._get_pairs(assets, currencies),
-                                       channels):
-            if self._websocket_client_class is not None:
-                if self.websocket_client is None:
-                    self.websocket_client = self._websocket_client_class()
-                subscription = self.websocket_client.listen(symbol, channel)
+        for (asset, currency), channel in product(
+                product(assets, currencies), channels):
+            symbol = self.get_symbol(asset, currency)
+            if shard is not None and \
+                    self.get_shard(symbol, exchange, shard[1])!=shard[0]:
+                continue
+            if self._websocket_client_class is not None and \
+                    channel not in self._rest_channels:
+                websocket_client = self._get_websocket_client(symbol, channel)
+                subscription = websocket_client.listen(symbol, channel)
+                if watchdog is not None:
+                    watchdog.watch(subscription)
             elif self._rest_client_class is not None:
-                channel_method = getattr(self, f'get_{channel.lower()}')
-                rest_client = self._rest_client_class()
-                subscription = rest_client.listen(symbol, channel_method,
-                                                  interval=interval,
-                                                  exchange=exchange)
+                # prefer the non-blocking variant of the channel method
+                channel_method = \
+                    getattr(self, f'get_{channel.lower()}_async', None) or \
+                    getattr(self, f'get_{channel.lower()}')
+                subscription = self.rest_client.listen(symbol, channel_method,
+                                                       interval=interval,
+                                                       exchange=exchange,
+                                                       asset=asset,
+                                                       currency=currency)
             else:
                 raise ValueError('No listen() method found.')
             subscriptions[subscription.market_name] = subscription
         return subscriptions
 
+    @classmethod
+    def get_shard(cls, symbol, exchange, count):
+        '''Stable shard of a market
+
+        Uses crc32 rather than hash() which is salted differently in every
+        process.
+        '''
+        key = f'{cls.__name__}--{exchange}--{symbol}'
+        return zlib.crc32(key.encode()) % count
+
     @classmethod
     def _validate_parameter(cls, parameter, value):
         if not value:
@@ -142,28 +227,52 @@ class Feed(abc.ABC, ConfigMixin):
             yield cls.get_symbol(asset, currency)
 
 
+def _chunk_list(items, max_length):
+    '''Splits items into lists whose comma separated length <= max_length'''
+    chunk, length = [], -1
+    for item in items:
+        if chunk and length+1+len(item)>max_length:
+            yield chunk
+            chunk, length = [], -1
+        chunk.append(item)
+        length += 1+len(item)
+    if chunk:
+        yield chunk
+
+
+@attr.s
+class _Poll:
+    '''A REST subscription and when it is next due to be polled'''
+
+    subscription = attr.ib()
+    method = attr.ib()
+    interval = attr.ib(default=1.0)
+    due = attr.ib(default=0.0)
+
+
 @attr.s
 class RestClient(abc.ABC):
 
+    # maximum comma separated length of the assets and currencies in one
+    # request, None if the channel methods only take a single pair
+    _batch_limits = None
+
     cache_dir = attr.ib(default=None)
     requester = attr.ib(default='base')
     subscriptions = attr.ib(default=attr.Factory(list), repr=False)
+    _polls = attr.ib(default=attr.Factory(list), repr=False)
+    _poller = attr.ib(default=None, repr=False)
 
-    def listen(self, symbol, channel, interval=1.0, exchange=None):
+    def listen(self, symbol, channel, interval=1.0, exchange=None,
+               asset=None, currency=None):
         exchange = exchange if exchange else self.exchange
         channel_name = f'{exchange}--{symbol}--{channel.__name__}'
         logger.info(f'Subscribing to {channel_name} ...')
-        # timer
-
         # FIXME: get the symbol properly
-        # application
-        def _get_raw_channel():
-            messages = channel(symbol[:3], symbol[3:], exchange=exchange,
-                               raw=True)
-            packet = '\n'.join(json.dumps(msg) for msg in messages)
-            return packet
-
-        channel_info = {'channel': channel.__name__}
+        asset = asset if asset else symbol[:3]
+        currency = currency if currency else symbol[3:]
+        channel_info = {'channel': channel.__name__, 'asset': asset,
+                        'currency': currency}
         subscription = Subscription(exchange=exchange,
                                     symbol=symbol,
                                     channel='ticker',
@@ -172,9 +281,10 @@ class RestClient(abc.ABC):
                                     handlers=self._get_handlers(),
                                     )
         self.subscriptions.append(subscription)
-        asyncio.ensure_future(
-            self._listener(subscription, interval=interval,
-                           callback=_get_raw_channel))
+        self._polls.append(_Poll(subscription=subscription, method=channel,
+                                 interval=interval))
+        if self._poller is None:
+            self._poller = asyncio.ensure_future(self._poll())
         asyncio.ensure_future(subscription.start())
         logger.info(f'Subscribed to {channel_name} ...')
         return subscription
@@ -183,7 +293,7 @@ class RestClient(abc.ABC):
     def __handle_packet(packet, subscription):
         # most of the time we get json so only decode that once
         try:
-            msg = json.loads(packet)
+            msg = codec.loads(packet)
         except:
             msg = packet
             raise
@@ -210,22 +320,112 @@ class RestClient(abc.ABC):
                 if callable(getattr(cls, attr)) 
                 and attr.startswith('parse_')]
 
-    async def _listener(self, subscription, interval, callback):
-        while True:
+    async def _poll(self):
+        '''Polls the due subscriptions with as few requests as possible
+
+        Due subscriptions to the same channel method and exchange are
+        combined into multi-symbol requests, see _batch_polls(), and the
+        messages are routed back to each subscription by symbol.
+        '''
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                now = loop.time()
+                groups = {}
+                for poll in self._polls:
+                    if poll.due<=now:
+                        poll.due = now+poll.interval
+                        key = (poll.method.__name__,
+                               poll.subscription.exchange)
+                        groups.setdefault(key, []).append(poll)
+                await asyncio.gather(*(self._poll_group(polls)
+                                       for polls in groups.values()))
+                next_due = min(poll.due for poll in self._polls)
+                await asyncio.sleep(max(0, next_due-loop.time()))
+        except asyncio.CancelledError:
+            ## unsubscribe from all subscriptions
+            await asyncio.shield(asyncio.gather(
+                *(self._unsubscribe(subscription)
+                  for subscription in self.subscriptions)))
+            raise
+
+    async def _poll_group(self, polls):
+        method = polls[0].method
+        exchange = polls[0].subscription.exchange
+        for assets, currencies, batch in self._batch_polls(polls):
             try:
-                # FIXME: This should use an async requester as below
-                packet = callback()
-                self.__handle_packet(packet, subscription)
-                await asyncio.sleep(interval)
-            except asyncio.CancelledError:
-                ## unsubscribe from all subscriptions
-                confirmations = await asyncio.gather(
-                    asyncio.shield(self._unsubscribe(subscription)) 
-                    for subscription in self.subscriptions)
+                messages = await self._call_channel(method, assets,
+                                                    currencies, exchange)
             except Exception as ex:
-                logger.error(ex)
-                logger.error(packet)
-                raise
+                logger.error(f'{method.__name__}({assets}, {currencies}) '
+                             f'failed: {ex!r}')
+                continue
+            if self._batch_limits is None:
+                routed = {self._get_poll_symbol(batch[0]): messages}
+            else:
+                # a batched request also returns the pairs of its assets and
+                # currencies that nobody subscribed to
+                routed = defaultdict(list)
+                for msg in messages:
+                    routed[self._get_message_symbol(msg)].append(msg)
+            for poll in batch:
+                for msg in routed.get(self._get_poll_symbol(poll), ()):
+                    packet = codec.dumps(msg)
+                    try:
+                        self.__handle_packet(packet, poll.subscription)
+                    except Exception as ex:
+                        # skip the message rather than stop polling
+                        logger.error(ex)
+                        logger.error(packet)
+
+    @staticmethod
+    async def _call_channel(method, assets, currencies, exchange):
+        get_messages = partial(method, assets, currencies,
+                               exchange=exchange, raw=True)
+        if asyncio.iscoroutinefunction(method):
+            return await get_messages()
+        # keep blocking requests off the event loop
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, get_messages)
+
+    def _batch_polls(self, polls):
+        '''Yields (assets, currencies, polls) for each request to make
+
+        Without _batch_limits every subscription gets its own request.
+        Otherwise the assets and currencies are split into lists whose
+        comma separated lengths are within the limits, and every
+        combination of these lists is requested once.
+        '''
+        if self._batch_limits is None:
+            for poll in polls:
+                channel_info = poll.subscription.channel_info
+                yield ([channel_info['asset']], [channel_info['currency']],
+                       [poll])
+            return
+        max_assets, max_currencies = self._batch_limits
+        assets = sorted({poll.subscription.channel_info['asset']
+                         for poll in polls})
+        currencies = sorted({poll.subscription.channel_info['currency']
+                             for poll in polls})
+        for asset_chunk, currency_chunk in product(
+                _chunk_list(assets, max_assets),
+                _chunk_list(currencies, max_currencies)):
+            batch = [poll for poll in polls if
+                     poll.subscription.channel_info['asset'] in asset_chunk
+                     and poll.subscription.channel_info['currency']
+                     in currency_chunk]
+            if batch:
+                yield asset_chunk, currency_chunk, batch
+
+    @staticmethod
+    def _get_poll_symbol(poll):
+        channel_info = poll.subscription.channel_info
+        return channel_info['asset']+channel_info['currency']
+
+    @staticmethod
+    def _get_message_symbol(msg):
+        '''The asset+currency of a raw message from a batched request'''
+        raise NotImplementedError()
 
     async def _subscribe(self, subscription):
         pass
@@ -235,7 +435,7 @@ class RestClient(abc.ABC):
 
     @requester.validator
     def __requester_validator(self, attribute, value):
-        if isinstance(value, str):
+        if value is None or isinstance(value, str):
             requester = Requester.factory(value, cache_dir=self.cache_dir)
             setattr(self, attribute.name, requester)
         elif not isinstance(value, Requester):
@@ -249,23 +449,75 @@ class RestClient(abc.ABC):
             data = response
         return data
 
+    async def _make_request_async(self, api_url, params=None, headers=None,
+                                  raw=False):
+        response = await self.requester.get_async(api_url, params=params,
+                                                  headers=headers)
+        if not raw:
+            data = response.json()
+        else:
+            data = response
+        return data
+
 @attr.s
 class WebsocketClient(abc.ABC):
     '''Base class for WebsocketClient feeds'''
     # FIXME: Is this really an ABC? What abstractmethods are there?
 
+    # per connection channel limit imposed by the exchange, None if unlimited
+    _max_channels = None
+    # whether the exchange sequence numbers its messages, see _get_sequence()
+    _sequenced = False
+    # the events whose timestamp comes from the exchange rather than the
+    # local clock, see _record_latency()
+    _exchange_timestamps = (Trade, Order)
+
     exchange = attr.ib(default=None)
     websocket_url = attr.ib(default=None)
     websocket = attr.ib(default=None, repr=False)
     subscriptions = attr.ib(default=attr.Factory(list), repr=False)
+    # seconds to collect subscription requests before sending them together
+    subscribe_window = attr.ib(default=0.1)
+    # backoff between reconnection attempts in seconds
+    reconnect_delay = attr.ib(default=1.0)
+    max_reconnect_delay = attr.ib(default=60.0)
+    # bounded queue between the socket reader and the packet handlers
+    queue_size = attr.ib(default=10000)
+    overflow = attr.ib(default='block')
+    # emit snapshots as one event per row instead of a single Snapshot
+    snapshot_rows = attr.ib(default=False)
+    # set when replaying a recording, which can't send a fresh snapshot
+    # after a sequence gap, see numismatic.recording
+    replaying = attr.ib(default=False)
+    # routing index from exchange channel id to subscription
+    _channels = attr.ib(default=attr.Factory(dict), repr=False)
+    _pending = attr.ib(default=attr.Factory(dict), repr=False)
+    _queue = attr.ib(default=None, repr=False)
+    _tasks = attr.ib(default=attr.Factory(list), repr=False)
+    # (receive time, packet) for every packet read off the socket
+    packet_stream = attr.ib(default=attr.Factory(Stream), repr=False)
+    # receive time of the packet being handled, for latency measurements
+    _recv_time = attr.ib(default=None, repr=False)
 
     def __attrs_post_init__(self):
         if self.exchange is None:
             self.exchange = self.__class__.exchange
         if self.websocket_url is None:
             self.websocket_url = self.__class__.websocket_url
+        if self.overflow=='conflate' and self._sequenced:
+            # a conflated delta is a sequence gap and so a resync
+            raise ValueError(f'{self.exchange} is sequenced and can not use '
+                             f'overflow=conflate')
+        self._queue = PacketQueue(maxsize=self.queue_size,
+                                  overflow=self.overflow)
         asyncio.ensure_future(self._connect())
-        asyncio.ensure_future(self._listener())
+        self._tasks.append(asyncio.ensure_future(self._listener()))
+        self._tasks.append(asyncio.ensure_future(self._consumer()))
+
+    def close(self):
+        '''Stops listening, unsubscribing from all subscriptions'''
+        for task in self._tasks:
+            task.cancel()
 
     async def _connect(self):
         '''
@@ -283,6 +535,9 @@ class WebsocketClient(abc.ABC):
 
     # FIXME: Should this not be named subscribe?
     def listen(self, symbol, channel=None):
+        if self._is_subscribed(symbol, channel):
+            raise ValueError(f'{symbol.upper()!r} is already subscribed to '
+                             f'the {channel} channel of this connection')
         symbol = symbol.upper()
         # set up the subscription
         channel_info = {'channel': channel}
@@ -293,51 +548,285 @@ class WebsocketClient(abc.ABC):
                                     client=self,
                                     handlers=self._get_handlers(),
                                     )
+        if self._sequenced:
+            subscription.sequencer = SequenceTracker()
+        subscription.event_stream.sink(
+            partial(self._record_latency, subscription))
         self.subscriptions.append(subscription)
         asyncio.ensure_future(subscription.start())
         return subscription
 
+    def _is_subscribed(self, symbol, channel):
+        '''Whether symbol is already subscribed to channel
+
+        Messages are routed by their exchange channel so a connection can
+        only carry one subscription to each.
+        '''
+        symbol = symbol.upper()
+        channel = str(channel).lower()
+        return any(subscription.symbol==symbol and
+                   str(subscription.channel).lower()==channel
+                   for subscription in self.subscriptions)
+
+    @property
+    def sequence_stats(self):
+        '''Sequence tracking counters (gaps, out_of_order, ...) per market'''
+        return {subscription.market_name: dict(subscription.sequencer.stats)
+                for subscription in self.subscriptions
+                if subscription.sequencer is not None}
+
+    def _record_latency(self, subscription, event):
+        if self._recv_time is None or isinstance(event, Reconnect):
+            # not emitted in response to a packet
+            return
+        exchange_time = event.timestamp \
+            if isinstance(event, self._exchange_timestamps) else None
+        latency.record_emit(subscription.exchange, subscription.channel,
+                            self._recv_time, time.time(), exchange_time)
+
+    def _emit_snapshot(self, subscription, snapshot):
+        '''Emits a Snapshot, or its rows if snapshot_rows is set'''
+        if self.snapshot_rows:
+            for event in snapshot.rows():
+                subscription.event_stream.emit(event)
+        else:
+            subscription.event_stream.emit(snapshot)
+
+    @property
+    def queue_stats(self):
+        '''Packet queue depth and overflow counters'''
+        return dict(self._queue.stats, depth=len(self._queue),
+                    maxsize=self._queue.maxsize)
+
     async def _listener(self):
+        '''Reads packets off the socket into the packet queue'''
         await self._connect()
         while True:
             try:
                 packet = await self.websocket.recv()
-                self.__handle_packet(packet)
-            except websockets.exceptions.ConnectionClosed:
-                await self._connect()
+                await self._enqueue(packet)
+            except websockets.exceptions.ConnectionClosed as ex:
+                logger.warning(f'Connection to {self.websocket_url!r} '
+                               f'closed: {ex}')
+                await self._reconnect()
             except asyncio.CancelledError:
                 ## unsubscribe from all subscriptions
-                confirmations = await asyncio.gather(
-                    asyncio.shield(self._unsubscribe(subscription)) 
-                    for subscription in self.subscriptions)
+                await asyncio.shield(self._unsubscribe_all(self.subscriptions))
+                raise
             except Exception as ex:
                 logger.error(ex)
                 logger.error(packet)
                 raise
 
+    async def _enqueue(self, packet):
+        recv_time = time.time()
+        self.packet_stream.emit((recv_time, packet))
+        msg = key = None
+        if self._queue.overflow=='conflate':
+            # conflation needs the channel so decode here rather than later
+            try:
+                decode_start = time.perf_counter()
+                msg = codec.loads(packet)
+                latency.record_decode(self.exchange,
+                                      time.perf_counter()-decode_start)
+                key = self._get_conflation_key(msg)
+            except Exception as ex:
+                # skip the packet rather than stop the listener
+                logger.error(ex)
+                logger.error(packet)
+                return
+        await self._queue.put((recv_time, packet, msg), key=key)
+
+    async def _consumer(self):
+        '''Handles the packets from the packet queue'''
+        while True:
+            self._recv_time, packet, msg = await self._queue.get()
+            try:
+                self.__handle_packet(packet, msg)
+            except Exception as ex:
+                # skip the packet rather than stop every subscription
+                logger.error(ex)
+                logger.error(packet)
+
+    async def _reconnect(self):
+        '''Reconnects and replays all the subscriptions
+
+        Retries use exponential backoff with full jitter. Once connected, the
+        subscriptions get their handshake handlers re-installed through
+        _subscribe() and a Reconnect event is emitted on every event_stream so
+        that downstream state can be resynced.
+        '''
+        self.websocket = None
+        self._channels.clear()
+        attempts = 0
+        while True:
+            delay = min(self.max_reconnect_delay,
+                        self.reconnect_delay * 2**attempts)
+            delay = random.uniform(0, delay)
+            attempts += 1
+            logger.info(f'Reconnecting to {self.websocket_url!r} in '
+                        f'{delay:.2f}s (attempt {attempts}) ...')
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                logger.warning(f'Reconnect to {self.websocket_url!r} '
+                               f'failed: {ex}')
+                self.websocket = None
+        for subscription in self.subscriptions:
+            subscription.channel_info = {'channel': subscription.channel}
+            subscription.handlers = self._get_handlers()
+            if subscription.sequencer is not None:
+                subscription.sequencer.reset()
+            subscription.event_stream.emit(
+                Reconnect(exchange=subscription.exchange,
+                          symbol=subscription.symbol, attempts=attempts))
+        await asyncio.gather(*[self._subscribe(subscription)
+                               for subscription in self.subscriptions])
+
+    async def _resync(self, subscription):
+        '''Requests a fresh snapshot for subscription after a sequence gap'''
+        logger.warning(f'Resyncing {subscription.market_name!r} ...')
+        await self._unsubscribe(subscription)
+        subscription.channel_info = {'channel': subscription.channel}
+        subscription.handlers = self._get_handlers()
+        await self._subscribe(subscription)
+
     async def _subscribe(self, subscription):
         await self._connect()
 
     async def _unsubscribe(self, subscription):
         pass
 
-    def __handle_packet(self, packet):
+    async def _unsubscribe_all(self, subscriptions):
+        '''Unsubscribes from all subscriptions
+
+        Clients whose exchange accepts batched requests should override this
+        to send a single message.
+        '''
+        confirmations = await asyncio.gather(
+            *[self._unsubscribe(subscription)
+              for subscription in subscriptions])
+        return confirmations
+
+    async def _batch(self, kind, subscription, send_batch):
+        '''Collects requests of the same kind into batches
+
+        The first request of a kind waits for subscribe_window seconds and
+        then calls send_batch once with every subscription that was requested
+        in the meantime.
+        '''
+        pending = self._pending.setdefault(kind, [])
+        pending.append(subscription)
+        if len(pending)>1:
+            # the batch is already scheduled
+            return
+        await asyncio.sleep(self.subscribe_window)
+        batch = self._pending.pop(kind)
+        logger.info(f'Sending {kind} for {len(batch)} subscriptions ...')
+        await send_batch(batch)
+
+    @staticmethod
+    def _get_channel_id(msg):
+        '''Returns the exchange channel id of a decoded message or None
+
+        Subclasses override this so that packets can be routed straight to
+        the subscription registered for that channel.
+        '''
+        return None
+
+    def _get_conflation_key(self, msg):
+        '''Returns the key of msg for the conflate overflow policy or None
+
+        Only messages that carry the whole state of their channel, like
+        tickers, may replace an older queued message with the same key.
+        Deltas such as trades and order book updates must all be handled so
+        by default nothing is conflated.
+        '''
+        return None
+
+    @staticmethod
+    def _get_sequence(msg):
+        '''Returns the exchange sequence number of a decoded message or None'''
+        return None
+
+    @staticmethod
+    def _is_snapshot(msg):
+        '''Whether msg is a snapshot that the sequence numbers restart from'''
+        return False
+
+    def _register_channel(self, channel_id, subscription):
+        logger.debug(f'Routing channel {channel_id!r} to '
+                     f'{subscription.market_name!r}')
+        self._channels[channel_id] = subscription
+
+    def _unregister_channel(self, channel_id):
+        self._channels.pop(channel_id, None)
+
+    def _route(self, msg):
+        '''Returns the subscriptions that should handle msg
+
+        Messages for a known channel go to exactly one subscription. Anything
+        else (e.g. subscription handshakes) is offered to all subscriptions.
+        '''
+        channel_id = self._get_channel_id(msg)
+        if channel_id is not None and channel_id in self._channels:
+            return (self._channels[channel_id],)
+        return self.subscriptions
+
+    def __handle_packet(self, packet, msg=None):
         # most of the time we get json so only decode that once
-        try:
-            msg = json.loads(packet)
-        except:
-            msg = packet
-            raise
+        if msg is None:
+            decode_start = time.perf_counter()
+            try:
+                msg = codec.loads(packet)
+            except:
+                msg = packet
+                raise
+            latency.record_decode(self.exchange,
+                                  time.perf_counter()-decode_start)
         if not msg:
             return
-        for subscription in self.subscriptions:
-            for handler in subscription.handlers:
-                result = handler(msg, subscription)
-                if result is STOP_HANDLERS:
-                    # FIXME: should this raw_stream now rather sit on the
-                    # WebsocketClient instead of the Subscription?
-                    subscription.raw_stream.emit(packet)
-                    break
+        subscriptions = self._route(msg)
+        if len(subscriptions)==1:
+            self.__handle_sequenced(msg, packet, subscriptions[0])
+        else:
+            for subscription in subscriptions:
+                self.__handle_msg(msg, packet, subscription)
+
+    def __handle_sequenced(self, msg, packet, subscription):
+        # Only messages with a single destination are sequence checked.
+        # Snapshots pass straight through as their handlers reset the tracker.
+        sequencer = subscription.sequencer
+        sequence = None if sequencer is None else self._get_sequence(msg)
+        if sequence is None or self._is_snapshot(msg):
+            self.__handle_msg(msg, packet, subscription)
+            return
+        try:
+            ready = sequencer.process(sequence, (msg, packet))
+        except SequenceGap as gap:
+            logger.warning(f'{subscription.market_name}: {gap}')
+            if self.replaying:
+                # carry on with the rest of the recording unchecked
+                sequencer.reset()
+            else:
+                asyncio.ensure_future(self._resync(subscription))
+            return
+        for msg, packet in ready:
+            self.__handle_msg(msg, packet, subscription)
+
+    @staticmethod
+    def __handle_msg(msg, packet, subscription):
+        for handler in subscription.handlers:
+            result = handler(msg, subscription)
+            if result is STOP_HANDLERS:
+                # FIXME: should this raw_stream now rather sit on the
+                # WebsocketClient instead of the Subscription?
+                subscription.raw_stream.emit(packet)
+                break
 
     @classmethod
     def _get_handlers(cls):
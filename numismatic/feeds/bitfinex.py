@@ -1,13 +1,13 @@
 import logging
 import time
-import json
 
 from streamz import Stream
 import attr
 import websockets
 
 from .base import Feed, WebsocketClient, STOP_HANDLERS
-from ..events import Heartbeat, Trade
+from ..events import Heartbeat, Trade, TradeSnapshot
+from ..libs import codec
 
 logger = logging.getLogger(__name__)
 
@@ -16,20 +16,24 @@ logger = logging.getLogger(__name__)
 class BitfinexWebsocketClient(WebsocketClient):
     '''Websocket client for the Bitfinex WebsocketClient
 
-    This currently opens a separate socket for every symbol that we listen to.
-    This could probably be handled by having just one socket.
+    All subscriptions share one socket up to the exchange's channel limit,
+    see Feed._get_websocket_client().
     '''
 
     exchange = 'Bitfinex'
     websocket_url = 'wss://api.bitfinex.com/ws/2'
+    _max_channels = 25
 
-    @classmethod
-    def handle_connect(cls, msg, subscription):
-        connection_status = msg
-        logger.debug(connection_status)
-        subscription.handlers.remove(cls.handle_connect)
-        logger.info(f'Removed {cls.__name__}.handle_connect()')
-        return STOP_HANDLERS
+    # the info event sent on every (re)connection
+    connection_status = attr.ib(default=None, repr=False)
+
+    def _route(self, msg):
+        # the info event is about the connection, not any one subscription
+        if isinstance(msg, dict) and msg.get('event')=='info':
+            self.connection_status = msg
+            logger.debug(self.connection_status)
+            return ()
+        return super()._route(msg)
 
     async def _subscribe(self, subscription):
         await super()._subscribe(subscription)
@@ -37,31 +41,63 @@ class BitfinexWebsocketClient(WebsocketClient):
         # it needs to go through the main __handle_packet so the raw_stream is
         # updated.
         subscription.handlers = [self.__handle_subscribed]
-        msg = json.dumps(dict(event='subscribe',
-                              channel=subscription.channel, 
-                              symbol=subscription.symbol))
-        logger.info(msg)
-        await self.websocket.send(msg)
+        await self._batch('subscribe', subscription, self._send_subscribe)
         return subscription
 
+    async def _send_subscribe(self, subscriptions):
+        # Bitfinex only takes one channel per subscribe event so a batch goes
+        # out as one burst of messages before any confirmations are handled.
+        for subscription in subscriptions:
+            msg = codec.dumps(dict(event='subscribe',
+                                  channel=subscription.channel,
+                                  symbol=subscription.symbol))
+            logger.info(msg)
+            await self.websocket.send(msg)
+
+    @staticmethod
+    def _get_channel_id(msg):
+        if isinstance(msg, list) and msg:
+            return msg[0]
+
+    def _get_conflation_key(self, msg):
+        # ticker updates replace each other, heartbeats and trades don't
+        subscription = self._channels.get(self._get_channel_id(msg))
+        if subscription is not None and \
+                subscription.channel.lower()=='ticker' and \
+                isinstance(msg[1], list):
+            return msg[0]
+
     @staticmethod
     def __handle_subscribed(msg, subscription):
         if isinstance(msg, dict) and 'event' in msg and \
                 msg['event']=='subscribed' and \
-                msg['pair']==subscription.symbol:
+                msg['pair']==subscription.symbol and \
+                msg['channel'].lower()==subscription.channel.lower():
             subscription.channel_info = msg
             # TODO: Make the following a debug log message rather
             logger.info(subscription.channel_info)
+            subscription.client._register_channel(msg['chanId'], subscription)
             # install the proper handlers
             subscription.handlers = subscription.client._get_handlers()
             # stop processing other handlers
             return STOP_HANDLERS
 
     async def _unsubscribe(self, subscription):
-        msg = json.dumps(dict(event='unsubscribe', 
-                              chanId=subscription.channel_info['chanId']))
-        logger.info(msg)
-        await self.websocket.send(msg)
+        await self._unsubscribe_all([subscription])
+
+    async def _unsubscribe_all(self, subscriptions):
+        # as with subscribing, send all the unsubscribe events in one burst
+        for subscription in subscriptions:
+            if 'chanId' not in subscription.channel_info:
+                continue
+            # stop routing the channel now as a resync replaces channel_info
+            # before the confirmation arrives
+            self._unregister_channel(subscription.channel_info['chanId'])
+            subscription.handlers = [self.__handle_unsubscribed]
+            msg = codec.dumps(dict(event='unsubscribe',
+                                  chanId=subscription.channel_info['chanId']))
+            logger.info(msg)
+            await self.websocket.send(msg)
 
     @staticmethod
     def __handle_unsubscribed(msg, subscription):
@@ -70,6 +106,7 @@ class BitfinexWebsocketClient(WebsocketClient):
                 msg['chanId']==subscription.channel_info['chanId']:
             confirmation = msg
             logger.info(confirmation)
+            subscription.client._unregister_channel(msg['chanId'])
             # disable all handlers
             subscription.handlers = []
             # stop processing other handlers
@@ -78,7 +115,7 @@ class BitfinexWebsocketClient(WebsocketClient):
     async def _ping_pong(self):
         'Simple ping pong for testing the connection'
         # try ping-pong
-        msg = json.dumps({'event':'ping'})
+        msg = codec.dumps({'event':'ping'})
         await self.websocket.send(msg)
         pong = await self.websocket.recv()
         return pong
@@ -125,14 +162,12 @@ class BitfinexWebsocketClient(WebsocketClient):
                 msg[0]==subscription.channel_info['chanId'] and \
                 isinstance(msg[1], list):
             # snapshot
+            snapshot = TradeSnapshot(exchange=subscription.exchange,
+                                     symbol=subscription.symbol)
             for (trade_id, timestamp, volume, price) in reversed(msg[1]):
-                msg = Trade(exchange=subscription.exchange,
-                            symbol=subscription.symbol, 
-                            price=price, 
-                            volume=volume,
-                            timestamp=timestamp/1000,
-                            id=trade_id)
-                subscription.event_stream.emit(msg)
+                snapshot.append(price=price, volume=volume, id=trade_id,
+                                timestamp=timestamp/1000)
+            subscription.client._emit_snapshot(subscription, snapshot)
             # stop processing other handlers
             return STOP_HANDLERS
 
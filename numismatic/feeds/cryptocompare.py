@@ -1,17 +1,22 @@
 import math
 import logging
 import abc
+import atexit
 import time
-from datetime import timedelta
 from dateutil.parser import parse
 from itertools import product
+from pathlib import Path
 
 import attr
+from appdirs import user_cache_dir
 
 from .base import Feed, RestClient
 from ..events import PriceUpdate, Ticker
-from ..libs.utils import date_range, make_list_str, to_datetime, \
-    dates_and_frequencies
+from ..libs.backfill import Backfill, BackfillError
+from ..libs.columns import to_columns, rows_to_columns
+from ..libs.historystore import HistoryStore, SeriesKey, CANDLE_FIELDS
+from ..libs.utils import make_list_str, to_datetime, dates_and_frequencies
+from ..requesters import LIBRARY_NAME
 
 
 logger = logging.getLogger(__name__)
@@ -27,6 +32,46 @@ EXCHANGES = ('BTC38,BTCC,BTCE,BTER,Bit2C,Bitfinex,Bitstamp,Bittrex,CCEDK,'
              'LiveCoin,Coinone,Tidex,Bleutrade,EthexIndia'
              ).split(',')
 
+HISTORY_FILE_NAME = 'history.sqlite'
+
+# seconds per candle of the histo* endpoints by freq
+CANDLE_PERIODS = dict(d=86400, h=3600, m=60)
+# 2010-07-17, the earliest candles, from which allData requests start
+HISTORY_START = 1279324800
+
+class CryptoCompareError(Exception):
+    pass
+
+
+@attr.s
+class HistoryChunk:
+    '''One histo* request of a backfill
+
+    The request is for the candles of series opening from start_time to
+    end_time, in seconds since the epoch.
+    '''
+
+    series = attr.ib()
+    exchange = attr.ib()
+    start_time = attr.ib()
+    end_time = attr.ib()
+    period = attr.ib()
+    # request the whole history up to end_time, only histoday supports this
+    all_data = attr.ib(default=False)
+    # the (start_time, end_time) ranges missing from the store, the rest of
+    # the candles are already cached
+    gaps = attr.ib(default=attr.Factory(list), repr=False)
+
+    @property
+    def limit(self):
+        # CryptoCompare returns limit+1 candles up to and including toTs
+        return (self.end_time-self.start_time)//self.period
+
+    @property
+    def toTs(self):
+        return self.end_time
+
+
 @attr.s
 class CryptoCompareRestClient(RestClient):
     '''Low level API for CryptoCompare.com
@@ -36,6 +81,8 @@ class CryptoCompareRestClient(RestClient):
     '''
 
     exchange = 'CCCAGG'
+    # maximum lengths of the fsyms and tsyms parameters of the multi calls
+    _batch_limits = (300, 100)
     base_url = 'https://www.cryptocompare.com/api/data/'
     api_url = 'https://min-api.cryptocompare.com/data'
 
@@ -56,12 +103,25 @@ class CryptoCompareRestClient(RestClient):
                       e=e)
         return self._make_request(api_url, params)
 
+    async def get_price_multi_async(self, fsyms, tsyms, e=None):
+        api_url = f'{self.api_url}/pricemulti'
+        params = dict(fsyms=make_list_str(fsyms), tsyms=make_list_str(tsyms),
+                      e=e)
+        return await self._make_request_async(api_url, params)
+
     def get_price_multi_full(self, fsyms, tsyms, e=None, raw=False):
         api_url = f'{self.api_url}/pricemultifull'
         params = dict(fsyms=make_list_str(fsyms), tsyms=make_list_str(tsyms),
                       e=e)
         return self._make_request(api_url, params, raw=raw)
 
+    async def get_price_multi_full_async(self, fsyms, tsyms, e=None,
+                                         raw=False):
+        api_url = f'{self.api_url}/pricemultifull'
+        params = dict(fsyms=make_list_str(fsyms), tsyms=make_list_str(tsyms),
+                      e=e)
+        return await self._make_request_async(api_url, params, raw=raw)
+
     def get_price_historical(self, fsym, tsyms, ts, markets=None):
         api_url = f'{self.api_url}/pricehistorical'
         tsyms = make_list_str(tsyms)
@@ -71,7 +131,8 @@ class CryptoCompareRestClient(RestClient):
     def get_historical_day(self, fsym, tsym, e=None, limit=30, toTs=None,
                            allData=False):
         api_url = f'{self.api_url}/histoday'
-        params = dict(fsym=fsym, tsym=tsym, e=e, limit=limit, toTs=toTs)
+        params = dict(fsym=fsym, tsym=tsym, e=e, limit=limit, toTs=toTs,
+                      allData='true' if allData else None)
         return self._make_request(api_url, params)
 
     def get_historical_hour(self, fsym, tsym, e=None, limit=30, toTs=None):
@@ -86,10 +147,29 @@ class CryptoCompareRestClient(RestClient):
 
     def _make_request(self, api_url, params=None, raw=False):
         data = super()._make_request(api_url, params, raw=raw)
+        if not raw and isinstance(data, dict) and \
+                data.get('Response')=='Error':
+            # errors such as rate limiting still come back as 200 OK
+            raise CryptoCompareError(data.get('Message'))
         if 'Data' in data and not raw:
             data = data['Data']
         return data
 
+    async def _make_request_async(self, api_url, params=None, raw=False):
+        data = await super()._make_request_async(api_url, params, raw=raw)
+        if not raw and isinstance(data, dict) and \
+                data.get('Response')=='Error':
+            raise CryptoCompareError(data.get('Message'))
+        if 'Data' in data and not raw:
+            data = data['Data']
+        return data
+
+    @staticmethod
+    def _get_message_symbol(msg):
+        if 'FROMSYMBOL' in msg:
+            return msg['FROMSYMBOL']+msg['TOSYMBOL']
+        return msg['asset']+msg['currency']
+
     @staticmethod
     def parse_price(msg):
         if isinstance(msg, dict) and \
@@ -122,6 +202,8 @@ class CryptoCompareFeed(Feed):
     _interval_limit = 2000
     _rest_client_class = CryptoCompareRestClient
 
+    history_store = attr.ib(default=None, repr=False)
+
     def get_list(self):
         return self.rest_client.get_coinlist()
         return coinlist.keys()
@@ -138,6 +220,17 @@ class CryptoCompareFeed(Feed):
         # FIXME: SHouldn't use caching
         data = self.rest_client.get_price_multi(fsyms=assets, tsyms=currencies,
                                                 e=exchange)
+        return self._parse_prices(data, exchange, raw)
+
+    async def get_prices_async(self, assets, currencies, exchange=None,
+                               raw=False):
+        assets = self._validate_parameter('assets', assets)
+        currencies = self._validate_parameter('currencies', currencies)
+        data = await self.rest_client.get_price_multi_async(
+            fsyms=assets, tsyms=currencies, e=exchange)
+        return self._parse_prices(data, exchange, raw)
+
+    def _parse_prices(self, data, exchange=None, raw=False):
         exchange = exchange if exchange else self.rest_client.exchange
         prices = [{'exchange':exchange, 'asset':asset, 'currency':currency,
                    'price':price, }
@@ -154,44 +247,253 @@ class CryptoCompareFeed(Feed):
         data = self.rest_client.get_price_multi_full(fsyms=assets,
                                                      tsyms=currencies,
                                                      e=exchange)
+        return self._parse_tickers(data, raw)
+
+    async def get_tickers_async(self, assets, currencies, exchange=None,
+                                raw=False):
+        assets = self._validate_parameter('assets', assets)
+        currencies = self._validate_parameter('currencies', currencies)
+        data = await self.rest_client.get_price_multi_full_async(
+            fsyms=assets, tsyms=currencies, e=exchange)
+        return self._parse_tickers(data, raw)
+
+    def _parse_tickers(self, data, raw=False):
         tickers = [msg if raw else self.rest_client.parse_ticker(msg)
                   for asset, asset_updates in data['RAW'].items()
                   for currency, msg in asset_updates.items()]
         return tickers
 
     def get_historical_data(self, assets, currencies, freq='d', end_date=None,
-                            start_date=-30, exchange=None):
+                            start_date=-30, exchange=None, columnar=False):
+        '''Candles of every asset and currency from start_date to end_date
+
+        With the history_store config item set, candles are kept in a local
+        HistoryStore and only the ranges it doesn't cover yet are requested.
+
+        The candles are a list of dicts that include the asset and currency,
+        or with columnar=True a dict by (asset, currency) of dicts of NumPy
+        arrays by column, see libs.columns. Either way the whole range is
+        returned at once, use iter_historical_data() to stream it instead.
+        '''
+        series, start_time, end_time, period = self._get_history_series(
+            assets, currencies, freq, start_date, end_date, exchange)
+        store = self._get_history_store()
+        chunks = self._plan_series(series, exchange, start_time, end_time,
+                                   period, store)
+        # in time order so that the fetched candles need no sorting
+        chunks.sort(key=lambda chunk: chunk.start_time)
+        fetched = {key:[] for key in series}
+        for chunk, candles in self._backfill_history(chunks, period, store,
+                                                     ordered=True):
+            if store is None:
+                fetched[chunk.series].extend(candles)
+        if columnar:
+            data = {}
+            for key in series:
+                if store is None:
+                    columns = to_columns(fetched.pop(key))
+                else:
+                    columns = rows_to_columns(
+                        store.get_rows(key, start_time, end_time),
+                        CANDLE_FIELDS)
+                data[key.asset, key.currency] = columns
+            return data
+        data = []
+        for key in series:
+            if store is None:
+                candles = fetched.pop(key)
+            else:
+                candles = store.get(key, start_time, end_time)
+            data.extend(self._annotate_candles(key, candles))
+        return data
+
+    def iter_historical_data(self, assets, currencies, freq='d',
+                             end_date=None, start_date=-30, exchange=None):
+        '''Yields the candles of get_historical_data() a chunk at a time
+
+        Every chunk is a list of up to _interval_limit candle dicts of one
+        asset and currency, or the candles of one request. The assets and
+        currencies follow each other and their chunks are in time order,
+        with the candles already in the HistoryStore merged in between the
+        requested ones. Requests run ahead of the oldest unfinished one by
+        at most the max_ahead of the Backfill, so the memory used is bounded
+        by that rather than the range. If a request fails for good the
+        remaining candles are still yielded before BackfillError is raised.
+        '''
+        series, start_time, end_time, period = self._get_history_series(
+            assets, currencies, freq, start_date, end_date, exchange)
+        store = self._get_history_store()
+        chunks = self._plan_series(series, exchange, start_time, end_time,
+                                   period, store)
+        # the order in which the chunks are yielded
+        chunks.sort(key=lambda chunk: (series.index(chunk.series),
+                                       chunk.start_time))
+        next_time = {key: start_time for key in series}
+        step = self._interval_limit*period
+
+        def stored(key, end):
+            # the stored candles from the last yielded one up to end
+            start, next_time[key] = next_time[key], end+period
+            if store is None:
+                return
+            for chunk_start in range(start, end+1, step):
+                candles = store.get(key, chunk_start,
+                                    min(end, chunk_start+step-period))
+                if candles:
+                    yield self._annotate_candles(key, candles)
+
+        current = 0
+        failed = None
+        try:
+            for chunk, candles in self._backfill_history(chunks, period,
+                                                         store, ordered=True):
+                index = series.index(chunk.series)
+                for key in series[current:index]:
+                    yield from stored(key, end_time)
+                current = index
+                # the fetched candles of a chunk replace the stored ones
+                yield from stored(chunk.series, chunk.start_time-period)
+                yield self._annotate_candles(chunk.series, candles)
+                next_time[chunk.series] = chunk.end_time+period
+        except BackfillError as ex:
+            failed = ex
+        for key in series[current:]:
+            yield from stored(key, end_time)
+        if failed is not None:
+            raise failed
+
+    def plan_historical_data(self, assets, currencies, freq='d',
+                             end_date=None, start_date=-30, exchange=None):
+        '''The HistoryChunks get_historical_data() would request'''
+        series, start_time, end_time, period = self._get_history_series(
+            assets, currencies, freq, start_date, end_date, exchange)
+        return self._plan_series(series, exchange, start_time, end_time,
+                                 period, self._get_history_store())
+
+    def _get_history_series(self, assets, currencies, freq, start_date,
+                            end_date, exchange=None):
+        '''The SeriesKeys, candle time range and period of a history call'''
         assets = self._validate_parameter('assets', assets)
         currencies = self._validate_parameter('currencies', currencies)
+        if freq not in CANDLE_PERIODS:
+            raise NotImplementedError(f'freq={freq}')
         start_date, end_date, freqstr, intervals = \
             dates_and_frequencies(start_date, end_date, freq)
-        limit = min(intervals, self._interval_limit)
-        dates = date_range(start_date, end_date, **{freqstr:limit})
+        period = CANDLE_PERIODS[freq]
+        start_time = math.floor(start_date.timestamp()/period)*period
+        end_time = math.floor(end_date.timestamp()/period)*period
+        series = [SeriesKey(feed=type(self).__name__,
+                            exchange=exchange if exchange else
+                            self.rest_client.exchange,
+                            asset=asset.upper(), currency=currency.upper(),
+                            freq=freq)
+                  for asset, currency in product(assets, currencies)]
+        return series, start_time, end_time, period
 
-        data = []
-        for asset, currency, (start, end) in \
-                product(assets, currencies, zip(dates[:-1], dates[1:])):
-            asset = asset.upper()
-            currency = currency.upper()
-            toTs = math.ceil(end.timestamp())
-            limit = math.ceil((end-start)/timedelta(**{freqstr:1}))
-            logger.debug(f'Getting {asset}/{currency} for {limit}{freqstr} to {end}')
-            time.sleep(1/4)   # max 4 requests per second
-            if freq.startswith('m'):
-                chunk = self.rest_client.get_historical_minute(
-                    fsym=asset, tsym=currency, e=exchange, limit=limit,
-                    toTs=toTs)
-            elif freq.startswith('h'):
-                chunk = self.rest_client.get_historical_hour(
-                    fsym=asset, tsym=currency, e=exchange, limit=limit,
-                    toTs=toTs)
-            elif freq.startswith('d'):
-                chunk = self.rest_client.get_historical_day(
-                    fsym=asset, tsym=currency, e=exchange, limit=limit,
-                    toTs=toTs)
-            else:
-                raise NotImplementedError(f'freq={freq}')
-            annotated_chunk = [{**{'asset':asset, 'currency':currency},
-                                **item} for item in chunk]
-            data.extend(annotated_chunk)
-        return data
+    def _backfill_history(self, chunks, period, store=None, ordered=False):
+        '''Yields (HistoryChunk, candles) for the planned chunks
+
+        The chunks are fetched concurrently and yielded as they complete, or
+        in their order with ordered=True, see Backfill.run(). They are also
+        merged into the store, if there is one.
+        '''
+        # the latest candle is still open and may change
+        last_closed = math.floor(time.time()/period)*period-period
+        logger.info(f'Requesting {len(chunks)} chunks for '
+                    f'{len({chunk.series for chunk in chunks})} series')
+        backfill = Backfill(
+            fetch=self._get_history_chunk,
+            max_workers=self.get_config_item('backfill_workers'),
+            retries=self.get_config_item('backfill_retries'))
+        for chunk, candles in backfill.run(chunks, ordered=ordered):
+            if store is not None:
+                store.put(chunk.series, candles, chunk.start_time,
+                          min(chunk.end_time, last_closed), period)
+            yield chunk, candles
+
+    @staticmethod
+    def _annotate_candles(series, candles):
+        return [{**{'asset':series.asset, 'currency':series.currency},
+                 **candle} for candle in candles]
+
+    def _plan_series(self, series, exchange, start_time, end_time, period,
+                     store=None):
+        return [chunk for key in series for chunk in self._plan_history(
+                    key, exchange, start_time, end_time, period, store)]
+
+    def _plan_history(self, series, exchange, start_time, end_time, period,
+                      store=None):
+        '''The fewest HistoryChunks that request every missing candle
+
+        Working back from the latest missing candle, every chunk requests up
+        to _interval_limit candles ending at that candle. A chunk may span
+        several gaps in the store and so re-request the cached candles
+        between them. Daily candles are requested in one go with allData
+        instead if that returns no more candles than the chunks could. The
+        allData candles are estimated from HISTORY_START as the first candle
+        of the series is not known beforehand.
+
+        Every series is requested at its own frequency as the candles of the
+        other endpoints can't stand in for each other.
+        '''
+        gaps = [(start_time, end_time)] if store is None else \
+            store.gaps(series, start_time, end_time, period)
+        window = (self._interval_limit-1)*period
+        chunks = []
+        while gaps:
+            chunk_end = gaps[-1][1]
+            window_start = chunk_end-window
+            chunk_gaps = []
+            while gaps and gaps[-1][1]>=window_start:
+                gap_start, gap_end = gaps.pop()
+                if gap_start<window_start:
+                    # the rest of the gap goes in the next chunk
+                    gaps.append((gap_start, window_start-period))
+                chunk_start = max(gap_start, window_start)
+                chunk_gaps.insert(0, (chunk_start, gap_end))
+            chunks.append(HistoryChunk(series=series, exchange=exchange,
+                                       start_time=chunk_start,
+                                       end_time=chunk_end, period=period,
+                                       gaps=chunk_gaps))
+        all_data_candles = \
+            (chunks[0].end_time-HISTORY_START)//period+1 if chunks else 0
+        if series.freq=='d' and len(chunks)>1 and \
+                all_data_candles<=len(chunks)*self._interval_limit:
+            chunks = [HistoryChunk(series=series, exchange=exchange,
+                                   start_time=chunks[-1].start_time,
+                                   end_time=chunks[0].end_time, period=period,
+                                   all_data=True,
+                                   gaps=[gap for chunk in reversed(chunks)
+                                         for gap in chunk.gaps])]
+        return chunks
+
+    def _get_history_chunk(self, chunk):
+        '''Fetches the candles of one HistoryChunk'''
+        series = chunk.series
+        logger.debug(f'Getting {series.asset}/{series.currency} for '
+                     f'{chunk.limit+1}{series.freq} to {chunk.toTs}')
+        get_historical = {'m': self.rest_client.get_historical_minute,
+                          'h': self.rest_client.get_historical_hour,
+                          'd': self.rest_client.get_historical_day,
+                          }[series.freq]
+        if chunk.all_data:
+            data = get_historical(fsym=series.asset, tsym=series.currency,
+                                  e=chunk.exchange, toTs=chunk.toTs,
+                                  allData=True)
+        else:
+            data = get_historical(fsym=series.asset, tsym=series.currency,
+                                  e=chunk.exchange, limit=chunk.limit,
+                                  toTs=chunk.toTs)
+        # newer responses have more fields than the candles in the store
+        return [{field: candle[field] for field in CANDLE_FIELDS}
+                for candle in data
+                if chunk.start_time<=candle['time']<=chunk.end_time]
+
+    def _get_history_store(self):
+        if self.history_store is None and \
+                self.get_config().getboolean('history_store'):
+            cache_dir = Path(self.cache_dir if self.cache_dir else
+                             user_cache_dir(LIBRARY_NAME))
+            self.history_store = HistoryStore(cache_dir / HISTORY_FILE_NAME)
+            atexit.register(self.history_store.close)
+        return self.history_store
@@ -1,91 +1,231 @@
 import logging
-import json
 import time
-from datetime import datetime
 
 from streamz import Stream
 import attr
 import websockets
 
 from .base import Feed, WebsocketClient, STOP_HANDLERS
-from ..events import Heartbeat, Trade
+from ..events import Heartbeat, Trade, Order, BookSnapshot
+from ..libs import codec
+from ..libs.utils import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+# the channel that sends each type of message
+MESSAGE_CHANNELS = {
+    'ticker': 'ticker',
+    'heartbeat': 'heartbeat',
+    'match': 'matches',
+    'last_match': 'matches',
+    'snapshot': 'level2',
+    'l2update': 'level2',
+    'received': 'full',
+    'open': 'full',
+    'done': 'full',
+    'change': 'full',
+    'activate': 'full',
+}
+
+# the messages that report a trade
+TRADE_TYPES = {'ticker', 'match', 'last_match'}
+
 
 @attr.s
 class GDAXWebsocketClient(WebsocketClient):
     '''Websocket client for the GDAX WebsocketClient
 
-    This currently opens a separate socket for every symbol that we listen to.
-    This could probably be handled by having just one socket.
+    All subscriptions share one socket, see Feed._get_websocket_client().
     '''
 
     exchange = 'GDAX'
     websocket_url = 'wss://ws-feed.gdax.com'
+    _exchange_timestamps = (Trade, Order, Heartbeat)
 
     async def _subscribe(self, subscription):
         await super()._subscribe(subscription)
         # install only the subscriptions handler
         subscription.handlers = [self.__handle_subscriptions]
-        channels = ['ticker'] if subscription.channel=='TRADES' else \
-            [subscription.channel]
-        msg = dict(type='subscribe', product_ids=[subscription.symbol],
-                   channels=channels)
-        packet = json.dumps(msg)
+        await self._batch('subscribe', subscription, self._send_subscribe)
+        return subscription
+
+    def _is_subscribed(self, symbol, channel):
+        # e.g. TRADES and MATCHES are the same channel
+        key = (self._get_channel_name(channel), symbol.upper())
+        return any(self._get_channel_key(subscription)==key
+                   for subscription in self.subscriptions)
+
+    @staticmethod
+    def _get_channel_name(channel):
+        # trades are reported on the matches channel
+        return 'matches' if channel=='TRADES' else channel.lower()
+
+    @classmethod
+    def _get_channels(cls, subscription):
+        # the heartbeat channel keeps quiet markets visibly alive, see
+        # numismatic.libs.watchdog
+        return [cls._get_channel_name(subscription.channel), 'heartbeat']
+
+    @classmethod
+    def _make_request_msg(cls, msg_type, subscriptions):
+        '''Combines the subscriptions into a single subscribe/unsubscribe
+
+        GDAX accepts a list of product_ids per channel so that all the
+        subscriptions can go out in one message.
+        '''
+        product_ids = {}
+        for subscription in subscriptions:
+            for channel in cls._get_channels(subscription):
+                symbols = product_ids.setdefault(channel, [])
+                # products subscribed on several channels share a heartbeat
+                if subscription.symbol not in symbols:
+                    symbols.append(subscription.symbol)
+        channels = [dict(name=channel, product_ids=symbols)
+                    for channel, symbols in product_ids.items()]
+        return dict(type=msg_type, channels=channels)
+
+    async def _send_subscribe(self, subscriptions):
+        packet = codec.dumps(self._make_request_msg('subscribe', subscriptions))
         logger.info(packet)
         await self.websocket.send(packet)
-        return subscription
+
+    @staticmethod
+    def _get_channel_id(msg):
+        # a product can be subscribed to on several channels
+        if isinstance(msg, dict) and 'product_id' in msg:
+            return (MESSAGE_CHANNELS.get(msg.get('type')), msg['product_id'])
+
+    @classmethod
+    def _get_channel_key(cls, subscription):
+        return (cls._get_channels(subscription)[0], subscription.symbol)
+
+    def _route(self, msg):
+        '''Returns the subscriptions that should handle msg
+
+        Product messages go to the subscription of their channel. Others,
+        such as heartbeats, go to all the subscriptions of the product.
+        Messages without a product (e.g. subscription handshakes) are
+        offered to all subscriptions.
+        '''
+        channel_id = self._get_channel_id(msg)
+        if channel_id is None:
+            return self.subscriptions
+        if channel_id in self._channels:
+            return (self._channels[channel_id],)
+        return tuple(subscription for (channel, product_id), subscription
+                     in self._channels.items() if product_id==channel_id[1])
 
     @staticmethod
     def __handle_subscriptions(msg, subscription):
         if isinstance(msg, dict) and 'type' in msg and \
                 msg['type']=='subscriptions':
-            channel_info = msg
+            # the reply lists all subscribed channels so only pick out the
+            # ones confirming this subscription
+            client = subscription.client
+            channels = [dict(name=channel['name'],
+                             product_ids=[subscription.symbol])
+                        for channel in msg['channels']
+                        if channel['name'] in client._get_channels(subscription)
+                        and subscription.symbol in channel['product_ids']]
+            if not channels:
+                return
+            channel_info = dict(type=msg['type'], channels=channels)
             logger.info(channel_info)
             subscription.channel_info.update(channel_info)
+            client._register_channel(client._get_channel_key(subscription),
+                                     subscription)
             # install the proper handlers
-            subscription.handlers = subscription.client._get_handlers()
+            subscription.handlers = client._get_handlers()
             # stop processing other handlers
             return STOP_HANDLERS
 
     async def _unsubscribe(self, subscription):
-        channel_info = subscription.channel_info
-        symbols = {symbol for channel in channel_info['channels'] 
-                   for symbol in channel['product_ids']}
-        channels = [channel['name'] for channel in channel_info['channels']]
-        msg = dict(type='unsubscribe', product_ids=list(symbols),
-                   channels=channels)
-        packet = json.dumps(msg)
-        logger.info(msg)
-        await self.websocket.send(msg)
-        while True:
-            packet = await self.websocket.recv()
-            msg = self._handle_packet(packet, subscription)
-            break
-        return msg
+        await self._unsubscribe_all([subscription])
+
+    async def _unsubscribe_all(self, subscriptions):
+        subscriptions = [subscription for subscription in subscriptions
+                         if 'channels' in subscription.channel_info]
+        if not subscriptions:
+            return
+        for subscription in subscriptions:
+            self._unregister_channel(self._get_channel_key(subscription))
+        msg = self._make_request_msg('unsubscribe', subscriptions)
+        # the subscriptions that stay may share channels, e.g. the heartbeat
+        # of their product, with the ones that go
+        unsubscribed = set(map(id, subscriptions))
+        shared = {(channel, subscription.symbol)
+                  for subscription in self.subscriptions
+                  if id(subscription) not in unsubscribed and
+                  'channels' in subscription.channel_info
+                  for channel in self._get_channels(subscription)}
+        channels = [dict(channel, product_ids=[
+                        product_id for product_id in channel['product_ids']
+                        if (channel['name'], product_id) not in shared])
+                    for channel in msg['channels']]
+        msg['channels'] = [channel for channel in channels
+                           if channel['product_ids']]
+        if not msg['channels']:
+            return
+        packet = codec.dumps(msg)
+        logger.info(packet)
+        await self.websocket.send(packet)
+
+    @staticmethod
+    def handle_book_snapshot(msg, subscription):
+        if 'type' in msg and msg['type']=='snapshot':
+            # the level2 channel sends the whole book once it is subscribed
+            snapshot = BookSnapshot(exchange=subscription.exchange,
+                                    symbol=subscription.symbol)
+            for side, levels in (('BID', msg['bids']), ('ASK', msg['asks'])):
+                for price, volume in levels:
+                    snapshot.append(price=price, volume=volume, side=side)
+            subscription.client._emit_snapshot(subscription, snapshot)
+            # stop processing other handlers
+            return STOP_HANDLERS
+
+    @staticmethod
+    def handle_book_update(msg, subscription):
+        if 'type' in msg and msg['type']=='l2update':
+            # each change is the new volume of a price level, so the price
+            # is the id of the Order, and a volume of 0 removes the level
+            timestamp = parse_timestamp(msg['time']) if 'time' in msg \
+                else time.time()
+            for side, price, volume in msg['changes']:
+                event = Order(exchange=subscription.exchange,
+                              symbol=subscription.symbol,
+                              price=price,
+                              volume=volume,
+                              type='BID' if side=='buy' else 'ASK',
+                              timestamp=timestamp)
+                subscription.event_stream.emit(event)
+            # stop processing other handlers
+            return STOP_HANDLERS
 
     @staticmethod
     def handle_heartbeat(msg, subscription):
         if 'type' in msg and msg['type']=='heartbeat':
-            event = Heartbeat(exchange=subscription.exchange, 
-                              symbol=subscription, timestamp=timestamp)
+            timestamp = parse_timestamp(msg['time']) if 'time' in msg \
+                else time.time()
+            event = Heartbeat(exchange=subscription.exchange,
+                              symbol=subscription.symbol, timestamp=timestamp)
             subscription.event_stream.emit(event)
             # stop processing other handlers
             return STOP_HANDLERS
 
     @staticmethod
     def handle_trade(msg, subscription):
-        if 'type' in msg and msg['type']=='ticker' and 'trade_id' in msg:
+        # tickers also carry the trade that caused them
+        if 'type' in msg and msg['type'] in TRADE_TYPES and 'trade_id' in msg:
             if 'product_id' in msg:
                 symbol = msg['product_id'].replace('-', '')
             if 'time' in msg:
-                dt = datetime.strptime(msg['time'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                timestamp = dt.timestamp()
+                timestamp = parse_timestamp(msg['time'])
+            volume = msg['size'] if 'size' in msg else \
+                msg['last_size'] if 'last_size' in msg else 0
             msg = Trade(exchange=subscription.exchange,
                         symbol=symbol, 
                         price=msg['price'],
-                        volume=msg['last_size'] if 'last_size' in msg else 0,
+                        volume=volume,
                         type=msg['side'].upper(),
                         timestamp=timestamp,
                         id=msg['trade_id'],
@@ -1,14 +1,17 @@
 from itertools import product
 import logging
-import json
+import math
 import time
+import asyncio
 
 import attr
 import websockets
 
-from ..events import Heartbeat, Trade, Order
+from ..events import Heartbeat, Trade, Order, BookSnapshot, PriceUpdate, \
+    Ticker
 from .base import Feed, RestClient, WebsocketClient, STOP_HANDLERS
 from ..config import config_item_getter
+from ..libs import codec
 
 
 logger = logging.getLogger(__name__)
@@ -16,7 +19,10 @@ logger = logging.getLogger(__name__)
 
 class LunoRestClient(RestClient):
 
+    exchange = 'Luno'
     api_url = 'https://api.mybitx.com/api/1/'
+    # the tickers of all pairs come back from a single call
+    _batch_limits = (math.inf, math.inf)
 
     api_key_id = attr.ib(default=attr.Factory(
         config_item_getter('LunoFeed', 'api_key_id')))
@@ -28,6 +34,38 @@ class LunoRestClient(RestClient):
         data = self._make_request(api_url)
         return data['tickers']
 
+    async def get_tickers_async(self):
+        api_url = f'{self.api_url}/tickers'
+        data = await self._make_request_async(api_url)
+        return data['tickers']
+
+    @staticmethod
+    def _get_message_symbol(msg):
+        return msg['pair']
+
+    @staticmethod
+    def parse_price(msg):
+        if isinstance(msg, dict) and \
+                set(msg)=={'exchange', 'pair', 'price'}:
+            event = PriceUpdate(exchange=msg['exchange'],
+                                symbol=msg['pair'],
+                                price=msg['price'])
+            return event
+
+    @classmethod
+    def parse_ticker(cls, msg):
+        if isinstance(msg, dict) and \
+                {'pair', 'last_trade', 'bid', 'ask',
+                 'rolling_24_hour_volume'} <= set(msg):
+            event = Ticker(exchange=cls.exchange,
+                           symbol=msg['pair'],
+                           price=msg['last_trade'],
+                           best_bid=msg['bid'],
+                           best_ask=msg['ask'],
+                           volume_24h=msg['rolling_24_hour_volume'],
+                           )
+            return event
+
 
 @attr.s
 class LunoWebsocketClient(WebsocketClient):
@@ -36,47 +74,72 @@ class LunoWebsocketClient(WebsocketClient):
     '''
     exchange = 'Luno'
     websocket_url = 'wss://ws.luno.com/api/1/stream'
+    # the stream url is per pair so every pair needs its own connection
+    _max_channels = 1
+    _sequenced = True
+    _exchange_timestamps = (Trade, Order, BookSnapshot)
 
     api_key_id = attr.ib(default=attr.Factory(
         config_item_getter('LunoFeed', 'api_key_id')))
     api_key_secret = attr.ib(default=attr.Factory(
         config_item_getter('LunoFeed', 'api_key_secret')), repr=False)
 
-    def listen(self, symbol, channel=None, websocket_url=None):
-        if websocket_url is None:
-            websocket_url = self.websocket_url
-        websocket_url = f'{websocket_url}/{symbol}'
-        return super().listen(symbol, channel, websocket_url)
+    # set by listen() once the pair, and so the stream url, is known
+    _listening = attr.ib(default=attr.Factory(asyncio.Event), repr=False)
+
+    def listen(self, symbol, channel=None):
+        if self.subscriptions:
+            raise ValueError(f'{self.exchange} streams only one pair per '
+                             f'connection')
+        self.websocket_url = f'{self.websocket_url}/{symbol.upper()}'
+        self._listening.set()
+        return super().listen(symbol, channel)
+
+    async def _connect(self):
+        # the stream url is per pair so wait for listen() before connecting
+        await self._listening.wait()
+        await super()._connect()
 
     async def _subscribe(self, subscription):
         await super()._subscribe(subscription)
         credentials = dict(api_key_id=self.api_key_id,
                            api_key_secret=self.api_key_secret)
-        await self.websocket.send(json.dumps(credentials))
+        await self.websocket.send(codec.dumps(credentials))
         subscription.handlers = [self._handle_order_book]
 
+    @staticmethod
+    def _get_sequence(msg):
+        if isinstance(msg, dict) and 'sequence' in msg:
+            return int(msg['sequence'])
+
+    @staticmethod
+    def _is_snapshot(msg):
+        return isinstance(msg, dict) and 'asks' in msg and 'bids' in msg
+
+    async def _resync(self, subscription):
+        # Luno only sends the order book snapshot when the stream is opened so
+        # reconnect and let _reconnect() resubscribe
+        logger.warning(f'Resyncing {subscription.market_name!r} ...')
+        await self.websocket.close()
+
     @staticmethod
     def _handle_order_book(msg, subscription):
-        if 'asks' in msg:
-            for order in msg['asks']:
-                order_ev = Order(exchange=subscription.exchange,
-                                 symbol=subscription.symbol,
-                                 price=order['price'],
-                                 volume=order['volume'],
-                                 type='SELL',
-                                 id=order['id'], 
-                                 )
-                subscription.event_stream.emit(order_ev)
-        if 'bids' in msg:
-            for order in msg['bids']:
-                order_ev = Order(exchange=subscription.exchange,
-                                 symbol=subscription.symbol,
-                                 price=order['price'],
-                                 volume=order['volume'],
-                                 type='BUY',
-                                 id=order['id'], 
-                                 )
-                subscription.event_stream.emit(order_ev)
+        if 'sequence' in msg and subscription.sequencer is not None:
+            subscription.sequencer.reset(int(msg['sequence']))
+        if 'asks' in msg or 'bids' in msg:
+            timestamp = float(msg['timestamp'])/1000 if 'timestamp' in msg \
+                else time.time()
+            snapshot = BookSnapshot(exchange=subscription.exchange,
+                                    symbol=subscription.symbol,
+                                    timestamp=timestamp,
+                                    sequence=msg.get('sequence'))
+            for order in msg.get('asks', []):
+                snapshot.append(price=order['price'], volume=order['volume'],
+                                id=order['id'], side='SELL')
+            for order in msg.get('bids', []):
+                snapshot.append(price=order['price'], volume=order['volume'],
+                                id=order['id'], side='BUY')
+            subscription.client._emit_snapshot(subscription, snapshot)
         if 'asks' in msg and 'bids' in msg:
             # restore normal handlers
             subscription.handlers = subscription.client._get_handlers()
@@ -84,8 +147,6 @@ class LunoWebsocketClient(WebsocketClient):
 
     @staticmethod
     def handle_trades(msg, subscription):
-        # TODO: Implement handling of sequence numbers for detecting missing
-        #       events
         timestamp = float(msg['timestamp'])/1000
         if 'trade_updates' in msg and msg['trade_updates']:
             for trade in msg['trade_updates']:
@@ -105,8 +166,6 @@ class LunoWebsocketClient(WebsocketClient):
 
     @staticmethod
     def handle_creates(msg, subscription):
-        # TODO: Implement handling of sequence numbers for detecting missing
-        #       events
         timestamp = float(msg['timestamp'])/1000
         if 'create_update' in msg and msg['create_update']:
             order = msg['create_update']
@@ -123,8 +182,6 @@ class LunoWebsocketClient(WebsocketClient):
 
     @staticmethod
     def handle_deletes(msg, subscription):
-        # TODO: Implement handling of sequence numbers for detecting missing
-        #       events
         timestamp = float(msg['timestamp'])/1000
         if 'delete_update' in msg and msg['delete_update']:
             order = msg['delete_update']
@@ -142,6 +199,8 @@ class LunoFeed(Feed):
 
     _rest_client_class = LunoRestClient
     _websocket_client_class = LunoWebsocketClient
+    # the pair streams only carry the order book and trades
+    _rest_channels = ('PRICES', 'TICKERS')
 
     def get_list(self):
         tickers = self.rest_client.get_tickers()
@@ -150,16 +209,46 @@ class LunoFeed(Feed):
     def get_info(self, assets):
         raise NotImplementedError('Not available for this feed.') 
 
-    def get_prices(self, assets, currencies):
+    def get_prices(self, assets, currencies, exchange=None, raw=False):
+        tickers = self.rest_client.get_tickers()
+        return self._parse_prices(
+            self._select_tickers(tickers, assets, currencies), raw)
+
+    async def get_prices_async(self, assets, currencies, exchange=None,
+                               raw=False):
+        tickers = await self.rest_client.get_tickers_async()
+        return self._parse_prices(
+            self._select_tickers(tickers, assets, currencies), raw)
+
+    def get_tickers(self, assets, currencies, exchange=None, raw=False):
+        tickers = self.rest_client.get_tickers()
+        return self._parse_tickers(
+            self._select_tickers(tickers, assets, currencies), raw)
+
+    async def get_tickers_async(self, assets, currencies, exchange=None,
+                                raw=False):
+        tickers = await self.rest_client.get_tickers_async()
+        return self._parse_tickers(
+            self._select_tickers(tickers, assets, currencies), raw)
+
+    def _select_tickers(self, tickers, assets, currencies):
         assets = self._validate_parameter('assets', assets)
         currencies = self._validate_parameter('currencies', currencies)
-        tickers = self.rest_client.get_tickers()
         pairs = {f'{asset}{currency}' for asset, currency in 
                  product(assets, currencies)}
         return [ticker for ticker in tickers if ticker['pair'] in pairs]
- 
-    def get_tickers(self, assets, currencies):
-        raise NotImplemented()       
+
+    def _parse_prices(self, tickers, raw=False):
+        prices = [{'exchange': self.rest_client.exchange,
+                   'pair': ticker['pair'], 'price': ticker['last_trade']}
+                  for ticker in tickers]
+        if not raw:
+            prices = [self.rest_client.parse_price(msg) for msg in prices]
+        return prices
+
+    def _parse_tickers(self, tickers, raw=False):
+        return [ticker if raw else self.rest_client.parse_ticker(ticker)
+                for ticker in tickers]
 
 
 if __name__=='__main__':
@@ -1,5 +1,4 @@
 import logging
-import json
 import time
 from datetime import datetime
 
@@ -8,7 +7,8 @@ import attr
 import websockets
 
 from .base import Feed, WebsocketClient, STOP_HANDLERS
-from ..events import Heartbeat, Trade, Order
+from ..events import Heartbeat, Trade, Order, BookSnapshot
+from ..libs import codec
 
 logger = logging.getLogger(__name__)
 
@@ -27,24 +27,53 @@ class PoloniexWebsocketClient(WebsocketClient):
     '''
     exchange = 'Poloniex'
     websocket_url = 'wss://api2.poloniex.com/'
+    _sequenced = True
+    # order book updates are not timestamped
+    _exchange_timestamps = (Trade,)
 
     async def _subscribe(self, subscription):
         await super()._subscribe(subscription)
         subscription.handlers = subscription.client._get_handlers()
         connection_message = dict(command='subscribe', channel=subscription.symbol)
 
-        packet = json.dumps(connection_message)
+        packet = codec.dumps(connection_message)
         logger.info(packet)
         await self.websocket.send(packet)
 
         return subscription
 
+    async def _unsubscribe(self, subscription):
+        if 'chanId' in subscription.channel_info:
+            self._unregister_channel(subscription.channel_info['chanId'])
+        packet = codec.dumps(dict(command='unsubscribe',
+                                  channel=subscription.symbol))
+        logger.info(packet)
+        await self.websocket.send(packet)
+
+    @staticmethod
+    def _get_channel_id(msg):
+        if isinstance(msg, list) and msg:
+            return msg[0]
+
+    @staticmethod
+    def _get_sequence(msg):
+        if isinstance(msg, list) and len(msg)>2:
+            return msg[1]
+
+    @staticmethod
+    def _is_snapshot(msg):
+        return isinstance(msg, list) and len(msg)>2 and \
+            any(data[0]=='i' for data in msg[2])
+
     @staticmethod
     def handle_message(msg, subscription):
         channel_id = msg[0]
 
         if channel_id == CHANNEL_ID_MAP['heartbeat']:
-            pass  # do nothing for now
+            # the heartbeat is per connection so goes to every subscription
+            event = Heartbeat(exchange=subscription.exchange,
+                              symbol=subscription.symbol)
+            subscription.event_stream.emit(event)
         elif channel_id == CHANNEL_ID_MAP['ticker']:
             pass  # do nothing for now
         else:
@@ -71,8 +100,9 @@ class PoloniexWebsocketClient(WebsocketClient):
             else:
                 # Channel information should be present at this stage
                 # and so a subscription can be matched to a channel via
-                # this info
-                if subscription.channel_info['chanId'] == channel_id:
+                # this info. It is missing while a subscription resyncs,
+                # and late updates of its old channel must be ignored.
+                if subscription.channel_info.get('chanId') == channel_id:
                     if msg_type == 'o':
                         msg_handled = PoloniexWebsocketClient._orderbook_removemodify(seq, data, subscription)
                     elif msg_type == 't':
@@ -101,28 +131,21 @@ class PoloniexWebsocketClient(WebsocketClient):
                 # is in this message, and so this must be done here
                 subscription.channel_info = {'channel': subscription.symbol,\
                                              'chanId': channel_id}
+                subscription.client._register_channel(channel_id,
+                                                      subscription)
+                if subscription.sequencer is not None:
+                    subscription.sequencer.reset(seq)
             if key == 'orderBook':
+                snapshot = BookSnapshot(exchange=subscription.exchange,
+                                        symbol=subscription.symbol,
+                                        sequence=seq)
                 for ask_price, volume in value[0].items():
-                    event = Order(
-                        exchange=subscription.exchange,
-                        symbol=subscription.symbol,
-                        price=ask_price,
-                        volume=volume,
-                        type='ASK',
-                        sequence=seq,
-                    )
-                    subscription.event_stream.emit(event)
-
+                    snapshot.append(price=ask_price, volume=volume,
+                                    side='ASK')
                 for bid_price, volume in value[1].items():
-                    event = Order(
-                        exchange=subscription.exchange,
-                        symbol=subscription.symbol,
-                        price=bid_price,
-                        volume=volume,
-                        type='BID',
-                        sequence=seq,
-                    )
-                    subscription.event_stream.emit(event)
+                    snapshot.append(price=bid_price, volume=volume,
+                                    side='BID')
+                subscription.client._emit_snapshot(subscription, snapshot)
         return True
 
     @staticmethod
@@ -0,0 +1,110 @@
+"""Concurrent fetching of historical data in chunks"""
+
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillError(Exception):
+    """Raised once all the chunks are done if any of them failed"""
+
+    def __init__(self, failed):
+        self.failed = failed
+        super().__init__(f'{len(failed)} chunk(s) failed, the first was '
+                         f'{failed[0][0]!r}: {failed[0][1]!r}')
+
+
+@attr.s
+class Backfill:
+    """Runs fetch(chunk) for many chunks in a pool of threads
+
+    run() yields (chunk, result) in the order the chunks complete, or with
+    ordered=True in the order of the chunks. Chunks are taken lazily from
+    the iterable. At most 2*max_workers of them are in flight and none is
+    started more than max_ahead chunks past the oldest one that is not done
+    yet, 4*max_workers by default. Results that are held back for the order,
+    by run() or by a consumer that reorders them itself, are therefore
+    bounded by max_ahead rather than by the number of chunks. A chunk whose
+    fetch raises is retried on its own up to retries times with exponential
+    backoff starting at retry_delay seconds. Once it has failed for good the
+    later chunks are yielded without it and BackfillError is raised at the
+    end.
+
+    The requests themselves are rate limited per host by the requesters so
+    max_workers only bounds how many wait on the rate limit or the network.
+    """
+
+    fetch = attr.ib()
+    max_workers = attr.ib(default=8, convert=int)
+    retries = attr.ib(default=3, convert=int)
+    retry_delay = attr.ib(default=1.0, convert=float)
+    max_ahead = attr.ib(default=None)
+    stats = attr.ib(default=attr.Factory(Counter))
+
+    def run(self, chunks, ordered=False):
+        chunks = enumerate(chunks)
+        max_ahead = self.max_ahead if self.max_ahead else 4*self.max_workers
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            # the outcome of the done chunks by index, None once yielded or
+            # failed, until all the chunks before them are done too
+            done_chunks = {}
+            oldest = submitted = 0
+
+            def submit():
+                if submitted>=oldest+max_ahead:
+                    return False
+                for index, chunk in chunks:
+                    future = executor.submit(self._fetch, chunk)
+                    pending[future] = index, chunk
+                    return True
+                return False
+
+            while True:
+                while len(pending)<2*self.max_workers and submit():
+                    submitted += 1
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, chunk = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as ex:
+                        logger.error(f'{chunk!r} failed: {ex!r}')
+                        self.stats['failed'] += 1
+                        failed.append((chunk, ex))
+                        done_chunks[index] = None
+                        continue
+                    self.stats['done'] += 1
+                    if ordered:
+                        done_chunks[index] = chunk, result
+                    else:
+                        done_chunks[index] = None
+                        yield chunk, result
+                while oldest in done_chunks:
+                    outcome = done_chunks.pop(oldest)
+                    oldest += 1
+                    if outcome is not None:
+                        yield outcome
+        if failed:
+            raise BackfillError(failed)
+
+    def _fetch(self, chunk):
+        for attempt in range(self.retries+1):
+            try:
+                return self.fetch(chunk)
+            except Exception as ex:
+                if attempt==self.retries:
+                    raise
+                delay = self.retry_delay*2**attempt
+                logger.warning(f'{chunk!r} failed: {ex!r}. Retrying in '
+                               f'{delay}s ...')
+                self.stats['retries'] += 1
+                time.sleep(delay)
@@ -0,0 +1,160 @@
+"""Single file store of cached HTTP responses"""
+
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import attr
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT,
+    saved_at REAL,
+    accessed_at REAL,
+    status INTEGER,
+    headers TEXT,
+    body BLOB,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+'''
+
+
+@attr.s
+class CacheEntry:
+    """A cached response"""
+
+    url = attr.ib()
+    saved_at = attr.ib()
+    status = attr.ib()
+    headers = attr.ib(repr=False)
+    body = attr.ib(repr=False)
+
+
+@attr.s
+class CacheStore:
+    """Cached responses in one sqlite3 file
+
+    Only the status, headers and zlib compressed body of a response are
+    kept, in a table indexed by the request key. Writes and access time
+    updates are buffered and committed together every batch_size writes or
+    flush_interval seconds, and on close(). The store may be used from
+    several threads.
+    """
+
+    path = attr.ib(convert=Path)
+    batch_size = attr.ib(default=100)
+    flush_interval = attr.ib(default=1.0)
+    size = attr.ib(default=0)
+    created = attr.ib(default=False)
+    _connection = attr.ib(default=None, repr=False)
+    _pending = attr.ib(default=attr.Factory(dict), repr=False)
+    _accessed = attr.ib(default=attr.Factory(dict), repr=False)
+    _flushed_at = attr.ib(default=attr.Factory(time.time), repr=False)
+    _lock = attr.ib(default=attr.Factory(threading.RLock), repr=False)
+
+    def __attrs_post_init__(self):
+        self.created = not self.path.exists()
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True)
+        self._connection = sqlite3.connect(str(self.path),
+                                           check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self.size = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            if key in self._pending:
+                row = self._pending[key][1:]
+            else:
+                row = self._connection.execute(
+                    'SELECT url, saved_at, accessed_at, status, headers, '
+                    'body, size FROM responses WHERE key=?',
+                    (key,)).fetchone()
+            if row is None:
+                return
+        url, saved_at, _, status, headers, body, _ = row
+        return CacheEntry(url=url, saved_at=saved_at, status=status,
+                          headers=codec.loads(headers),
+                          body=zlib.decompress(body))
+
+    def put(self, key, entry):
+        body = zlib.compress(entry.body)
+        row = (key, entry.url, entry.saved_at, entry.saved_at, entry.status,
+               codec.dumps(dict(entry.headers)), body, len(body))
+        with self._lock:
+            old = self._pending.get(key)
+            if old is not None:
+                self.size -= old[-1]
+            else:
+                old_size = self._connection.execute(
+                    'SELECT size FROM responses WHERE key=?',
+                    (key,)).fetchone()
+                if old_size is not None:
+                    self.size -= old_size[0]
+            self._pending[key] = row
+            self.size += len(body)
+            self._maybe_flush()
+
+    def touch(self, key, now=None):
+        """Records an access, which orders the entries for eviction"""
+        with self._lock:
+            self._accessed[key] = time.time() if now is None else now
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._pending)+len(self._accessed)>=self.batch_size or \
+                time.time()-self._flushed_at>=self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO responses VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?)', self._pending.values())
+                self._connection.executemany(
+                    'UPDATE responses SET accessed_at=? WHERE key=?',
+                    [(accessed_at, key) for key, accessed_at
+                     in self._accessed.items()])
+            self._pending.clear()
+            self._accessed.clear()
+            self._flushed_at = time.time()
+
+    def evict(self, max_size):
+        """Removes the least recently used entries until size<=max_size
+
+        Returns the keys of the removed entries.
+        """
+        evicted = []
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute(
+                'SELECT key, size FROM responses ORDER BY accessed_at')
+            for key, size in rows:
+                if self.size<=max_size:
+                    break
+                evicted.append(key)
+                self.size -= size
+            with self._connection:
+                self._connection.executemany(
+                    'DELETE FROM responses WHERE key=?',
+                    [(key,) for key in evicted])
+        return evicted
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self.flush()
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,80 @@
+"""JSON codecs for the packet and event hot paths
+
+The module level loads() and dumps() point at the selected codec. Use them
+through the module, i.e. codec.loads(packet), so that set_codec() takes effect
+everywhere.
+"""
+
+import json
+import logging
+from collections import OrderedDict
+
+from ..config import get_config_item
+
+logger = logging.getLogger(__name__)
+
+
+def _orjson():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+
+    return orjson.loads, dumps
+
+
+def _ujson():
+    import ujson
+    return ujson.loads, ujson.dumps
+
+
+def _rapidjson():
+    import rapidjson
+    return rapidjson.loads, rapidjson.dumps
+
+
+def _json():
+    return json.loads, json.dumps
+
+
+# in order of preference for codec='auto'
+CODECS = OrderedDict([
+    ('orjson', _orjson),
+    ('ujson', _ujson),
+    ('rapidjson', _rapidjson),
+    ('json', _json),
+    ])
+
+name = 'json'
+loads = json.loads
+dumps = json.dumps
+
+
+def set_codec(codec='auto'):
+    """Selects the json codec by name
+
+    'auto' picks the fastest one that is installed. Falls back to the stdlib
+    json module if the requested codec is not installed."""
+    global name, loads, dumps
+    codec = 'auto' if not codec else codec.lower()
+    if codec=='auto':
+        candidates = list(CODECS)
+    elif codec in CODECS:
+        candidates = [codec, 'json']
+    else:
+        raise ValueError(f'codec={codec!r}')
+    for candidate in candidates:
+        try:
+            loads, dumps = CODECS[candidate]()
+        except ImportError:
+            if candidate==codec:
+                logger.warning(f'{candidate} is not installed. Falling back '
+                               'to json.')
+            continue
+        name = candidate
+        break
+    logger.debug(f'Using the {name} codec')
+    return name
+
+
+set_codec(get_config_item('codec'))
@@ -0,0 +1,77 @@
+"""Columnar NumPy arrays of candles"""
+
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+CANDLE_DTYPES = (('time', 'int64'), ('open', 'float64'), ('high', 'float64'),
+                 ('low', 'float64'), ('close', 'float64'),
+                 ('volumefrom', 'float64'), ('volumeto', 'float64'))
+CANDLE_COLUMNS = tuple(name for name, dtype in CANDLE_DTYPES)
+# bytes of the ascii asset and currency fields of .npy files
+SYMBOL_LENGTH = 12
+
+
+def _check_numpy():
+    if np is None:
+        raise ImportError('You need to have numpy installed to use columnar '
+                          'history. Install it with:\n'
+                          '\n'
+                          '   pip install numpy')
+
+
+def to_columns(candles):
+    """Converts candle dicts to a dict of one typed array per column"""
+    _check_numpy()
+    return {name: np.fromiter((candle[name] for candle in candles),
+                              dtype=dtype, count=len(candles))
+            for name, dtype in CANDLE_DTYPES}
+
+
+def rows_to_columns(rows, fields):
+    """Converts tuples of the candle fields to a dict of typed arrays"""
+    _check_numpy()
+    records = np.array(rows, dtype=[(field, dict(CANDLE_DTYPES)[field])
+                                    for field in fields])
+    return {name: np.ascontiguousarray(records[name])
+            for name in CANDLE_COLUMNS}
+
+
+def save(path, history):
+    """Saves columns by (asset, currency) to a .npz or .npy file
+
+    A .npz file holds a 'ASSET-CURRENCY/column' array for every column of
+    every pair and loads each array on access. A .npy file holds a single
+    structured array of all the candles, with bytes asset and currency
+    fields, which np.load(path, mmap_mode='r') maps without reading it.
+    """
+    _check_numpy()
+    path = Path(path)
+    if path.suffix=='.npz':
+        np.savez(str(path), **{f'{asset}-{currency}/{name}': column
+                               for (asset, currency), columns
+                               in history.items()
+                               for name, column in columns.items()})
+    elif path.suffix=='.npy':
+        symbol_dtype = f'S{SYMBOL_LENGTH}'
+        dtype = [('asset', symbol_dtype), ('currency', symbol_dtype),
+                 *CANDLE_DTYPES]
+        length = sum(len(columns['time']) for columns in history.values())
+        records = np.lib.format.open_memmap(str(path), mode='w+',
+                                            dtype=dtype, shape=(length,))
+        offset = 0
+        for (asset, currency), columns in history.items():
+            end = offset+len(columns['time'])
+            records['asset'][offset:end] = asset
+            records['currency'][offset:end] = currency
+            for name in CANDLE_COLUMNS:
+                records[name][offset:end] = columns[name]
+            offset = end
+        records.flush()
+        del records
+    else:
+        raise ValueError(f'path={path}')
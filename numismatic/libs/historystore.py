@@ -0,0 +1,156 @@
+"""Local store of OHLCV candles and the time ranges they cover"""
+
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+# in the order the CryptoCompare histo* endpoints return them
+CANDLE_FIELDS = ('time', 'close', 'high', 'low', 'open', 'volumefrom',
+                 'volumeto')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS candles (
+    feed TEXT,
+    exchange TEXT,
+    asset TEXT,
+    currency TEXT,
+    freq TEXT,
+    time INTEGER,
+    close REAL,
+    high REAL,
+    low REAL,
+    open REAL,
+    volumefrom REAL,
+    volumeto REAL,
+    PRIMARY KEY (feed, exchange, asset, currency, freq, time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    feed TEXT,
+    exchange TEXT,
+    asset TEXT,
+    currency TEXT,
+    freq TEXT,
+    start_time INTEGER,
+    end_time INTEGER
+);
+CREATE INDEX IF NOT EXISTS coverage_series
+    ON coverage (feed, exchange, asset, currency, freq);
+'''
+
+SERIES = 'feed=? AND exchange=? AND asset=? AND currency=? AND freq=?'
+
+
+@attr.s(frozen=True)
+class SeriesKey:
+    """Identifies one candle series"""
+
+    feed = attr.ib()
+    exchange = attr.ib()
+    asset = attr.ib()
+    currency = attr.ib()
+    freq = attr.ib()
+
+
+@attr.s
+class HistoryStore:
+    """Candles in one sqlite3 file together with the ranges they cover
+
+    The coverage of a series is a set of disjoint [start_time, end_time]
+    ranges of candle open times, in seconds since the epoch, for which every
+    candle has been stored. Only closed candles, which never change, should
+    be recorded as covered so that gaps() returns just the ranges that
+    still have to be requested. The store may be used from several threads.
+    """
+
+    path = attr.ib(convert=Path)
+    _connection = attr.ib(default=None, repr=False)
+    _lock = attr.ib(default=attr.Factory(threading.RLock), repr=False)
+
+    def __attrs_post_init__(self):
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True)
+        self._connection = sqlite3.connect(str(self.path),
+                                           check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def coverage(self, key):
+        with self._lock:
+            return self._connection.execute(
+                f'SELECT start_time, end_time FROM coverage WHERE {SERIES} '
+                f'ORDER BY start_time', attr.astuple(key)).fetchall()
+
+    def covered(self, key, start_time, end_time):
+        """The covered (start_time, end_time) ranges clipped to the range"""
+        return [(max(covered_start, start_time), min(covered_end, end_time))
+                for covered_start, covered_end in self.coverage(key)
+                if covered_start<=end_time and covered_end>=start_time]
+
+    def gaps(self, key, start_time, end_time, period):
+        """The uncovered (start_time, end_time) ranges of candles"""
+        gaps = []
+        next_time = start_time
+        for covered_start, covered_end in self.coverage(key):
+            if covered_end<next_time:
+                continue
+            if covered_start>end_time:
+                break
+            if covered_start>next_time:
+                gaps.append((next_time, covered_start-period))
+            next_time = max(next_time, covered_end+period)
+        if next_time<=end_time:
+            gaps.append((next_time, end_time))
+        return gaps
+
+    def get(self, key, start_time, end_time):
+        """The candles from start_time to end_time as dicts"""
+        return [dict(zip(CANDLE_FIELDS, row))
+                for row in self.get_rows(key, start_time, end_time)]
+
+    def get_rows(self, key, start_time, end_time):
+        """The candles from start_time to end_time as CANDLE_FIELDS tuples"""
+        with self._lock:
+            return self._connection.execute(
+                f'SELECT {", ".join(CANDLE_FIELDS)} FROM candles '
+                f'WHERE {SERIES} AND time>=? AND time<=? ORDER BY time',
+                attr.astuple(key)+(start_time, end_time)).fetchall()
+
+    def put(self, key, candles, start_time=None, end_time=None, period=None):
+        """Stores candles and marks start_time to end_time as covered
+
+        Candles already stored for the same times are replaced. Ranges that
+        overlap or adjoin the new one are merged with it.
+        """
+        series = attr.astuple(key)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO candles VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [series+tuple(candle[field] for field in CANDLE_FIELDS)
+                 for candle in candles])
+            if start_time is None or start_time>end_time:
+                return
+            merged = self._connection.execute(
+                f'SELECT start_time, end_time FROM coverage WHERE {SERIES} '
+                f'AND start_time<=? AND end_time>=?',
+                series+(end_time+period, start_time-period)).fetchall()
+            for covered_start, covered_end in merged:
+                start_time = min(start_time, covered_start)
+                end_time = max(end_time, covered_end)
+            self._connection.execute(
+                f'DELETE FROM coverage WHERE {SERIES} AND start_time>=? '
+                f'AND end_time<=?', series+(start_time, end_time))
+            self._connection.execute(
+                'INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?, ?)',
+                series+(start_time, end_time))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,154 @@
+"""Streaming latency metrics"""
+
+import math
+from collections import defaultdict, deque
+
+import attr
+
+
+@attr.s
+class Histogram:
+    """Streaming histogram with logarithmic buckets
+
+    Values (in seconds) are counted in buckets that grow by a factor of
+    2**(1/resolution) starting at min_value, so percentiles are accurate to
+    within that factor while memory stays bounded by the range of values.
+    Negative values, e.g. latencies to an exchange clock that runs ahead,
+    get the mirror image buckets with negative indices and values within
+    min_value of 0 share bucket 0.
+    """
+
+    min_value = attr.ib(default=1e-6)
+    resolution = attr.ib(default=8)
+    count = attr.ib(default=0)
+    total = attr.ib(default=0.0)
+    min = attr.ib(default=math.inf)
+    max = attr.ib(default=-math.inf)
+    _buckets = attr.ib(default=attr.Factory(lambda: defaultdict(int)),
+                       repr=False)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value<self.min:
+            self.min = value
+        if value>self.max:
+            self.max = value
+        magnitude = abs(value)
+        if magnitude<=self.min_value:
+            index = 0
+        else:
+            index = int(math.log2(magnitude/self.min_value)*
+                        self.resolution)+1
+            if value<0:
+                index = -index
+        self._buckets[index] += 1
+
+    def _upper_bound(self, index):
+        if index<0:
+            # the bucket of -x is bounded above by the lower bound of x
+            return -self.min_value*2**((-index-1)/self.resolution)
+        return self.min_value*2**(index/self.resolution)
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else math.nan
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        if not self.count:
+            return math.nan
+        rank = p/100*self.count
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen>=rank:
+                return max(min(self._upper_bound(index), self.max),
+                           self.min)
+        return self.max
+
+    def summary(self):
+        return dict(count=self.count, mean=self.mean, min=self.min,
+                    p50=self.percentile(50), p90=self.percentile(90),
+                    p99=self.percentile(99), max=self.max)
+
+
+@attr.s
+class ClockOffset:
+    """Estimates the offset of an exchange clock from the local clock
+
+    The estimate is the minimum of (receive time - exchange time) over the
+    last window seconds, i.e. the sample with the least network and queueing
+    delay. Corrected exchange timestamps therefore measure latency relative
+    to the best path seen recently rather than absolute one-way latency.
+    """
+
+    window = attr.ib(default=300.0)
+    # (receive time, delta) with increasing deltas, so the minimum is first
+    _samples = attr.ib(default=attr.Factory(deque), repr=False)
+
+    def add(self, recv_time, exchange_time):
+        delta = recv_time-exchange_time
+        samples = self._samples
+        while samples and samples[-1][1]>=delta:
+            samples.pop()
+        samples.append((recv_time, delta))
+        while samples[0][0]<recv_time-self.window:
+            samples.popleft()
+
+    @property
+    def offset(self):
+        return self._samples[0][1] if self._samples else 0.0
+
+    def correct(self, exchange_time):
+        """Converts an exchange timestamp to the local clock"""
+        return exchange_time+self.offset
+
+
+@attr.s
+class LatencyMonitor:
+    """Latency histograms per exchange, channel and stage
+
+    The stages are:
+
+        exchange_to_recv:           exchange timestamp to receipt at the
+                                    socket, including any clock offset
+        exchange_to_recv_corrected: the same with the exchange timestamp
+                                    corrected by the ClockOffset estimate,
+                                    i.e. the delay over the best path seen
+        decode:                     decoding the json of a packet
+        recv_to_emit:               receipt at the socket, through the
+                                    packet queue, to event_stream.emit
+    """
+
+    histograms = attr.ib(default=attr.Factory(lambda: defaultdict(Histogram)))
+    offsets = attr.ib(default=attr.Factory(lambda: defaultdict(ClockOffset)))
+
+    def record_decode(self, exchange, seconds):
+        self.histograms[exchange, 'ALL', 'decode'].add(seconds)
+
+    def record_emit(self, exchange, channel, recv_time, emit_time,
+                    exchange_time=None):
+        self.histograms[exchange, channel, 'recv_to_emit'].add(
+            emit_time-recv_time)
+        if exchange_time is not None:
+            offset = self.offsets[exchange]
+            offset.add(recv_time, exchange_time)
+            self.histograms[exchange, channel, 'exchange_to_recv'].add(
+                recv_time-exchange_time)
+            self.histograms[exchange, channel,
+                            'exchange_to_recv_corrected'].add(
+                recv_time-offset.correct(exchange_time))
+
+    def summary(self):
+        """Histogram summaries keyed by exchange--channel--stage"""
+        return {'--'.join(map(str, key)): histogram.summary()
+                for key, histogram in sorted(self.histograms.items())}
+
+    def reset(self):
+        self.histograms.clear()
+        self.offsets.clear()
+
+
+# shared by all clients so that the histograms can be queried in one place
+latency = LatencyMonitor()
@@ -0,0 +1,75 @@
+"""Bounded queues for decoupling socket readers from packet handlers"""
+
+import asyncio
+from collections import Counter, deque
+
+import attr
+
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'conflate')
+
+
+@attr.s
+class PacketQueue:
+    """Bounded FIFO queue with a configurable overflow policy
+
+    When the queue is full, put() behaves according to overflow:
+
+        block:       wait for space, i.e. apply backpressure to the reader
+        drop_oldest: discard the oldest queued item
+        conflate:    replace the queued item with the same key (channel) in
+                     place, otherwise discard the oldest queued item
+
+    Queue depth and the drop counters are available from stats.
+    """
+
+    maxsize = attr.ib(default=10000, convert=int)
+    overflow = attr.ib(default='block',
+                       validator=attr.validators.in_(OVERFLOW_POLICIES))
+    stats = attr.ib(default=attr.Factory(Counter))
+    _items = attr.ib(default=attr.Factory(deque), repr=False)
+    _latest = attr.ib(default=attr.Factory(dict), repr=False)
+    _not_empty = attr.ib(default=attr.Factory(asyncio.Event), repr=False)
+    _not_full = attr.ib(default=attr.Factory(asyncio.Event), repr=False)
+
+    def __len__(self):
+        return len(self._items)
+
+    def full(self):
+        return len(self._items)>=self.maxsize
+
+    async def put(self, item, key=None):
+        if self.full():
+            if self.overflow=='block':
+                self.stats['blocked'] += 1
+                while self.full():
+                    self._not_full.clear()
+                    await self._not_full.wait()
+            elif self.overflow=='conflate' and key in self._latest:
+                self._latest[key][1] = item
+                self.stats['conflated'] += 1
+                return
+            else:
+                self._pop()
+                self.stats['dropped'] += 1
+        cell = [key, item]
+        self._items.append(cell)
+        if key is not None and self.overflow=='conflate':
+            self._latest[key] = cell
+        self.stats['put'] += 1
+        if len(self._items)>self.stats['max_depth']:
+            self.stats['max_depth'] = len(self._items)
+        self._not_empty.set()
+
+    async def get(self):
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self._pop()
+
+    def _pop(self):
+        key, item = cell = self._items.popleft()
+        if self._latest.get(key) is cell:
+            del self._latest[key]
+        self._not_full.set()
+        return item
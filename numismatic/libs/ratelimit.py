@@ -0,0 +1,94 @@
+"""Rate limiting of requests to an API host"""
+
+import asyncio
+import threading
+import time
+
+import attr
+
+from ..config import config, get_config_item
+
+
+@attr.s
+class TokenBucket:
+    """Allows rate requests per second with bursts of up to burst requests
+
+    reserve() takes a token, going into debt if there are none, and returns
+    the seconds the caller must wait before using it. Callers therefore
+    queue up in the order they reserved without any polling. The bucket is
+    not thread safe, use it through RateLimits.
+    """
+
+    rate = attr.ib(convert=float)
+    burst = attr.ib(default=1, convert=float)
+    tokens = attr.ib(default=None)
+    _updated = attr.ib(default=attr.Factory(time.monotonic), repr=False)
+
+    def __attrs_post_init__(self):
+        if self.tokens is None:
+            self.tokens = self.burst
+
+    def reserve(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst,
+                          self.tokens+(now-self._updated)*self.rate)
+        self._updated = now
+        self.tokens -= 1
+        return -self.tokens/self.rate if self.tokens<0 else 0.0
+
+
+@attr.s
+class RateLimits:
+    """Registry of the token buckets of the API hosts
+
+    limits maps a host to its (rate, burst), other hosts get default. A rate
+    of 0 means unlimited. All requesters share the module level rate_limits
+    so every request to a host draws from the same bucket.
+    """
+
+    limits = attr.ib(default=attr.Factory(dict))
+    default = attr.ib(default=(0, 1))
+    _buckets = attr.ib(default=attr.Factory(dict), repr=False)
+    _lock = attr.ib(default=attr.Factory(threading.Lock), repr=False)
+
+    @classmethod
+    def from_config(cls, config=config):
+        """Reads the host = rate, burst items of the RateLimits section"""
+        limits = {}
+        if config.has_section('RateLimits'):
+            section = config['RateLimits']
+            for host in section:
+                if host in config.defaults():
+                    continue
+                rate, _, burst = section[host].partition(',')
+                limits[host] = (float(rate), int(burst or 1))
+        default = (float(get_config_item('rate_limit', config=config)),
+                   int(get_config_item('rate_burst', config=config)))
+        return cls(limits=limits, default=default)
+
+    def get_bucket(self, host):
+        """The TokenBucket of host or None if it is unlimited"""
+        if host not in self._buckets:
+            rate, burst = self.limits.get(host, self.default)
+            self._buckets[host] = \
+                TokenBucket(rate=rate, burst=burst) if rate>0 else None
+        return self._buckets[host]
+
+    def reserve(self, host):
+        # requests may be made from executor threads
+        with self._lock:
+            bucket = self.get_bucket(host)
+            return 0.0 if bucket is None else bucket.reserve()
+
+    async def acquire(self, host):
+        delay = self.reserve(host)
+        if delay>0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, host):
+        delay = self.reserve(host)
+        if delay>0:
+            time.sleep(delay)
+
+
+rate_limits = RateLimits.from_config()
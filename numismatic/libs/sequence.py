@@ -0,0 +1,80 @@
+"""Sequence number tracking for incrementally updated feeds"""
+
+import time
+from collections import Counter
+
+import attr
+
+
+class SequenceGap(Exception):
+    """Raised when missing sequence numbers did not arrive in time"""
+
+
+@attr.s
+class SequenceTracker:
+    """Tracks the sequence numbers of one subscription
+
+    Messages that arrive ahead of the expected sequence number are buffered
+    for up to max_delay seconds or max_buffer messages so that they can be put
+    back in order. If the missing messages don't turn up the gap is real,
+    SequenceGap is raised and all further messages are dropped until reset()
+    is called with the sequence number of a fresh snapshot.
+    """
+
+    max_buffer = attr.ib(default=100)
+    max_delay = attr.ib(default=1.0)
+    expected = attr.ib(default=None)
+    resyncing = attr.ib(default=False)
+    stats = attr.ib(default=attr.Factory(Counter))
+    _buffer = attr.ib(default=attr.Factory(dict), repr=False)
+    _buffered_since = attr.ib(default=None, repr=False)
+
+    def reset(self, sequence=None):
+        """Syncs to a snapshot with the given sequence number
+
+        With sequence=None messages pass through unchecked until the next
+        snapshot."""
+        self.expected = None if sequence is None else sequence+1
+        self.resyncing = False
+        self._buffer.clear()
+        self._buffered_since = None
+        if sequence is not None:
+            self.stats['snapshots'] += 1
+
+    def process(self, sequence, msg, now=None):
+        """Returns the messages that are ready to be handled, in order"""
+        if self.resyncing:
+            self.stats['dropped'] += 1
+            return []
+        if self.expected is None:
+            # not synced to a snapshot yet
+            return [msg]
+        if sequence<self.expected:
+            self.stats['duplicates'] += 1
+            return []
+        now = time.time() if now is None else now
+        if sequence>self.expected:
+            self.stats['out_of_order'] += 1
+            self._buffer[sequence] = msg
+            if self._buffered_since is None:
+                self._buffered_since = now
+            if len(self._buffer)>self.max_buffer or \
+                    now-self._buffered_since>self.max_delay:
+                missing = (self.expected, min(self._buffer)-1)
+                self.stats['gaps'] += 1
+                self.stats['dropped'] += len(self._buffer)
+                self.expected = None
+                self.resyncing = True
+                self._buffer.clear()
+                self._buffered_since = None
+                raise SequenceGap(f'Missing sequence numbers {missing}')
+            return []
+        ready = [msg]
+        self.expected += 1
+        while self.expected in self._buffer:
+            ready.append(self._buffer.pop(self.expected))
+            self.expected += 1
+            self.stats['reordered'] += 1
+        # restart the clock for whatever is still waiting
+        self._buffered_since = now if self._buffer else None
+        return ready
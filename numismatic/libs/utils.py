@@ -1,21 +1,10 @@
 """Utility functions"""
 
 import math
-from datetime import datetime, timedelta
+import calendar
+from datetime import datetime, timedelta, timezone
 
-def date_range(start_date, end_date, **freq):
-    """Calculates date range by substracting a delta
-    value from end_date until we reach start_date"""
-
-    delta = timedelta(**freq)
-    dates = []
-
-    while end_date > start_date:
-        dates.insert(0, end_date)
-        end_date -= delta   
-
-    dates.insert(0, start_date)
-    return dates
+from dateutil.parser import parse
 
 def to_datetime(datelike, origin=None):
     """Converts a datelike object to python date
@@ -28,6 +17,42 @@ def to_datetime(datelike, origin=None):
     else:
         raise TypeError(f'{datelike}')
 
+# epoch seconds of the dates seen by parse_timestamp
+_date_epochs = {}
+
+def parse_timestamp(timestamp):
+    """Converts an ISO-8601 UTC timestamp string to seconds since the epoch
+
+    Specialised for the fixed layout YYYY-MM-DDTHH:MM:SS[.fraction][Z] sent
+    by the exchanges, with any number of fraction digits. The epoch of the
+    date prefix is cached so hot-path parsing only reads the time of day.
+    Any other layout is handled by dateutil, assuming UTC when no timezone
+    is given."""
+
+    fraction = timestamp[19:]
+    if fraction.endswith('Z'):
+        fraction = fraction[:-1]
+    if (len(timestamp)<19 or timestamp[10] not in 'T ' or
+            timestamp[13]!=':' or timestamp[16]!=':' or
+            fraction and (fraction[0]!='.' or not fraction[1:].isdigit())):
+        dt = parse(timestamp)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    date = timestamp[:10]
+    try:
+        seconds = _date_epochs[date]
+    except KeyError:
+        if len(_date_epochs)>1000:
+            _date_epochs.clear()
+        seconds = _date_epochs[date] = calendar.timegm(
+            datetime.strptime(date, '%Y-%m-%d').timetuple())
+    seconds += (int(timestamp[11:13])*3600 + int(timestamp[14:16])*60 +
+                int(timestamp[17:19]))
+    if fraction:
+        seconds += int(fraction[1:])/10**(len(fraction)-1)
+    return seconds
+
 def make_list_str(items):
     """Converts a string to a list"""
     if isinstance(items, str):
@@ -0,0 +1,158 @@
+"""Detection of subscriptions that have gone silent"""
+
+import logging
+import asyncio
+import math
+import time
+from collections import Counter
+from functools import partial
+
+import attr
+
+from ..events import Heartbeat
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s
+class Watch:
+    """Activity of one subscription"""
+
+    subscription = attr.ib()
+    last_message = attr.ib(default=attr.Factory(time.time))
+    last_heartbeat = attr.ib(default=None)
+    # consecutive deadlines missed
+    misses = attr.ib(default=0)
+    active = attr.ib(default=True)
+
+    @property
+    def last_seen(self):
+        """When anything, data or a heartbeat, last arrived"""
+        if self.last_heartbeat is None:
+            return self.last_message
+        return max(self.last_message, self.last_heartbeat)
+
+
+@attr.s
+class Watchdog:
+    """Resubscribes or reconnects subscriptions that miss their deadline
+
+    Every event on a watched subscription's event_stream other than a
+    Heartbeat updates last_message, Heartbeats only update last_heartbeat.
+    Heartbeats are sent for the subscription's own channel, so a quiet
+    market that still gets them is alive and is left alone. A subscription
+    without any events or heartbeats for timeout seconds is resynced. If it
+    stays silent for another timeout while no other subscription on its
+    connection hears anything either, the socket is probably half-open and
+    is closed so that the client reconnects.
+
+    All the deadlines are kept in a single timer wheel with tick second
+    slots that one task advances. Activity only updates the Watch, so a
+    watch is rescheduled lazily when its slot comes round rather than on
+    every event.
+    """
+
+    timeout = attr.ib(default=60.0, convert=float)
+    tick = attr.ib(default=1.0, convert=float)
+    watches = attr.ib(default=attr.Factory(dict), repr=False)
+    stats = attr.ib(default=attr.Factory(Counter))
+    _wheel = attr.ib(default=None, repr=False)
+    _position = attr.ib(default=0, repr=False)
+    _task = attr.ib(default=None, repr=False)
+
+    # shared watchdogs by timeout, see get()
+    _instances = {}
+
+    def __attrs_post_init__(self):
+        slots = int(math.ceil(self.timeout/self.tick))+1
+        self._wheel = [[] for _ in range(slots)]
+
+    @classmethod
+    def get(cls, timeout):
+        """The shared Watchdog for timeout"""
+        timeout = float(timeout)
+        if timeout not in cls._instances:
+            cls._instances[timeout] = cls(timeout=timeout)
+        return cls._instances[timeout]
+
+    def watch(self, subscription):
+        if not hasattr(subscription.client, '_resync'):
+            logger.warning(f'Can only watch websocket subscriptions. '
+                           f'Skipping {subscription.market_name!r}.')
+            return
+        watch = Watch(subscription=subscription)
+        if subscription.market_name in self.watches:
+            self.watches[subscription.market_name].active = False
+        self.watches[subscription.market_name] = watch
+        subscription.event_stream.sink(partial(self._on_event, watch))
+        self._schedule(watch, watch.last_message+self.timeout)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return watch
+
+    def unwatch(self, subscription):
+        watch = self.watches.pop(subscription.market_name, None)
+        if watch is not None:
+            watch.active = False
+
+    def staleness(self, now=None):
+        """Seconds since the last event other than a Heartbeat per market"""
+        now = time.time() if now is None else now
+        return {market_name: now-watch.last_message
+                for market_name, watch in self.watches.items()}
+
+    @staticmethod
+    def _on_event(watch, event):
+        if isinstance(event, Heartbeat):
+            watch.last_heartbeat = time.time()
+        else:
+            watch.last_message = time.time()
+        watch.misses = 0
+
+    def _schedule(self, watch, deadline, now=None):
+        now = time.time() if now is None else now
+        ticks = min(max(1, math.ceil((deadline-now)/self.tick)),
+                    len(self._wheel)-1)
+        self._wheel[(self._position+ticks) % len(self._wheel)].append(watch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self._advance(time.time())
+
+    def _advance(self, now):
+        self._position = (self._position+1) % len(self._wheel)
+        due, self._wheel[self._position] = self._wheel[self._position], []
+        for watch in due:
+            if not watch.active:
+                continue
+            deadline = watch.last_seen+self.timeout
+            if deadline>now:
+                self._schedule(watch, deadline, now)
+            else:
+                try:
+                    self._on_stale(watch, now)
+                except Exception as ex:
+                    # keep watching the other subscriptions
+                    logger.error(ex)
+                self._schedule(watch, now+self.timeout, now)
+
+    def _on_stale(self, watch, now):
+        subscription = watch.subscription
+        client = subscription.client
+        watch.misses += 1
+        logger.warning(f'{subscription.market_name} has been silent for '
+                       f'{now-watch.last_seen:.1f}s')
+        if watch.misses==1 or self._connected(client, now):
+            self.stats['resyncs'] += 1
+            asyncio.ensure_future(client._resync(subscription))
+        else:
+            # the socket is probably half-open so force a reconnect
+            self.stats['reconnects'] += 1
+            asyncio.ensure_future(client.websocket.close())
+
+    def _connected(self, client, now):
+        """Whether any subscription on client heard anything recently"""
+        return any(watch.subscription.client is client and
+                   now-watch.last_seen<self.timeout
+                   for watch in self.watches.values())
@@ -0,0 +1,201 @@
+"""Local order books maintained from Order events"""
+import logging
+import math
+from collections import defaultdict
+from itertools import islice
+
+from sortedcontainers import SortedDict
+from streamz import Stream
+import attr
+
+from .events import Order, Trade, Reconnect, BookUpdate, BookSnapshot, \
+    OrderType
+
+logger = logging.getLogger(__name__)
+
+
+BID_TYPES = {OrderType.BID, OrderType.BUY}
+ASK_TYPES = {OrderType.ASK, OrderType.SELL}
+
+
+@attr.s
+class BookSide:
+    '''The price levels of one side of an order book
+
+    The levels are kept in a SortedDict of price to volume, sorted so that
+    the best price is always the last key. Asks are stored with negated
+    prices to achieve this. Adding, changing or removing a level is
+    O(log n) in the number of levels, the best level is read off the end in
+    O(1) and the best n levels in O(n).
+    '''
+
+    sign = attr.ib(default=1)
+    _levels = attr.ib(default=attr.Factory(SortedDict), repr=False)
+
+    def __len__(self):
+        return len(self._levels)
+
+    def add(self, price, volume):
+        '''Adds volume, which may be negative, to the level at price'''
+        key = self.sign*price
+        volume += self._levels.get(key, 0)
+        if volume>0:
+            self._levels[key] = volume
+        else:
+            self._levels.pop(key, None)
+
+    def clear(self):
+        self._levels.clear()
+
+    def load(self, levels):
+        '''Replaces all levels with the {price: volume} mapping levels'''
+        sign = self.sign
+        self._levels = SortedDict((sign*price, volume) for price, volume
+                                  in levels.items() if volume>0)
+
+    @property
+    def best(self):
+        '''(price, volume) of the best level or (nan, nan) if empty'''
+        if not self._levels:
+            return math.nan, math.nan
+        key, volume = self._levels.peekitem(-1)
+        return self.sign*key, volume
+
+    def top(self, n):
+        '''The best n levels as a list of (price, volume)'''
+        if n<=0:
+            return []
+        sign, levels = self.sign, self._levels
+        return [(sign*key, levels[key])
+                for key in islice(reversed(levels), n)]
+
+
+@attr.s
+class OrderBook:
+    '''Order book built up from the Order events of a subscription
+
+    Orders are tracked by id so that modifications, cancellations and
+    (for exchanges that report the maker order id) trades can be applied to
+    the right level. Feeds that publish levels rather than orders use the
+    price as the id, see Order. A BookUpdate with the top of the book is
+    emitted on book_stream after every change. The book is cleared when the
+    subscription reconnects and replaced by a BookSnapshot.
+    '''
+
+    event_stream = attr.ib()
+    exchange = attr.ib(default=None)
+    symbol = attr.ib(default=None)
+    bids = attr.ib(default=attr.Factory(lambda: BookSide(sign=1)),
+                   repr=False)
+    asks = attr.ib(default=attr.Factory(lambda: BookSide(sign=-1)),
+                   repr=False)
+    book_stream = attr.ib(default=attr.Factory(Stream), repr=False)
+    _orders = attr.ib(default=attr.Factory(dict), repr=False)
+
+    def __attrs_post_init__(self):
+        self.event_stream.sink(self.update)
+
+    def update(self, event):
+        if isinstance(event, Order):
+            self._apply_order(event)
+        elif isinstance(event, BookSnapshot):
+            self._load_snapshot(event)
+        elif isinstance(event, Trade):
+            if not self._apply_trade(event):
+                return
+        elif isinstance(event, Reconnect):
+            logger.info(f'Clearing {event.exchange}--{event.symbol} order '
+                        'book ...')
+            self.clear()
+        else:
+            return
+        if self.exchange is None:
+            self.exchange, self.symbol = event.exchange, event.symbol
+        self.book_stream.emit(self._make_update(event))
+
+    def _apply_order(self, order):
+        self._remove(order.id)
+        if order.type in BID_TYPES:
+            side = self.bids
+        elif order.type in ASK_TYPES:
+            side = self.asks
+        else:
+            # CANCEL
+            return
+        if order.volume>0:
+            side.add(order.price, order.volume)
+            self._orders[order.id] = (side, order.price, order.volume)
+
+    def _load_snapshot(self, snapshot):
+        '''Replaces the book with a BookSnapshot in a single pass'''
+        self._orders.clear()
+        bid_levels, ask_levels = defaultdict(float), defaultdict(float)
+        for price, volume, order_id, order_type in zip(
+                snapshot.prices, snapshot.volumes, snapshot.ids,
+                snapshot.sides):
+            order_type = OrderType(order_type)
+            if order_type in BID_TYPES:
+                side, levels = self.bids, bid_levels
+            elif order_type in ASK_TYPES:
+                side, levels = self.asks, ask_levels
+            else:
+                continue
+            # same id as the equivalent Order event, see Order
+            order_id = order_id or price
+            if order_id in self._orders:
+                old_side, old_price, old_volume = self._orders.pop(order_id)
+                (bid_levels if old_side is self.bids else
+                 ask_levels)[old_price] -= old_volume
+            if volume>0:
+                levels[price] += volume
+                self._orders[order_id] = (side, price, volume)
+        self.bids.load(bid_levels)
+        self.asks.load(ask_levels)
+
+    def _apply_trade(self, trade):
+        '''Reduces the maker order if the trade id refers to one'''
+        if trade.id not in self._orders:
+            return False
+        side, price, volume = self._orders[trade.id]
+        traded = min(trade.volume, volume)
+        side.add(price, -traded)
+        if volume-traded>0:
+            self._orders[trade.id] = (side, price, volume-traded)
+        else:
+            del self._orders[trade.id]
+        return True
+
+    def _remove(self, order_id):
+        if order_id in self._orders:
+            side, price, volume = self._orders.pop(order_id)
+            side.add(price, -volume)
+
+    def _make_update(self, event):
+        best_bid, bid_volume = self.bids.best
+        best_ask, ask_volume = self.asks.best
+        return BookUpdate(exchange=self.exchange, symbol=self.symbol,
+                          best_bid=best_bid, bid_volume=bid_volume,
+                          best_ask=best_ask, ask_volume=ask_volume,
+                          timestamp=event.timestamp,
+                          sequence=getattr(event, 'sequence', None))
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._orders.clear()
+
+    @property
+    def best_bid(self):
+        return self.bids.best[0]
+
+    @property
+    def best_ask(self):
+        return self.asks.best[0]
+
+    @property
+    def spread(self):
+        return self.best_ask-self.best_bid
+
+    def depth(self, n=10):
+        '''The best n bid and ask levels as lists of (price, volume)'''
+        return {'bids': self.bids.top(n), 'asks': self.asks.top(n)}
@@ -0,0 +1,187 @@
+"""Recording and replaying of raw websocket traffic
+
+A recording is a gzip file starting with a header line that describes the
+recorded clients and their subscriptions, followed by one binary frame per
+packet:
+
+    receive time (double), client id (ushort), is text (uchar),
+    length (uint), packet bytes
+
+Replaying creates the recorded clients with a ReplaySocket in place of the
+websocket so that the packets go through the unchanged WebsocketClient
+queueing, routing and handle_* dispatch.
+"""
+import logging
+import asyncio
+import gzip
+import json
+import struct
+import time
+import atexit
+import importlib
+from functools import partial
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'NUMISMATIC-RECORDING-1\n'
+FRAME = struct.Struct('<dHBI')
+
+
+def _class_path(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def _import_class(class_path):
+    module_name, _, class_name = class_path.rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+@attr.s
+class Recorder:
+    '''Writes the packets received by websocket clients to a recording'''
+
+    path = attr.ib()
+    clients = attr.ib()
+    frames = attr.ib(default=0)
+    _file = attr.ib(default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        header = dict(clients=[
+            dict(id=client_id, client=_class_path(type(client)),
+                 exchange=client.exchange,
+                 subscriptions=[(subscription.symbol, subscription.channel)
+                                for subscription in client.subscriptions])
+            for client_id, client in enumerate(self.clients)])
+        logger.info(f'Recording {len(self.clients)} clients to '
+                    f'{self.path!r} ...')
+        self._file = gzip.open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._file.write(json.dumps(header).encode('utf-8')+b'\n')
+        for client_id, client in enumerate(self.clients):
+            client.packet_stream.sink(partial(self.write, client_id))
+        atexit.register(self.close)
+
+    def write(self, client_id, frame):
+        recv_time, packet = frame
+        is_text = isinstance(packet, str)
+        data = packet.encode('utf-8') if is_text else packet
+        self._file.write(FRAME.pack(recv_time, client_id, is_text, len(data)))
+        self._file.write(data)
+        self.frames += 1
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            logger.info(f'Recorded {self.frames} frames to {self.path!r}')
+            self._file.close()
+
+
+def read_recording(path):
+    '''Returns the header and an iterator over the frames of a recording
+
+    The frames are (receive time, client id, packet) tuples.
+    '''
+    file = gzip.open(path, 'rb')
+    if file.readline()!=MAGIC:
+        file.close()
+        raise ValueError(f'{path!r} is not a numismatic recording')
+    header = json.loads(file.readline().decode('utf-8'))
+
+    def _frames():
+        with file:
+            while True:
+                prefix = file.read(FRAME.size)
+                if len(prefix)<FRAME.size:
+                    return
+                recv_time, client_id, is_text, length = FRAME.unpack(prefix)
+                packet = file.read(length)
+                if is_text:
+                    packet = packet.decode('utf-8')
+                yield recv_time, client_id, packet
+
+    return header, _frames()
+
+
+@attr.s
+class ReplaySocket:
+    '''Stands in for a websocket, serving recorded packets from recv()'''
+
+    frames = attr.ib(default=attr.Factory(partial(asyncio.Queue, 1000)),
+                     repr=False)
+    sent = attr.ib(default=0)
+    open = attr.ib(default=True)
+
+    async def recv(self):
+        return await self.frames.get()
+
+    async def send(self, packet):
+        # requests to the exchange go nowhere, the replies are recorded
+        logger.debug(packet)
+        self.sent += 1
+
+    async def close(self):
+        self.open = False
+
+
+@attr.s
+class Replayer:
+    '''Replays a recording through freshly created websocket clients
+
+    speed is a multiple of real time, 0 replays as fast as the clients can
+    handle the packets.
+    '''
+
+    path = attr.ib()
+    speed = attr.ib(default=1.0, convert=float)
+    clients = attr.ib(default=attr.Factory(list), repr=False)
+    stats = attr.ib(default=attr.Factory(dict))
+    _frames = attr.ib(default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        header, self._frames = read_recording(self.path)
+        for client_info in header['clients']:
+            client_class = _import_class(client_info['client'])
+            client = client_class(websocket=ReplaySocket(), overflow='block',
+                                  replaying=True)
+            for symbol, channel in client_info['subscriptions']:
+                client.listen(symbol, channel)
+            self.clients.append(client)
+
+    @property
+    def subscriptions(self):
+        return {subscription.market_name: subscription
+                for client in self.clients
+                for subscription in client.subscriptions}
+
+    async def run(self):
+        # let the subscriptions install their handshake handlers first
+        await asyncio.sleep(0)
+        while any(client._pending for client in self.clients):
+            await asyncio.sleep(0.01)
+        logger.info(f'Replaying {self.path!r} at '
+                    f'{self.speed or "max"} speed ...')
+        frames = 0
+        start = time.time()
+        first = None
+        for recv_time, client_id, packet in self._frames:
+            if self.speed:
+                if first is None:
+                    first = recv_time
+                delay = start+(recv_time-first)/self.speed-time.time()
+                if delay>0:
+                    await asyncio.sleep(delay)
+            await self.clients[client_id].websocket.frames.put(packet)
+            frames += 1
+        # wait for the clients to handle everything
+        while any(not client.websocket.frames.empty() or len(client._queue)
+                  for client in self.clients):
+            await asyncio.sleep(0.001)
+        elapsed = time.time()-start
+        self.stats.update(frames=frames, elapsed=elapsed,
+                          frames_per_second=frames/elapsed if elapsed else 0)
+        logger.info(f'Replayed {frames} frames in {elapsed:.3f}s')
+        for client in self.clients:
+            client.close()
+        return self.stats
@@ -1,25 +1,52 @@
 import logging
+import asyncio
+import atexit
+import hashlib
 import requests
 import time
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
 from pathlib import Path
 from functools import partial
-import gzip
-from urllib.parse import urlparse, urlencode
+from urllib.parse import urlparse
 import pickle
 
 import attr
 from appdirs import user_cache_dir
 
+from .config import config_item_getter
+from .libs import codec
+from .libs.ratelimit import rate_limits
+from .libs.cachestore import CacheStore, CacheEntry
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 
 log = logging.getLogger(__name__)
 
 
 LIBRARY_NAME = 'numismatic'
+CACHE_FILE_NAME = 'responses.sqlite'
 
 
 @attr.s
 class Requester:
-    "Basic Requester using requests and blocking calls"
+    """Basic Requester using requests and blocking calls
+
+    Concurrent requests for the same url and params share a single request
+    and all get its response, see _single_flight(). Such calls are counted
+    as coalesced in stats.
+    """
+
+    stats = attr.ib(default=attr.Factory(Counter))
+    _in_flight = attr.ib(default=attr.Factory(dict), repr=False)
+    _in_flight_tasks = attr.ib(default=attr.Factory(dict), repr=False)
+    _in_flight_lock = attr.ib(default=attr.Factory(threading.Lock),
+                              repr=False)
 
     @classmethod
     def factory(cls, requester, **kwargs):
@@ -29,63 +56,383 @@ class Requester:
             subcls = Requester
         elif requester in {'caching'}:
             subcls = CachingRequester
+        elif requester in {'async'}:
+            subcls = AsyncRequester
         else:
             raise NotImplementedError(f'requester={requester}')
+        # None leaves the default, e.g. cache_dir without coin --cache-dir
         kwds = {field.name:kwargs[field.name] for field in
-                attr.fields(subcls) if field.name in kwargs}
+                attr.fields(subcls)
+                if kwargs.get(field.name) is not None}
         return subcls(**kwds)
 
     def get(self, url, params=None, headers=None):
+        return self._single_flight(url, params, headers)
+
+    def _get(self, url, params=None, headers=None):
+        rate_limits.acquire_sync(urlparse(url).netloc)
         response = requests.get(url, params=params, headers=headers)
         return response
 
+    async def get_async(self, url, params=None, headers=None):
+        return await self._single_flight_async(url, params, headers)
+
+    async def _get_async(self, url, params=None, headers=None):
+        '''Runs the blocking get() in an executor off the event loop'''
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, partial(self.get, url, params=params, headers=headers))
+
+    @staticmethod
+    def _get_flight_key(url, params=None):
+        params = () if not params else tuple(sorted(
+            (key, str(value)) for key, value in params.items()
+            if value is not None))
+        return url, params
+
+    def _single_flight(self, url, params=None, headers=None):
+        '''Makes the request with _get() unless it is already in flight'''
+        key = self._get_flight_key(url, params)
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            return future.result()
+        try:
+            response = self._get(url, params=params, headers=headers)
+            future.set_result(response)
+            return response
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+
+    async def _single_flight_async(self, url, params=None, headers=None):
+        '''Awaits _get_async() unless the request is already in flight'''
+        # tasks can only be awaited on the loop that runs them
+        key = (asyncio.get_event_loop(), self._get_flight_key(url, params))
+        task = self._in_flight_tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._get_async(url, params=params, headers=headers))
+            self._in_flight_tasks[key] = task
+            task.add_done_callback(
+                lambda task: self._in_flight_tasks.pop(key, None))
+        else:
+            self.stats['coalesced'] += 1
+        # one caller giving up must not cancel the request for the others
+        return await asyncio.shield(task)
+
+
+@attr.s
+class Response:
+    "The parts of an HTTP response that the feeds use"
+
+    url = attr.ib()
+    status_code = attr.ib(convert=int)
+    headers = attr.ib(default=attr.Factory(dict), repr=False)
+    content = attr.ib(default=b'', repr=False)
+
+    @property
+    def ok(self):
+        return self.status_code<400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return codec.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f'{self.status_code} for {self.url}',
+                                     response=self)
+
+
+# seconds that the responses of an endpoint stay fresh, None for forever
+DEFAULT_TTLS = {
+    'coinlist': 24*60*60,
+    'price': 5,
+    'pricemulti': 5,
+    'pricemultifull': 5,
+    'tickers': 5,
+    # the candles up to now, closed candles are cached forever
+    'histoday': 60,
+    'histohour': 60,
+    'histominute': 60,
+}
+
+# candle length in seconds of the historical endpoints
+CANDLE_PERIODS = {'histoday': 24*60*60, 'histohour': 60*60, 'histominute': 60}
+
 
 @attr.s
 class CachingRequester(Requester):
+    """Requester that caches successful responses in memory and on disk
+
+    Responses are fresh for the ttls of their endpoint, or default_ttl
+    seconds for other endpoints, see _get_ttl(). The memory_size most
+    recently used responses are also kept in memory. On disk the responses
+    live in a single CacheStore file in cache_dir and once it exceeds
+    max_disk_size MB the least recently used responses are removed. Hits,
+    misses and evictions are counted in stats. The requester may be used
+    from several threads, e.g. by a Backfill.
+    """
 
     cache_dir = \
         attr.ib(default=attr.Factory(partial(user_cache_dir, LIBRARY_NAME)),
                 convert=Path)
+    ttls = attr.ib(default=attr.Factory(lambda: dict(DEFAULT_TTLS)))
+    default_ttl = attr.ib(default=attr.Factory(
+        config_item_getter('DEFAULT', 'cache_ttl')), convert=float)
+    memory_size = attr.ib(default=attr.Factory(
+        config_item_getter('DEFAULT', 'cache_memory_size')), convert=int)
+    max_disk_size = attr.ib(default=attr.Factory(
+        config_item_getter('DEFAULT', 'cache_max_size')), convert=float)
+    store = attr.ib(default=None, repr=False)
+    _memory = attr.ib(default=attr.Factory(OrderedDict), repr=False)
+    # guards _memory and stats, the store has its own lock
+    _lock = attr.ib(default=attr.Factory(threading.RLock), repr=False)
 
-    def _get_path(self, url, params=None):
-        parts = urlparse(url)
-        path = self.cache_dir / parts.netloc / parts.path.strip('/')
-        if params:
-            path /= urlencode(params)
-        return path
+    def __attrs_post_init__(self):
+        if self.store is None:
+            self.store = CacheStore(self.cache_dir / CACHE_FILE_NAME)
+            if self.store.created:
+                self.import_directory(self.cache_dir)
+            atexit.register(self.store.close)
+
+    @staticmethod
+    def _get_url(url, params=None):
+        '''The full url as requests would send it'''
+        return requests.Request('GET', url, params=params).prepare().url
+
+    @staticmethod
+    def _get_key(full_url):
+        return hashlib.sha1(full_url.encode('utf-8')).hexdigest()
+
+    def _get_ttl(self, url, params=None):
+        endpoint = urlparse(url).path.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint in CANDLE_PERIODS and params and \
+                params.get('toTs') is not None and \
+                float(params['toTs'])+CANDLE_PERIODS[endpoint]<=time.time():
+            # all the candles have closed so will never change
+            return None
+        return self.ttls.get(endpoint, self.default_ttl)
 
     def get(self, url, params=None, headers=None, use_cache=True):
-        path = self._get_path(url, params=params, headers=headers)
-        if use_cache and path.exists():
-            try:
-                return pickle.load(path.open('rb'))
-            except:
-                # Couldn't load cached response so make request
-                log.error(f'Couldn\'t load {path}.')
+        key = self._get_key(self._get_url(url, params))
+        now = time.time()
+        if use_cache:
+            response = self._load(key, self._get_ttl(url, params), now)
+            if response is not None:
+                return response
+        self._count('misses')
         log.debug(f'Retrieving {url} ...')
-        response = super().get(url, params=params)
+        response = super().get(url, params=params, headers=headers)
         # FIXME: should this raise if unsuccessful?
-        if not path.parent.exists():
-            log.debug(f'Creating {path.parent} ...')
-            path.parent.mkdir(parents=True)
-        log.debug(f'Saving {path} ...')
-        pickle.dump(response, path.open('wb'))
+        if response.ok:
+            self._store(key, Response(url=response.url,
+                                      status_code=response.status_code,
+                                      headers=dict(response.headers),
+                                      content=response.content), now)
+        return response
+
+    @staticmethod
+    def _is_fresh(saved_at, ttl, now):
+        return ttl is None or now-saved_at<ttl
+
+    def _count(self, stat, count=1):
+        with self._lock:
+            self.stats[stat] += count
+
+    def _load(self, key, ttl, now):
+        with self._lock:
+            if key in self._memory:
+                saved_at, response = self._memory[key]
+                if self._is_fresh(saved_at, ttl, now):
+                    self._memory.move_to_end(key)
+                    self.store.touch(key, now)
+                    self.stats['memory_hits'] += 1
+                    return response
+                # the disk copy is the same age
+                del self._memory[key]
+                self.stats['expired'] += 1
+                return
+        entry = self.store.get(key)
+        if entry is None:
+            return
+        if not self._is_fresh(entry.saved_at, ttl, now):
+            self._count('expired')
+            return
+        response = Response(url=entry.url, status_code=entry.status,
+                            headers=entry.headers, content=entry.body)
+        self.store.touch(key, now)
+        self._remember(key, (entry.saved_at, response))
+        self._count('disk_hits')
         return response
-        # if str(path).endswith('.gz'):
-        #     opener = partial(gzip.open, mode='wb')
-        # else:
-        #     opener = partial(open, mode='wt')
-        # path = request_dir / filename
-        # log.debug(f'Saving {path} ...')
-        # with open(path) as f:
-        #     for chunk in response.iter_content(chunk_size=1024):
-        #         f.write(chunk)
-        # return response
 
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory)>self.memory_size:
+                self._memory.popitem(last=False)
+                self.stats['memory_evictions'] += 1
 
+    def _store(self, key, response, saved_at):
+        self._remember(key, (saved_at, response))
+        self.store.put(key, CacheEntry(url=response.url, saved_at=saved_at,
+                                       status=response.status_code,
+                                       headers=response.headers,
+                                       body=response.content))
+        max_size = self.max_disk_size*2**20
+        if self.store.size>max_size:
+            # evict down to 90% of the cap so as not to evict on every put
+            evicted = self.store.evict(0.9*max_size)
+            with self._lock:
+                for key in evicted:
+                    self._memory.pop(key, None)
+                self.stats['disk_evictions'] += len(evicted)
+            log.info(f'Evicted {len(evicted)} cached responses')
+
+    def import_directory(self, cache_dir):
+        '''Imports the pickled responses of the old one file per url cache
+
+        Returns the number of responses imported.
+        '''
+        imported = 0
+        for path in Path(cache_dir).rglob('*'):
+            if not path.is_file() or path.name.startswith(CACHE_FILE_NAME):
+                continue
+            try:
+                with path.open('rb') as file:
+                    entry = pickle.load(file)
+            except Exception:
+                log.debug(f'Skipping {path} ...')
+                continue
+            if not isinstance(entry, tuple):
+                # cached before entries were timestamped
+                entry = (path.stat().st_mtime, entry)
+            saved_at, response = entry
+            if not getattr(response, 'ok', False):
+                continue
+            self.store.put(self._get_key(response.url),
+                           CacheEntry(url=response.url, saved_at=saved_at,
+                                      status=response.status_code,
+                                      headers=dict(response.headers),
+                                      body=response.content))
+            imported += 1
+        self.store.flush()
+        if imported:
+            log.info(f'Imported {imported} cached responses from '
+                     f'{cache_dir}')
+        return imported
+
+
+@attr.s
 class AsyncRequester(Requester):
-    "Asynchronous requester with rate limiting"
+    """Asynchronous requester with pooled connections and rate limiting
+
+    Every host gets its own keep-alive connection pool and is rate limited
+    by libs.ratelimit.rate_limits. At most max_concurrency requests are in
+    flight per event loop.
+
+    The blocking get() may be called from any thread. It runs the request
+    on a private event loop thread, so calls from several threads share
+    its connection pools.
+    """
+
+    max_concurrency = attr.ib(default=attr.Factory(
+        config_item_getter('DEFAULT', 'max_concurrency')), convert=int)
+    timeout = attr.ib(default=attr.Factory(
+        config_item_getter('DEFAULT', 'request_timeout')), convert=float)
+    # by (event loop, host) and event loop as neither can change loops
+    _sessions = attr.ib(default=attr.Factory(dict), repr=False)
+    _semaphores = attr.ib(default=attr.Factory(dict), repr=False)
+    _loop = attr.ib(default=None, repr=False)
+    _loop_lock = attr.ib(default=attr.Factory(threading.Lock), repr=False)
+
+    @staticmethod
+    def available():
+        return aiohttp is not None
+
+    def __attrs_post_init__(self):
+        if aiohttp is None:
+            raise ImportError('You need to have aiohttp installed to use the '
+                              'AsyncRequester. Install it with:\n'
+                              '\n'
+                              '   pip install aiohttp'
+                              '\n')
+        atexit.register(self.shutdown)
+
+    def get(self, url, params=None, headers=None):
+        future = asyncio.run_coroutine_threadsafe(
+            self.get_async(url, params=params, headers=headers),
+            self._get_loop())
+        return future.result()
+
+    def _get_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever,
+                                 name='AsyncRequester', daemon=True).start()
+        return self._loop
+
+    async def _get_async(self, url, params=None, headers=None):
+        host = urlparse(url).netloc
+        if params:
+            # requests drops None params, aiohttp refuses them
+            params = {key: str(value) for key, value in params.items()
+                      if value is not None}
+        loop = asyncio.get_event_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphores[loop]:
+            await rate_limits.acquire(host)
+            log.debug(f'Retrieving {url} ...')
+            session = self._get_session(loop, host)
+            async with session.get(url, params=params,
+                                   headers=headers) as response:
+                content = await response.read()
+                return Response(url=str(response.url),
+                                status_code=response.status,
+                                headers=dict(response.headers),
+                                content=content)
+
+    def _get_session(self, loop, host):
+        key = (loop, host)
+        if key not in self._sessions or self._sessions[key].closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.max_concurrency)
+            self._sessions[key] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._sessions[key]
+
+    async def close(self):
+        '''Closes the sessions of the running event loop'''
+        loop = asyncio.get_event_loop()
+        for key in [key for key in self._sessions if key[0] is loop]:
+            await self._sessions.pop(key).close()
 
-    def get(self, url, path=None):
-        raise NotImplementedError()
+    def shutdown(self):
+        '''Closes the sessions of every event loop and stops the private one
 
+        This is registered with atexit, by when the loops are no longer
+        running.
+        '''
+        for loop in {loop for loop, host in self._sessions}:
+            if loop is self._loop:
+                asyncio.run_coroutine_threadsafe(self.close(), loop).result()
+            elif not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(self.close())
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,232 @@
+"""Sharded ingestion across worker processes
+
+Every worker process runs its own event loop and websocket/rest clients for
+the markets that hash to its shard. Decoding and event construction happen in
+the workers and the events, and optionally the raw packets, are sent back to
+the parent in batches where they are re-emitted on proxy Subscriptions, so
+the parent's collect/compare pipeline is unchanged.
+"""
+import logging
+import asyncio
+import multiprocessing
+import queue
+import time
+from functools import partial
+
+import attr
+
+from .feeds import Feed
+from .feeds.base import Subscription
+from .libs import codec
+
+logger = logging.getLogger(__name__)
+
+# Forking would copy the parent's event loop along with all its scheduled
+# tasks so the workers are started from scratch.
+_context = multiprocessing.get_context('spawn')
+
+# seconds to wait for all workers to report their subscriptions
+READY_TIMEOUT = 60
+# seconds between checks that the listening workers are still alive
+CHECK_INTERVAL = 1
+
+
+@attr.s
+class _Outbox:
+    '''Collects the items emitted in a worker and sends them in batches'''
+
+    queue = attr.ib()
+    interval = attr.ib(default=0.01)
+    items = attr.ib(default=attr.Factory(list), repr=False)
+
+    def put(self, market_name, stream_name, item):
+        self.items.append((market_name, stream_name, item))
+
+    async def flush(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.items:
+                items, self.items = self.items, []
+                self.queue.put(('data', items))
+
+
+def _worker_main(feed, shard, workers, assets, currencies, channels,
+                 exchange, interval, max_channels, stale_timeout, out_queue,
+                 log_level, codec_name, requester, cache_dir, streams):
+    logging.basicConfig(level=log_level)
+    codec.set_codec(codec_name)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        feed_client = Feed.factory(feed, max_channels=max_channels,
+                                   cache_dir=cache_dir, requester=requester)
+        subscriptions = feed_client.subscribe(
+            assets, currencies, channels, exchange=exchange,
+            interval=interval, shard=(shard, workers),
+            stale_timeout=stale_timeout)
+    except Exception as ex:
+        out_queue.put(('error', shard, repr(ex)))
+        raise
+    outbox = _Outbox(queue=out_queue)
+    markets = []
+    for market_name, subscription in subscriptions.items():
+        markets.append((market_name, subscription.exchange,
+                        subscription.symbol, subscription.channel))
+        # only send what the parent uses as it has to unpickle and emit it
+        for stream_name in streams:
+            getattr(subscription, stream_name).sink(
+                partial(outbox.put, market_name, stream_name))
+    out_queue.put(('ready', shard, markets))
+    if not markets:
+        return
+    logger.info(f'Worker {shard} listening to {len(markets)} markets ...')
+    asyncio.ensure_future(outbox.flush())
+    loop.run_forever()
+
+
+@attr.s
+class WorkerPool:
+    '''Runs the subscriptions of a Feed sharded over worker processes
+
+    Only the event_stream of the subscriptions is sent back from the
+    workers, and their raw_stream too if raw is set.
+    '''
+
+    feed = attr.ib()
+    workers = attr.ib(convert=int)
+    # passed on to the Feed in every worker
+    requester = attr.ib(default='base')
+    cache_dir = attr.ib(default=None)
+    raw = attr.ib(default=False)
+    subscriptions = attr.ib(default=attr.Factory(dict), repr=False)
+    processes = attr.ib(default=attr.Factory(list), repr=False)
+    queue = attr.ib(default=None, repr=False)
+    # market names by shard of the workers that are listening
+    _listening = attr.ib(default=attr.Factory(dict), repr=False)
+
+    def subscribe(self, assets, currencies, channels, exchange=None,
+                  interval=1.0, max_channels=None, stale_timeout=None):
+        '''Starts the workers and returns proxy subscriptions
+
+        Blocks until every worker has reported its subscriptions.
+        '''
+        self.queue = _context.Queue()
+        for shard in range(self.workers):
+            process = _context.Process(
+                target=_worker_main,
+                args=(self.feed, shard, self.workers, assets, currencies,
+                      channels, exchange, interval, max_channels,
+                      stale_timeout, self.queue, logging.getLogger().level,
+                      codec.name, self.requester, self.cache_dir,
+                      self.streams),
+                daemon=True)
+            logger.info(f'Starting {self.feed} worker {shard} ...')
+            process.start()
+            self.processes.append(process)
+        backlog = []
+        ready = set()
+        deadline = time.monotonic()+READY_TIMEOUT
+        while len(ready)<self.workers:
+            try:
+                msg = self.queue.get(timeout=1)
+            except queue.Empty:
+                self._check_startup(ready, deadline)
+                continue
+            if msg[0]=='ready':
+                _, shard, markets = msg
+                for market_name, exchange, symbol, channel in markets:
+                    self.subscriptions[market_name] = Subscription(
+                        exchange=exchange, symbol=symbol, channel=channel,
+                        client=self)
+                if markets:
+                    self._listening[shard] = [market[0] for market in markets]
+                ready.add(shard)
+            elif msg[0]=='error':
+                self.stop()
+                raise RuntimeError(f'Worker {msg[1]} failed: {msg[2]}')
+            else:
+                backlog.append(msg)
+        asyncio.ensure_future(self._listener(backlog))
+        return dict(self.subscriptions)
+
+    def _check_startup(self, ready, deadline):
+        '''Raises RuntimeError if a worker died or the workers are too slow
+
+        ready are the shards that have reported their subscriptions. Those
+        workers may already have exited if they had nothing to listen to.
+        '''
+        for shard, process in enumerate(self.processes):
+            if shard not in ready and not process.is_alive():
+                self.stop()
+                raise RuntimeError(f'Worker {shard} exited with code '
+                                   f'{process.exitcode} before subscribing')
+        if time.monotonic()>deadline:
+            self.stop()
+            missing = sorted(set(range(self.workers))-ready)
+            raise RuntimeError(f'Workers {missing} did not subscribe within '
+                               f'{READY_TIMEOUT}s')
+
+    @property
+    def streams(self):
+        '''The subscription streams that the workers send back'''
+        return ('event_stream', 'raw_stream') if self.raw else \
+            ('event_stream',)
+
+    def _check_workers(self):
+        '''Logs the workers that have died since they started listening
+
+        Their markets get no more events so this is reported once per
+        worker, and a RuntimeError is raised once all of them are gone.
+        '''
+        died = False
+        for shard, market_names in list(self._listening.items()):
+            process = self.processes[shard]
+            if not process.is_alive():
+                died = True
+                del self._listening[shard]
+                logger.error(f'Worker {shard} exited with code '
+                             f'{process.exitcode}, no more events for '
+                             f'{", ".join(market_names)}')
+        if died and not self._listening:
+            raise RuntimeError('All workers have exited')
+
+    def _get(self):
+        try:
+            return self.queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def _handle_msg(self, msg):
+        if msg[0]=='data':
+            for market_name, stream_name, item in msg[1]:
+                subscription = self.subscriptions[market_name]
+                getattr(subscription, stream_name).emit(item)
+        elif msg[0]=='error':
+            logger.error(f'Worker {msg[1]} failed: {msg[2]}')
+
+    async def _listener(self, backlog=()):
+        loop = asyncio.get_event_loop()
+        try:
+            for msg in backlog:
+                self._handle_msg(msg)
+            next_check = time.monotonic()
+            while True:
+                msg = await loop.run_in_executor(None, self._get)
+                if msg is not None:
+                    self._handle_msg(msg)
+                if time.monotonic()>=next_check:
+                    self._check_workers()
+                    next_check = time.monotonic()+CHECK_INTERVAL
+        except asyncio.CancelledError:
+            self.stop()
+            raise
+
+    async def _subscribe(self, subscription):
+        # the workers do the subscribing
+        pass
+
+    def stop(self):
+        for process in self.processes:
+            if process.is_alive():
+                logger.debug(f'Terminating worker {process.pid} ...')
+                process.terminate()
@@ -24,6 +24,9 @@ setup(name='numismatic',
       python_requires='~=3.6',
       extras_require={
         'SQL': ['sqlalchemy'],
+        'JSON': ['ujson'],
+        'ASYNC': ['aiohttp'],
+        'NUMPY': ['numpy'],
         },
       zip_safe=False,
       entry_points='''
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+import websockets.exceptions
+
+
+def run(coro):
+    """Runs coro on a fresh event loop like asyncio.run(), which is 3.7+"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        all_tasks = getattr(asyncio, 'all_tasks', None) or \
+            asyncio.Task.all_tasks
+        tasks = all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class Disconnected(websockets.exceptions.ConnectionClosed):
+    """ConnectionClosed without the frames its constructor wants"""
+
+    def __init__(self):
+        Exception.__init__(self)
+
+    def __str__(self):
+        return 'connection lost'
+
+
+class FakeWebsocket:
+    """Stands in for a websockets connection, frames are fed by the test"""
+
+    def __init__(self):
+        self.frames = asyncio.Queue()
+        self.sent = []
+        self.closed = 0
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+    async def recv(self):
+        frame = await self.frames.get()
+        if frame is None:
+            raise Disconnected()
+        return frame
+
+    async def close(self):
+        self.closed += 1
+
+    def feed(self, msg):
+        self.frames.put_nowait(json.dumps(msg))
+
+    def disconnect(self):
+        """Makes recv() raise ConnectionClosed once the frames are read"""
+        self.frames.put_nowait(None)
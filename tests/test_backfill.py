@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from numismatic.libs.backfill import Backfill, BackfillError
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    slept = []
+    monkeypatch.setattr('numismatic.libs.backfill.time.sleep', slept.append)
+    return slept
+
+
+def test_failed_chunks_are_retried_with_backoff(slept):
+    attempts = []
+
+    def fetch(chunk):
+        attempts.append(chunk)
+        if chunk=='flaky' and attempts.count(chunk)<3:
+            raise IOError('timed out')
+        return chunk.upper()
+
+    backfill = Backfill(fetch, max_workers=2, retries=3, retry_delay=0.5)
+    assert sorted(backfill.run(['flaky', 'fine']))==[('fine', 'FINE'),
+                                                     ('flaky', 'FLAKY')]
+    assert slept==[0.5, 1.0]
+    assert backfill.stats=={'retries': 2, 'done': 2}
+
+
+def test_chunks_that_keep_failing_are_raised_at_the_end(slept):
+    def fetch(chunk):
+        if chunk%2:
+            raise ValueError(chunk)
+        return chunk
+
+    backfill = Backfill(fetch, max_workers=2, retries=1, retry_delay=0.1)
+    results = []
+    with pytest.raises(BackfillError) as error:
+        for chunk, result in backfill.run(range(5)):
+            results.append(result)
+    assert sorted(results)==[0, 2, 4]
+    assert sorted(chunk for chunk, ex in error.value.failed)==[1, 3]
+    assert backfill.stats['failed']==2
+    assert backfill.stats['retries']==2
+
+
+def test_chunks_are_taken_lazily():
+    taken = []
+
+    def chunks():
+        for chunk in range(100):
+            taken.append(chunk)
+            yield chunk
+
+    backfill = Backfill(lambda chunk: chunk, max_workers=2)
+    results = backfill.run(chunks())
+    next(results)
+    # the first 2*max_workers chunks plus one to replace the done chunk
+    assert len(taken)<=5
+    assert len(list(results))==99
+
+
+def test_ordered_results_follow_the_chunks():
+    def fetch(chunk):
+        # the earlier chunks take longer
+        time.sleep(0.001*(10-chunk))
+        return chunk
+
+    backfill = Backfill(fetch, max_workers=4)
+    assert [result for chunk, result in backfill.run(range(10),
+                                                     ordered=True)] == \
+        list(range(10))
+
+
+def test_a_slow_chunk_holds_back_the_chunks_after_it():
+    release = threading.Event()
+    taken = []
+
+    def chunks():
+        for chunk in range(100):
+            taken.append(chunk)
+            yield chunk
+
+    def fetch(chunk):
+        if chunk==0:
+            release.wait(1)
+        return chunk
+
+    backfill = Backfill(fetch, max_workers=2, max_ahead=4)
+    results = backfill.run(chunks())
+    assert sorted(next(results)[0] for _ in range(3))==[1, 2, 3]
+    assert taken==[0, 1, 2, 3]
+    release.set()
+    assert sorted(chunk for chunk, result in results)==[0]+list(range(4, 100))
+
+
+def test_chunks_after_a_failed_one_are_still_yielded_in_order(slept):
+    def fetch(chunk):
+        if chunk==0:
+            raise IOError('timed out')
+        return chunk
+
+    backfill = Backfill(fetch, max_workers=2, retries=0, max_ahead=4)
+    results = []
+    with pytest.raises(BackfillError) as error:
+        for chunk, result in backfill.run(range(10), ordered=True):
+            results.append(result)
+    assert results==list(range(1, 10))
+    assert [chunk for chunk, ex in error.value.failed]==[0]
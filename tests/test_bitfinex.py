@@ -0,0 +1,206 @@
+import asyncio
+import json
+from collections import defaultdict
+
+import pytest
+
+from numismatic.events import Reconnect, Trade, TradeSnapshot
+from numismatic.feeds import base
+from numismatic.feeds.bitfinex import BitfinexFeed, BitfinexWebsocketClient
+
+from .fakes import FakeWebsocket, run
+
+
+def test_info_events_are_handled_once_per_connection():
+    async def main():
+        websocket = FakeWebsocket()
+        client = BitfinexWebsocketClient(websocket=websocket,
+                                         subscribe_window=0)
+        subscription = client.listen('BTCUSD', 'TRADES')
+        events = []
+        subscription.event_stream.sink(events.append)
+        websocket.feed({'event': 'info', 'version': 2})
+        await asyncio.sleep(0.01)
+        websocket.feed({'event': 'subscribed', 'channel': 'trades',
+                        'chanId': 10, 'pair': 'BTCUSD'})
+        await asyncio.sleep(0.01)
+        handlers = list(subscription.handlers)
+        # as after a reconnect
+        websocket.feed({'event': 'info', 'version': 2})
+        websocket.feed([10, 'tu', [1, 1500000000000, 0.5, 4000]])
+        await asyncio.sleep(0.01)
+        client.close()
+        assert client.connection_status=={'event': 'info', 'version': 2}
+        assert subscription.handlers==handlers
+        assert not [handler for handler in handlers
+                    if 'connect' in handler.__name__]
+        assert [type(event) for event in events]==[Trade]
+    run(main())
+
+
+def test_subscriptions_in_a_window_are_sent_in_one_burst():
+    async def main():
+        websocket = FakeWebsocket()
+        client = BitfinexWebsocketClient(websocket=websocket,
+                                         subscribe_window=0.01)
+        trades = client.listen('BTCUSD', 'TRADES')
+        ticker = client.listen('ETHUSD', 'TICKER')
+        await asyncio.sleep(0)
+        assert websocket.sent==[]
+        await asyncio.sleep(0.05)
+        assert [json.loads(msg) for msg in websocket.sent] == \
+            [{'event': 'subscribe', 'channel': 'TRADES', 'symbol': 'BTCUSD'},
+             {'event': 'subscribe', 'channel': 'TICKER', 'symbol': 'ETHUSD'}]
+        websocket.feed({'event': 'subscribed', 'channel': 'ticker',
+                        'chanId': 11, 'pair': 'ETHUSD'})
+        websocket.feed({'event': 'subscribed', 'channel': 'trades',
+                        'chanId': 10, 'pair': 'BTCUSD'})
+        await asyncio.sleep(0.01)
+        del websocket.sent[:]
+        await client._unsubscribe_all([trades, ticker])
+        client.close()
+        assert client._channels=={}
+        assert [json.loads(msg) for msg in websocket.sent] == \
+            [{'event': 'unsubscribe', 'chanId': 10},
+             {'event': 'unsubscribe', 'chanId': 11}]
+    run(main())
+
+
+def test_reconnect_backs_off_and_resubscribes(monkeypatch):
+    old, new = FakeWebsocket(), FakeWebsocket()
+    attempts = []
+
+    async def connect(url):
+        attempts.append(url)
+        if len(attempts)==1:
+            raise OSError('connection refused')
+        return new
+
+    delays = []
+
+    def uniform(low, high):
+        delays.append(high)
+        return 0
+
+    monkeypatch.setattr('websockets.connect', connect)
+    monkeypatch.setattr('numismatic.feeds.base.random.uniform', uniform)
+
+    async def main():
+        client = BitfinexWebsocketClient(websocket=old, subscribe_window=0,
+                                         reconnect_delay=1,
+                                         max_reconnect_delay=1.5)
+        subscription = client.listen('BTCUSD', 'TRADES')
+        events = []
+        subscription.event_stream.sink(events.append)
+        await asyncio.sleep(0.01)
+        old.feed({'event': 'subscribed', 'channel': 'trades',
+                  'chanId': 10, 'pair': 'BTCUSD'})
+        await asyncio.sleep(0.01)
+        old.disconnect()
+        await asyncio.sleep(0.01)
+        assert delays==[1, 1.5]
+        assert client.websocket is new
+        assert client._channels=={}
+        assert [type(event) for event in events]==[Reconnect]
+        assert events[0].attempts==2
+        assert [json.loads(msg) for msg in new.sent] == \
+            [{'event': 'subscribe', 'channel': 'TRADES', 'symbol': 'BTCUSD'}]
+        # the new connection numbers its channels afresh
+        new.feed({'event': 'subscribed', 'channel': 'trades',
+                  'chanId': 20, 'pair': 'BTCUSD'})
+        new.feed([20, 'tu', [1, 1500000000000, 0.5, 4000]])
+        await asyncio.sleep(0.01)
+        client.close()
+        assert [type(event) for event in events]==[Reconnect, Trade]
+    run(main())
+
+
+@pytest.mark.parametrize('snapshot_rows', [False, True])
+def test_trade_snapshots(snapshot_rows):
+    async def main():
+        websocket = FakeWebsocket()
+        client = BitfinexWebsocketClient(websocket=websocket,
+                                         subscribe_window=0,
+                                         snapshot_rows=snapshot_rows)
+        subscription = client.listen('BTCUSD', 'TRADES')
+        events = []
+        subscription.event_stream.sink(events.append)
+        await asyncio.sleep(0.01)
+        websocket.feed({'event': 'subscribed', 'channel': 'trades',
+                        'chanId': 10, 'pair': 'BTCUSD'})
+        # newest first
+        websocket.feed([10, [[2, 1500000001000, -0.25, 4001],
+                             [1, 1500000000000, 0.5, 4000]]])
+        await asyncio.sleep(0.01)
+        client.close()
+        return events
+    events = run(main())
+    if snapshot_rows:
+        trades = events
+    else:
+        assert [type(event) for event in events]==[TradeSnapshot]
+        snapshot, = events
+        assert len(snapshot)==2
+        assert snapshot.latest().id=='2'
+        trades = list(snapshot.rows())
+    assert [type(event) for event in trades]==[Trade, Trade]
+    assert [(trade.id, trade.price, trade.volume, trade.timestamp)
+            for trade in trades] == \
+        [('1', 4000, 0.5, 1500000000), ('2', 4001, -0.25, 1500000001)]
+
+
+@pytest.mark.parametrize('max_channels, pooled', [
+    (None, [25, 5]),
+    (10, [10, 10, 10]),
+    # the exchange's own limit still applies
+    (100, [25, 5]),
+])
+def test_subscriptions_fill_pooled_connections_up_to_the_limit(
+        monkeypatch, max_channels, pooled):
+    monkeypatch.setattr(base, '_websocket_client_pool', defaultdict(list))
+
+    async def main():
+        feed = BitfinexFeed(max_channels=max_channels)
+        assets = [f'C{index:02d}' for index in range(30)]
+        feed.subscribe(assets, 'USD', 'trades', stale_timeout=0)
+        clients = base._websocket_client_pool[BitfinexWebsocketClient]
+        for client in clients:
+            # before the clients get to connect
+            client.websocket = FakeWebsocket()
+            client.close()
+        await asyncio.sleep(0)
+        assert feed.websocket_client is clients[0]
+        assert [len(client.subscriptions) for client in clients]==pooled
+    run(main())
+
+
+def test_duplicate_subscriptions_get_their_own_connections(monkeypatch):
+    monkeypatch.setattr(base, '_websocket_client_pool', defaultdict(list))
+
+    async def main():
+        subscriptions = [
+            subscription for feed in (BitfinexFeed(), BitfinexFeed())
+            for subscription in feed.subscribe(
+                'BTC', 'USD', 'TRADES', stale_timeout=0).values()]
+        clients = base._websocket_client_pool[BitfinexWebsocketClient]
+        for client in clients:
+            client.websocket = FakeWebsocket()
+            client.subscribe_window = 0
+        assert [subscription.client for subscription in subscriptions] == \
+            clients
+        events = [[], []]
+        for subscription, sink in zip(subscriptions, events):
+            subscription.event_stream.sink(sink.append)
+        await asyncio.sleep(0.01)
+        for client in clients:
+            client.websocket.feed({'event': 'subscribed', 'channel': 'trades',
+                                   'chanId': 10, 'pair': 'BTCUSD'})
+            client.websocket.feed([10, 'tu', [1, 1500000000000, 0.5, 4000]])
+        await asyncio.sleep(0.01)
+        for client in clients:
+            client.close()
+        assert [[type(event) for event in sink] for sink in events] == \
+            [[Trade], [Trade]]
+        with pytest.raises(ValueError, match='already subscribed'):
+            clients[0].listen('btcusd', 'trades')
+    run(main())
@@ -0,0 +1,67 @@
+import pickle
+
+from numismatic.libs.cachestore import CacheEntry, CacheStore
+from numismatic.requesters import CachingRequester, Response
+
+
+def entry(url, saved_at=1500000000.0, body=b'{"price": 4000}'):
+    return CacheEntry(url=url, saved_at=saved_at, status=200,
+                      headers={'Content-Type': 'application/json'}, body=body)
+
+
+def test_entries_survive_reopening(tmp_path):
+    path = tmp_path / 'responses.sqlite'
+    store = CacheStore(path, batch_size=100, flush_interval=60)
+    assert store.created
+    store.put('a', entry('https://api/a'))
+    # pending writes are visible before they are flushed
+    assert store.get('a')==entry('https://api/a')
+    assert store.get('b') is None
+    store.close()
+    store = CacheStore(path)
+    assert not store.created
+    assert store.get('a')==entry('https://api/a')
+    assert store.size>0
+    store.close()
+
+
+def test_size_counts_replaced_entries_once(tmp_path):
+    store = CacheStore(tmp_path / 'responses.sqlite', batch_size=1)
+    store.put('a', entry('https://api/a', body=b'x'*1000))
+    size = store.size
+    store.put('a', entry('https://api/a', body=b'x'*1000))
+    assert store.size==size
+    store.put('a', entry('https://api/a', body=bytes(range(256))*4))
+    assert store.size>size
+    store.close()
+
+
+def test_evict_removes_the_least_recently_accessed(tmp_path):
+    store = CacheStore(tmp_path / 'responses.sqlite')
+    for saved_at, key in enumerate('abcd'):
+        store.put(key, entry(f'https://api/{key}', saved_at=saved_at,
+                             body=key.encode('ascii')*100))
+    store.touch('a', now=10)
+    store.touch('c', now=11)
+    evicted = store.evict(store.size//2)
+    assert evicted==['b', 'd']
+    assert [key for key in 'abcd' if store.get(key) is not None]==['a', 'c']
+    store.close()
+
+
+def test_old_pickled_caches_are_imported(tmp_path):
+    url = 'https://min-api.cryptocompare.com/data/coinlist'
+    response = Response(url=url, status_code=200, content=b'{"Data": {}}')
+    with (tmp_path / 'old-entry').open('wb') as file:
+        pickle.dump((1500000000.0, response), file)
+    failed = Response(url=url+'?page=2', status_code=500)
+    with (tmp_path / 'failed-entry').open('wb') as file:
+        pickle.dump((1500000000.0, failed), file)
+    (tmp_path / 'not-a-pickle').write_text('junk')
+    requester = CachingRequester(cache_dir=tmp_path)
+    assert requester.store.created
+    cached = requester.store.get(requester._get_key(url))
+    assert (cached.url, cached.saved_at, cached.body) == \
+        (url, 1500000000.0, b'{"Data": {}}')
+    assert requester.store.get(requester._get_key(url+'?page=2')) is None
+    requester.store.close()
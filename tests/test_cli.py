@@ -0,0 +1,50 @@
+import json
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from numismatic.cli import DATE, DATE_OR_PERIODS, coin
+from numismatic.requesters import CACHE_FILE_NAME, Requester, Response
+
+
+def test_dates_or_periods():
+    assert DATE_OR_PERIODS.convert(-30, None, None)==-30
+    assert DATE_OR_PERIODS.convert('-3000', None, None)==-3000
+    assert DATE_OR_PERIODS.convert('2017-01-01', None, None)=='2017-01-01'
+    assert DATE_OR_PERIODS.convert(None, None, None) is None
+    with pytest.raises(click.BadParameter):
+        DATE_OR_PERIODS.convert('yesterday-ish', None, None)
+
+
+def test_dates_only():
+    assert DATE.convert('2017-01-01', None, None)=='2017-01-01'
+    assert DATE.convert(None, None, None) is None
+    with pytest.raises(click.BadParameter, match='is not a date'):
+        DATE.convert('-5', None, None)
+
+
+@pytest.fixture
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    return tmp_path
+
+
+def test_caching_requester_uses_the_user_cache_dir(cache_home, monkeypatch):
+    def get(self, url, params=None, headers=None):
+        content = json.dumps({'BTC': {'USD': 4000}}).encode()
+        return Response(url=url, status_code=200, content=content)
+
+    monkeypatch.setattr(Requester, '_get', get)
+    result = CliRunner().invoke(coin, ['-r', 'caching', 'prices', '-a', 'BTC',
+                                       '-c', 'USD', '--raw'])
+    assert result.exit_code==0, result.output
+    assert '4000' in result.output
+    assert (cache_home / 'numismatic' / CACHE_FILE_NAME).exists()
+
+
+def test_caching_history_without_a_cache_dir(cache_home):
+    result = CliRunner().invoke(coin, ['-r', 'caching', 'history', '-a', 'BTC',
+                                       '-c', 'USD', '--dry-run'])
+    assert result.exit_code==0, result.output
+    assert result.output.endswith('1 requests\n')
@@ -0,0 +1,66 @@
+import json
+
+import attr
+import pytest
+
+from numismatic.events import Trade, TradeSnapshot
+from numismatic.libs import codec
+
+
+@pytest.fixture(autouse=True)
+def restore_codec():
+    name = codec.name
+    yield
+    codec.set_codec(name)
+
+
+def missing():
+    raise ImportError('not installed')
+
+
+def test_json_round_trip():
+    assert codec.set_codec('JSON')=='json'
+    packet = codec.dumps({'type': 'match', 'price': '100.5', 'size': 0.25})
+    assert isinstance(packet, str)
+    assert codec.loads(packet)=={'type': 'match', 'price': '100.5',
+                                 'size': 0.25}
+
+
+def test_loads_follows_the_selected_codec(monkeypatch):
+    monkeypatch.setitem(codec.CODECS, 'ujson', lambda: (len, repr))
+    assert codec.set_codec('ujson')=='ujson'
+    assert codec.loads('[1, 2]')==6
+
+
+def test_missing_codec_falls_back_to_json(monkeypatch):
+    monkeypatch.setitem(codec.CODECS, 'orjson', missing)
+    assert codec.set_codec('orjson')=='json'
+    assert codec.loads('{"a": 1}')=={'a': 1}
+
+
+def test_auto_picks_the_first_installed(monkeypatch):
+    monkeypatch.setitem(codec.CODECS, 'orjson', missing)
+    monkeypatch.setitem(codec.CODECS, 'ujson', missing)
+    monkeypatch.setitem(codec.CODECS, 'rapidjson',
+                        lambda: (codec.json.loads, codec.json.dumps))
+    assert codec.set_codec('auto')=='rapidjson'
+    assert codec.set_codec(None)=='rapidjson'
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        codec.set_codec('bson')
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson'])
+def test_events_encode_as_their_fields(name):
+    if codec.set_codec(name)!=name:
+        pytest.skip(f'{name} is not installed')
+    trade = Trade(exchange='Bitfinex', symbol='BTCUSD', price=5609.2,
+                  volume=0.0169, timestamp=1508424154.0, id='75165521')
+    assert json.loads(trade.json())==attr.asdict(trade)
+    snapshot = TradeSnapshot(exchange='Bitfinex', symbol='BTCUSD',
+                             timestamp=1508424154.0)
+    snapshot.append(5609.2, 0.0169, id=1, timestamp=1508424153.0)
+    assert json.loads(snapshot.json())['prices']==[5609.2]
+    assert json.loads(snapshot.json())['timestamps']==[1508424153.0]
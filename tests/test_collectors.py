@@ -0,0 +1,56 @@
+from streamz import Stream
+
+from numismatic.cli import price_updates
+from numismatic.collectors import Collector
+from numismatic.events import Trade, TradeSnapshot, Order, BookSnapshot, \
+    Heartbeat
+
+
+def trade_snapshot():
+    snapshot = TradeSnapshot(exchange='Test', symbol='BTCUSD')
+    snapshot.append(price=100, volume=1, timestamp=2)
+    snapshot.append(price=99, volume=2, timestamp=1)
+    return snapshot
+
+
+def events():
+    return [Trade(exchange='Test', symbol='BTCUSD', price=101, volume=1),
+            trade_snapshot(),
+            Order(exchange='Test', symbol='BTCUSD', price=100, volume=1),
+            BookSnapshot(exchange='Test', symbol='BTCUSD'),
+            Heartbeat(exchange='Test', symbol='BTCUSD')]
+
+
+def collected(**kwargs):
+    event_stream = Stream()
+    collector = Collector(event_stream=event_stream, **kwargs)
+    results = []
+    collector.event_stream.sink(results.append)
+    for event in events():
+        event_stream.emit(event)
+    return results
+
+
+def test_type_filters_keep_the_snapshots_of_the_type():
+    assert [type(event) for event in collected(types=('Trade',))] == \
+        [Trade, TradeSnapshot]
+    assert [type(event) for event in collected(types=('Order',))] == \
+        [Order, BookSnapshot]
+    assert [type(event) for event in collected(types=('TradeSnapshot',))] \
+        == [TradeSnapshot]
+
+
+def test_expression_filters_see_the_rows_of_snapshots():
+    results = collected(types=('Trade',), filters=('volume>1',))
+    assert [(type(event), event.price) for event in results] == \
+        [(Trade, 99)]
+
+
+def test_compare_takes_the_latest_trade_of_a_snapshot():
+    event_stream = Stream()
+    results = []
+    price_updates(event_stream).sink(results.append)
+    for event in events():
+        event_stream.emit(event)
+    event_stream.emit(TradeSnapshot(exchange='Test', symbol='BTCUSD'))
+    assert [event.price for event in results]==[101, 100]
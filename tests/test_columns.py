@@ -0,0 +1,63 @@
+import pytest
+
+from numismatic.libs import columns
+
+np = pytest.importorskip('numpy')
+
+
+CANDLES = [dict(time=1500000000+60*index, open=4000.0+index,
+                high=4010.0+index, low=3990.0+index, close=4005.0+index,
+                volumefrom=1.5*index, volumeto=6000.0*index)
+           for index in range(5)]
+
+
+@pytest.fixture
+def history():
+    return {('BTC', 'USD'): columns.to_columns(CANDLES),
+            ('ETH', 'USD'): columns.to_columns(CANDLES[:2])}
+
+
+def test_to_columns():
+    data = columns.to_columns(CANDLES)
+    assert set(data)==set(columns.CANDLE_COLUMNS)
+    assert data['time'].dtype==np.int64
+    assert data['close'].dtype==np.float64
+    assert data['close'].tolist()==[candle['close'] for candle in CANDLES]
+
+
+def test_rows_to_columns():
+    rows = [tuple(candle[name] for name in columns.CANDLE_COLUMNS)
+            for candle in CANDLES]
+    data = columns.rows_to_columns(rows, columns.CANDLE_COLUMNS)
+    for name in columns.CANDLE_COLUMNS:
+        np.testing.assert_array_equal(data[name],
+                                      columns.to_columns(CANDLES)[name])
+
+
+def test_npz_round_trip(tmp_path, history):
+    path = tmp_path / 'history.npz'
+    columns.save(path, history)
+    with np.load(str(path)) as data:
+        assert len(data.files)==2*len(columns.CANDLE_COLUMNS)
+        for (asset, currency), pair_columns in history.items():
+            for name, column in pair_columns.items():
+                saved = data[f'{asset}-{currency}/{name}']
+                assert saved.dtype==column.dtype
+                np.testing.assert_array_equal(saved, column)
+
+
+def test_npy_round_trip(tmp_path, history):
+    path = tmp_path / 'history.npy'
+    columns.save(path, history)
+    records = np.load(str(path), mmap_mode='r')
+    assert len(records)==7
+    assert records['asset'].tolist()==[b'BTC']*5+[b'ETH']*2
+    eth = records[records['asset']==b'ETH']
+    np.testing.assert_array_equal(eth['close'],
+                                  history[('ETH', 'USD')]['close'])
+    del records, eth
+
+
+def test_other_suffixes_are_refused(tmp_path, history):
+    with pytest.raises(ValueError):
+        columns.save(tmp_path / 'history.csv', history)
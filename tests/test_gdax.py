@@ -0,0 +1,156 @@
+import asyncio
+import json
+from collections import defaultdict
+
+import pytest
+
+from numismatic.events import BookSnapshot, Order, Trade
+from numismatic.feeds import base
+from numismatic.feeds.gdax import GDAXFeed, GDAXWebsocketClient
+from numismatic.orderbook import OrderBook
+
+from .fakes import FakeWebsocket, run
+
+
+def subscribed(websocket, *channels):
+    websocket.feed({'type': 'subscriptions', 'channels': [
+        {'name': channel, 'product_ids': ['BTC-USD']}
+        for channel in channels + ('heartbeat',)]})
+
+
+def test_level2_messages_build_an_order_book():
+    async def main():
+        websocket = FakeWebsocket()
+        client = GDAXWebsocketClient(websocket=websocket, subscribe_window=0)
+        subscription = client.listen('BTC-USD', 'LEVEL2')
+        book = OrderBook(event_stream=subscription.event_stream)
+        events = []
+        subscription.event_stream.sink(events.append)
+        await asyncio.sleep(0.01)
+        subscribed(websocket, 'level2')
+        websocket.feed({'type': 'snapshot', 'product_id': 'BTC-USD',
+                        'bids': [['100.00', '1.5'], ['99.00', '2']],
+                        'asks': [['101.00', '1']]})
+        websocket.feed({'type': 'l2update', 'product_id': 'BTC-USD',
+                        'time': '2017-10-16T12:00:00.000000Z',
+                        'changes': [['buy', '100.00', '0'],
+                                    ['sell', '100.50', '3']]})
+        await asyncio.sleep(0.01)
+        client.close()
+        assert [type(event) for event in events] == \
+            [BookSnapshot, Order, Order]
+        assert book.depth()=={'bids': [(99, 2)],
+                              'asks': [(100.5, 3), (101, 1)]}
+    run(main())
+
+
+def test_trades_and_tickers_of_a_product_are_routed_apart():
+    async def main():
+        websocket = FakeWebsocket()
+        client = GDAXWebsocketClient(websocket=websocket, subscribe_window=0)
+        trades = client.listen('BTC-USD', 'TRADES')
+        ticker = client.listen('BTC-USD', 'TICKER')
+        trade_events, ticker_events = [], []
+        trades.event_stream.sink(trade_events.append)
+        ticker.event_stream.sink(ticker_events.append)
+        await asyncio.sleep(0.01)
+        subscribed(websocket, 'matches', 'ticker')
+        websocket.feed({'type': 'match', 'product_id': 'BTC-USD',
+                        'trade_id': 1, 'price': '100.00', 'size': '0.5',
+                        'side': 'buy', 'time': '2017-10-16T12:00:00Z'})
+        websocket.feed({'type': 'ticker', 'product_id': 'BTC-USD',
+                        'trade_id': 1, 'price': '100.00', 'last_size': '0.5',
+                        'side': 'buy', 'time': '2017-10-16T12:00:00Z'})
+        await asyncio.sleep(0.01)
+        client.close()
+        assert [(type(event), event.volume) for event in trade_events] == \
+            [(Trade, 0.5)]
+        assert [type(event) for event in ticker_events]==[Trade]
+        assert set(client._channels) == \
+            {('matches', 'BTC-USD'), ('ticker', 'BTC-USD')}
+    run(main())
+
+
+def test_one_subscription_per_channel_and_product():
+    async def main():
+        client = GDAXWebsocketClient(websocket=FakeWebsocket())
+        client.listen('BTC-USD', 'TRADES')
+        with pytest.raises(ValueError, match='already subscribed'):
+            client.listen('btc-usd', 'MATCHES')
+        client.close()
+    run(main())
+
+
+def test_subscriptions_in_a_window_are_sent_in_one_message():
+    async def main():
+        websocket = FakeWebsocket()
+        client = GDAXWebsocketClient(websocket=websocket,
+                                     subscribe_window=0.01)
+        client.listen('BTC-USD', 'TRADES')
+        client.listen('ETH-USD', 'TRADES')
+        client.listen('BTC-USD', 'TICKER')
+        await asyncio.sleep(0.05)
+        assert len(websocket.sent)==1
+        msg = json.loads(websocket.sent[0])
+        assert msg['type']=='subscribe'
+        assert sorted((channel['name'], sorted(channel['product_ids']))
+                      for channel in msg['channels']) == \
+            [('heartbeat', ['BTC-USD', 'ETH-USD']),
+             ('matches', ['BTC-USD', 'ETH-USD']),
+             ('ticker', ['BTC-USD'])]
+        # a later subscription starts a new batch
+        client.listen('LTC-USD', 'TRADES')
+        await asyncio.sleep(0.05)
+        client.close()
+        assert len(websocket.sent)==2
+    run(main())
+
+
+def test_unsubscribe_keeps_the_heartbeats_still_in_use():
+    async def main():
+        websocket = FakeWebsocket()
+        client = GDAXWebsocketClient(websocket=websocket, subscribe_window=0)
+        trades = client.listen('BTC-USD', 'TRADES')
+        client.listen('BTC-USD', 'TICKER')
+        await asyncio.sleep(0.01)
+        subscribed(websocket, 'matches', 'ticker')
+        await asyncio.sleep(0.01)
+        del websocket.sent[:]
+        await client._unsubscribe(trades)
+        client.close()
+        assert [json.loads(packet) for packet in websocket.sent] == \
+            [{'type': 'unsubscribe',
+              'channels': [{'name': 'matches', 'product_ids': ['BTC-USD']}]}]
+    run(main())
+
+
+def test_duplicate_subscriptions_get_their_own_connections(monkeypatch):
+    monkeypatch.setattr(base, '_websocket_client_pool', defaultdict(list))
+
+    async def main():
+        subscriptions = [
+            subscription for feed in (GDAXFeed(), GDAXFeed())
+            for subscription in feed.subscribe(
+                'BTC', 'USD', 'TRADES', stale_timeout=0).values()]
+        clients = base._websocket_client_pool[GDAXWebsocketClient]
+        for client in clients:
+            client.websocket = FakeWebsocket()
+            client.subscribe_window = 0
+        assert [subscription.client for subscription in subscriptions] == \
+            clients
+        events = [[], []]
+        for subscription, sink in zip(subscriptions, events):
+            subscription.event_stream.sink(sink.append)
+        await asyncio.sleep(0.01)
+        for client in clients:
+            subscribed(client.websocket, 'matches')
+            client.websocket.feed({'type': 'match', 'product_id': 'BTC-USD',
+                                   'trade_id': 1, 'price': '100.00',
+                                   'size': '0.5', 'side': 'buy',
+                                   'time': '2017-10-16T12:00:00Z'})
+        await asyncio.sleep(0.01)
+        for client in clients:
+            client.close()
+        assert [[type(event) for event in sink] for sink in events] == \
+            [[Trade], [Trade]]
+    run(main())
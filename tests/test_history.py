@@ -0,0 +1,179 @@
+import json
+
+import pytest
+
+from numismatic.config import config
+from numismatic.feeds.base import Feed
+from numismatic.feeds.cryptocompare import HISTORY_START
+from numismatic.libs.backfill import BackfillError
+from numismatic.libs.historystore import HistoryStore, SeriesKey, \
+    CANDLE_FIELDS
+from numismatic.requesters import Requester, Response
+
+
+DAY = 86400
+MINUTE = 60
+# 2026-01-01
+END = 1767225600
+
+
+def candle(time):
+    return dict(time=time, close=1.0, high=2.0, low=0.5, open=1.0,
+                volumefrom=3.0, volumeto=4.0)
+
+
+def series(freq):
+    return SeriesKey(feed='CryptoCompareFeed', exchange='CCCAGG', asset='BTC',
+                     currency='USD', freq=freq)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(tmp_path / 'history.sqlite')
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def feed(tmp_path, store):
+    feed = Feed.factory('cryptocompare', requester='base',
+                        cache_dir=str(tmp_path))
+    feed.history_store = store
+    return feed
+
+
+def test_store_gaps(store):
+    key = series('d')
+    assert store.gaps(key, 0, 10*DAY, DAY)==[(0, 10*DAY)]
+    store.put(key, [candle(t) for t in range(2*DAY, 5*DAY, DAY)],
+              2*DAY, 4*DAY, DAY)
+    store.put(key, [candle(7*DAY)], 7*DAY, 7*DAY, DAY)
+    assert store.gaps(key, 0, 10*DAY, DAY) == \
+        [(0, DAY), (5*DAY, 6*DAY), (8*DAY, 10*DAY)]
+    assert store.gaps(key, 3*DAY, 4*DAY, DAY)==[]
+    assert store.covered(key, 3*DAY, 10*DAY)==[(3*DAY, 4*DAY),
+                                              (7*DAY, 7*DAY)]
+    assert [row[0] for row in store.get_rows(key, 0, 10*DAY)] == \
+        [2*DAY, 3*DAY, 4*DAY, 7*DAY]
+
+
+def test_store_merges_adjoining_coverage(store):
+    key = series('d')
+    store.put(key, [], 2*DAY, 4*DAY, DAY)
+    store.put(key, [], 5*DAY, 6*DAY, DAY)
+    store.put(key, [], 0, DAY, DAY)
+    assert store.coverage(key)==[(0, 6*DAY)]
+    assert store.gaps(key, 0, 6*DAY, DAY)==[]
+
+
+def test_plan_covers_every_gap_with_fewer_requests(feed, store):
+    key = series('m')
+    start = END-20000*MINUTE
+    # 1000 cached candles then 50 missing ones, over and over
+    for covered_start in range(start, END, 1050*MINUTE):
+        store.put(key, [], covered_start, covered_start+999*MINUTE, MINUTE)
+    gaps = store.gaps(key, start, END, MINUTE)
+    chunks = feed._plan_history(key, None, start, END, MINUTE, store)
+    assert len(chunks)<len(gaps)
+    assert [gap for chunk in reversed(chunks) for gap in chunk.gaps]==gaps
+    for chunk in chunks:
+        assert chunk.limit<feed._interval_limit
+        assert not chunk.all_data
+        assert chunk.start_time<=chunk.gaps[0][0]
+        assert chunk.gaps[-1][1]==chunk.end_time
+
+
+def test_plan_long_daily_range_with_all_data(feed, store):
+    # three requests could return more candles than allData
+    chunks = feed._plan_history(series('d'), None, END-5000*DAY, END, DAY,
+                                store)
+    assert len(chunks)==1
+    assert chunks[0].all_data
+    assert (chunks[0].start_time, chunks[0].end_time)==(END-5000*DAY, END)
+
+
+def test_plan_short_daily_gaps_without_all_data(feed, store):
+    key = series('d')
+    # only the first and last few days are missing, too many to cover with
+    # one 2000 candle request but allData would return much more
+    start = END-3000*DAY
+    store.put(key, [], start+5*DAY, END-5*DAY, DAY)
+    chunks = feed._plan_history(key, None, start, END, DAY, store)
+    assert (END-HISTORY_START)//DAY+1>2*feed._interval_limit
+    assert [(chunk.start_time, chunk.end_time, chunk.all_data)
+            for chunk in chunks] == [(END-4*DAY, END, False),
+                                     (start, start+4*DAY, False)]
+
+
+def test_plan_nothing_when_covered(feed, store):
+    key = series('h')
+    store.put(key, [], END-100*3600, END, 3600)
+    assert feed._plan_history(key, None, END-50*3600, END, 3600, store)==[]
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    """Fakes the histo* endpoints, which return extra fields per candle"""
+    requests = []
+
+    def get(self, url, params=None, headers=None):
+        requests.append(params)
+        period = {'histominute': 60, 'histohour': 3600,
+                  'histoday': 86400}[url.rsplit('/', 1)[1]]
+        end = params['toTs']//period*period
+        data = [dict(candle(end-i*period), conversionType='direct')
+                for i in range(params['limit'], -1, -1)]
+        content = json.dumps({'Response': 'Success', 'Data': data})
+        return Response(url=url, status_code=200, headers={},
+                        content=content.encode())
+    monkeypatch.setattr(Requester, '_get', get)
+    return requests
+
+
+def test_iter_merges_stored_and_fetched_candles_in_time_order(feed, store,
+                                                              requests):
+    history = dict(freq='m', start_date=-9000, end_date='2018-01-01')
+    # cache the middle of the range
+    feed.get_historical_data('BTC', 'USD', freq='m', start_date=-3000,
+                             end_date='2017-12-31 20:00')
+    requests.clear()
+    plan = feed.plan_historical_data('BTC,ETH', 'USD', **history)
+    chunks = list(feed.iter_historical_data('BTC,ETH', 'USD', **history))
+    assert len(requests)==len(plan)==9
+    for asset in ('BTC', 'ETH'):
+        times = [candle['time'] for chunk in chunks for candle in chunk
+                 if candle['asset']==asset]
+        assert times==list(range(times[0], times[-1]+60, 60))
+        assert len(times)==9001
+    assert {tuple(candle) for chunk in chunks for candle in chunk} == \
+        {('asset', 'currency')+CANDLE_FIELDS}
+    by_asset = lambda candle: candle['asset']
+    assert sorted((candle for chunk in chunks for candle in chunk),
+                  key=by_asset) == \
+        sorted(feed.get_historical_data('BTC,ETH', 'USD', **history),
+               key=by_asset)
+
+
+def test_iter_yields_the_rest_of_the_range_when_a_chunk_fails(
+        feed, requests, monkeypatch):
+    monkeypatch.setitem(config['DEFAULT'], 'backfill_retries', '0')
+    history = dict(freq='m', start_date=-40000, end_date='2018-01-01')
+    plan = feed.plan_historical_data('BTC', 'USD', **history)
+    head = min(plan, key=lambda chunk: chunk.start_time)
+    get = Requester._get
+
+    def failing_get(self, url, params=None, headers=None):
+        if params['toTs']==head.toTs:
+            requests.append(params)
+            raise IOError('timed out')
+        return get(self, url, params=params, headers=headers)
+
+    monkeypatch.setattr(Requester, '_get', failing_get)
+    chunks = []
+    with pytest.raises(BackfillError):
+        for chunk in feed.iter_historical_data('BTC', 'USD', **history):
+            chunks.append(chunk)
+    assert len(requests)==len(plan)==21
+    times = [candle['time'] for chunk in chunks for candle in chunk]
+    assert times==list(range(head.end_time+MINUTE,
+                             plan[0].end_time+MINUTE, MINUTE))
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from numismatic.config import config
+from numismatic.feeds import base
+from numismatic.feeds.luno import LunoFeed, LunoWebsocketClient
+from numismatic.events import BookSnapshot, Order, PriceUpdate
+
+from .fakes import FakeWebsocket, run
+
+
+def order(sequence, order_id):
+    return {'sequence': str(sequence), 'timestamp': 1500000000000,
+            'trade_updates': None, 'delete_update': None,
+            'create_update': {'order_id': order_id, 'type': 'BID',
+                              'price': '100', 'volume': '1'}}
+
+
+async def subscribed(websocket, replaying=False, **sequencer):
+    client = LunoWebsocketClient(websocket=websocket, api_key_id='id',
+                                 api_key_secret='secret',
+                                 replaying=replaying)
+    subscription = client.listen('xbtzar')
+    for name, value in sequencer.items():
+        setattr(subscription.sequencer, name, value)
+    events = []
+    subscription.event_stream.sink(events.append)
+    # Luno sends the snapshot once it has the credentials
+    await asyncio.sleep(0.01)
+    websocket.feed({'sequence': '10', 'asks': [], 'bids': [],
+                    'timestamp': 1500000000000})
+    await asyncio.sleep(0.05)
+    return client, subscription, events
+
+
+def test_listen_uses_the_pair_stream():
+    async def main():
+        websocket = FakeWebsocket()
+        client, subscription, events = await subscribed(websocket)
+        client.close()
+        assert client.websocket_url=='wss://ws.luno.com/api/1/stream/XBTZAR'
+        assert len(websocket.sent)==1
+        assert isinstance(events[0], BookSnapshot)
+        with pytest.raises(ValueError):
+            client.listen('ETHXBT')
+    run(main())
+
+
+def test_out_of_order_sequences_are_reordered():
+    async def main():
+        websocket = FakeWebsocket()
+        client, subscription, events = await subscribed(websocket)
+        for sequence in (12, 11, 13):
+            websocket.feed(order(sequence, f'order-{sequence}'))
+        await asyncio.sleep(0.05)
+        client.close()
+        assert [event.id for event in events if isinstance(event, Order)] \
+            == ['order-11', 'order-12', 'order-13']
+        assert websocket.closed==0
+    run(main())
+
+
+def test_sequence_gap_resyncs():
+    async def main():
+        websocket = FakeWebsocket()
+        client, subscription, events = await subscribed(websocket,
+                                                        max_buffer=1)
+        for sequence in (12, 13):
+            websocket.feed(order(sequence, f'order-{sequence}'))
+        await asyncio.sleep(0.05)
+        client.close()
+        assert not [event for event in events if isinstance(event, Order)]
+        assert subscription.sequencer.stats['gaps']==1
+        # Luno only sends a snapshot on connect so the resync reconnects
+        assert websocket.closed==1
+    run(main())
+
+
+def test_sequence_gaps_in_a_replay_are_skipped():
+    async def main():
+        websocket = FakeWebsocket()
+        client, subscription, events = await subscribed(
+            websocket, replaying=True, max_buffer=1)
+        for sequence in (12, 13, 14):
+            websocket.feed(order(sequence, f'order-{sequence}'))
+        await asyncio.sleep(0.05)
+        client.close()
+        assert subscription.sequencer.stats['gaps']==1
+        # the replay goes on rather than waiting for a snapshot
+        assert websocket.closed==0
+        assert [event.id for event in events if isinstance(event, Order)] \
+            == ['order-14']
+    run(main())
+
+
+def test_pooled_clients_stream_one_pair_each(monkeypatch):
+    for item in ('api_key_id', 'api_key_secret'):
+        monkeypatch.setitem(config['LunoFeed'], item, item)
+
+    async def main():
+        feed = LunoFeed()
+        feed.subscribe('XBT,ETH', 'ZAR', 'trades', stale_timeout=0)
+        clients = base._websocket_client_pool.pop(LunoWebsocketClient)
+        for client in clients:
+            # before the clients get to connect
+            client.websocket = FakeWebsocket()
+        await asyncio.sleep(0.01)
+        for client in clients:
+            client.close()
+        assert sorted(client.websocket_url for client in clients) == \
+            ['wss://ws.luno.com/api/1/stream/ETHZAR',
+             'wss://ws.luno.com/api/1/stream/XBTZAR']
+    run(main())
+
+
+TICKERS = [{'pair': pair, 'timestamp': 1500000000000, 'bid': '99',
+            'ask': '101', 'last_trade': '100',
+            'rolling_24_hour_volume': '10'}
+           for pair in ('XBTZAR', 'ETHZAR', 'ETHXBT')]
+
+
+def test_prices_are_polled_through_the_rest_client(monkeypatch):
+    for item in ('api_key_id', 'api_key_secret'):
+        monkeypatch.setitem(config['LunoFeed'], item, item)
+
+    async def main():
+        feed = LunoFeed()
+        for client in base._websocket_client_pool.pop(LunoWebsocketClient):
+            client.close()
+        requests = []
+
+        async def get_tickers_async():
+            requests.append(None)
+            return TICKERS
+        feed.rest_client.get_tickers_async = get_tickers_async
+        subscriptions = feed.subscribe('XBT,ETH', 'ZAR', 'prices',
+                                       interval=10)
+        events = []
+        for subscription in subscriptions.values():
+            subscription.event_stream.sink(events.append)
+        await asyncio.sleep(0.05)
+        feed.rest_client._poller.cancel()
+        assert sorted(subscriptions) == \
+            ['Luno--ETHZAR--ticker', 'Luno--XBTZAR--ticker']
+        assert sorted((type(event), event.symbol, event.price)
+                      for event in events) == \
+            [(PriceUpdate, 'ETHZAR', 100), (PriceUpdate, 'XBTZAR', 100)]
+        return requests
+    requests = run(main())
+    # all the due pairs are polled with one request
+    assert len(requests)==1
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from numismatic.feeds import base
+from numismatic.feeds.bitfinex import BitfinexWebsocketClient
+from numismatic.feeds.luno import LunoWebsocketClient
+from numismatic.libs.metrics import ClockOffset, Histogram, LatencyMonitor
+
+from .fakes import FakeWebsocket, run
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.add(i/1000)
+    assert histogram.count==1000
+    assert histogram.percentile(50)==pytest.approx(0.5, rel=0.1)
+    assert histogram.percentile(99)==pytest.approx(0.99, rel=0.1)
+    assert histogram.percentile(100)==1.0
+
+
+def test_histogram_percentiles_of_negative_values():
+    histogram = Histogram()
+    # an exchange clock about 5s ahead
+    for i in range(1000):
+        histogram.add(-5+i/10000)
+    assert histogram.percentile(50)==pytest.approx(-4.95, rel=0.1)
+    assert histogram.percentile(99)==pytest.approx(-4.9, rel=0.1)
+    assert histogram.percentile(100)==histogram.max
+    mixed = Histogram()
+    for value in (-2, -1, -0.5, 0, 0.5, 1, 2):
+        mixed.add(value)
+    assert [mixed.percentile(p) for p in (10, 50, 90)] == \
+        pytest.approx([-2, 0, 2], rel=0.1, abs=1e-5)
+
+
+def test_clock_offset_is_the_least_delay_in_the_window():
+    offset = ClockOffset(window=10)
+    offset.add(100, 90.5)
+    offset.add(101, 91)
+    assert offset.offset==9.5
+    offset.add(111, 101.8)
+    # the 9.5 sample has left the window
+    assert offset.offset==pytest.approx(9.2)
+
+
+def test_raw_and_corrected_exchange_latency():
+    monitor = LatencyMonitor()
+    # the exchange clock is 5s ahead and the delays are 0.1s and 0.3s
+    monitor.record_emit('Test', 'trades', 100.1, 100.2, exchange_time=105)
+    monitor.record_emit('Test', 'trades', 101.3, 101.4, exchange_time=106)
+    summary = monitor.summary()
+    raw = summary['Test--trades--exchange_to_recv']
+    corrected = summary['Test--trades--exchange_to_recv_corrected']
+    assert (raw['min'], raw['max'])==pytest.approx((-4.9, -4.7))
+    assert (corrected['min'], corrected['max'])==pytest.approx((0, 0.2))
+
+
+def test_decode_is_timed_on_its_own(monkeypatch):
+    monitor = LatencyMonitor()
+    monkeypatch.setattr(base, 'latency', monitor)
+
+    async def main():
+        websocket = FakeWebsocket()
+        client = BitfinexWebsocketClient(websocket=websocket)
+        for i in range(3):
+            websocket.feed([10, 'hb'])
+        await asyncio.sleep(0.01)
+        client.close()
+    run(main())
+    assert list(monitor.summary())==['Bitfinex--ALL--decode']
+    assert monitor.summary()['Bitfinex--ALL--decode']['count']==3
+
+
+def test_book_events_record_exchange_latency(monkeypatch):
+    monitor = LatencyMonitor()
+    monkeypatch.setattr(base, 'latency', monitor)
+
+    async def main():
+        websocket = FakeWebsocket()
+        client = LunoWebsocketClient(websocket=websocket, api_key_id='id',
+                                     api_key_secret='secret')
+        client.listen('XBTZAR', 'ORDERS')
+        await asyncio.sleep(0.01)
+        websocket.feed({'sequence': '1', 'asks': [], 'bids': [],
+                        'timestamp': 1500000000000})
+        websocket.feed({'sequence': '2', 'trade_updates': None,
+                        'create_update': {'order_id': 'A', 'type': 'BID',
+                                          'price': '100', 'volume': '1'},
+                        'delete_update': None, 'timestamp': 1500000000000})
+        await asyncio.sleep(0.01)
+        client.close()
+    run(main())
+    assert monitor.summary()['Luno--ORDERS--exchange_to_recv']['count']==2
@@ -0,0 +1,77 @@
+from numismatic.events import Order, Trade, Reconnect, BookSnapshot, \
+    BookUpdate
+from numismatic.orderbook import BookSide, OrderBook
+
+from streamz import Stream
+
+
+def test_book_side_keeps_the_best_level_last():
+    bids, asks = BookSide(sign=1), BookSide(sign=-1)
+    for price in (101, 99, 100):
+        bids.add(price, 1)
+        asks.add(price+10, 1)
+    assert bids.best==(101, 1)
+    assert asks.best==(109, 1)
+    assert bids.top(2)==[(101, 1), (100, 1)]
+    assert asks.top(5)==[(109, 1), (110, 1), (111, 1)]
+
+
+def test_book_side_top_of_nothing():
+    side = BookSide()
+    side.add(100, 1)
+    assert side.top(0)==[]
+    assert side.top(-1)==[]
+
+
+def test_book_side_removes_emptied_levels():
+    side = BookSide()
+    side.add(100, 2)
+    side.add(100, -1)
+    assert side.best==(100, 1)
+    side.add(100, -1)
+    assert len(side)==0
+
+
+def book_events():
+    event_stream = Stream()
+    book = OrderBook(event_stream=event_stream)
+    updates = []
+    book.book_stream.sink(updates.append)
+    return event_stream, book, updates
+
+
+def order(order_id, price, volume, type):
+    return Order(exchange='Test', symbol='BTCUSD', id=order_id, price=price,
+                 volume=volume, type=type, timestamp=1)
+
+
+def cancel(order_id):
+    return Order(exchange='Test', symbol='BTCUSD', id=order_id,
+                 type='CANCEL', timestamp=1)
+
+
+def test_order_book_applies_orders_trades_and_cancels():
+    event_stream, book, updates = book_events()
+    event_stream.emit(order(1, 100, 2, 'BUY'))
+    event_stream.emit(order(2, 101, 1, 'SELL'))
+    event_stream.emit(order(3, 99, 1, 'BUY'))
+    assert (book.best_bid, book.best_ask)==(100, 101)
+    event_stream.emit(Trade(exchange='Test', symbol='BTCUSD', id=1,
+                            price=100, volume=2, timestamp=2))
+    assert book.best_bid==99
+    event_stream.emit(cancel(3))
+    assert book.depth()=={'bids': [], 'asks': [(101, 1)]}
+    assert all(isinstance(update, BookUpdate) for update in updates)
+    assert updates[-1].best_ask==101
+
+
+def test_order_book_snapshot_and_reconnect():
+    event_stream, book, updates = book_events()
+    snapshot = BookSnapshot(exchange='Test', symbol='BTCUSD')
+    snapshot.append(price=100, volume=1, side='BUY')
+    snapshot.append(price=100, volume=2, side='BUY')
+    snapshot.append(price=102, volume=1, side='SELL')
+    event_stream.emit(snapshot)
+    assert book.depth()=={'bids': [(100, 2)], 'asks': [(102, 1)]}
+    event_stream.emit(Reconnect(exchange='Test', symbol='BTCUSD'))
+    assert book.depth()=={'bids': [], 'asks': []}
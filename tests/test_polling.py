@@ -0,0 +1,63 @@
+import asyncio
+
+from numismatic.events import PriceUpdate
+from numismatic.feeds.base import _chunk_list
+from numismatic.feeds.cryptocompare import CryptoCompareRestClient
+
+from .fakes import run
+
+
+def test_chunk_list():
+    assert list(_chunk_list(['BTC', 'ETH', 'LTC'], 7))==[['BTC', 'ETH'],
+                                                         ['LTC']]
+    assert list(_chunk_list(['BTC', 'ETH', 'LTC'], 11))==[['BTC', 'ETH',
+                                                           'LTC']]
+    # an item that is too long on its own still gets a chunk
+    assert list(_chunk_list(['BTC', 'VERYLONGCOIN'], 7))==[['BTC'],
+                                                           ['VERYLONGCOIN']]
+    assert list(_chunk_list([], 7))==[]
+
+
+def subscribe(client, calls, *symbols):
+    async def get_prices_async(assets, currencies, exchange=None, raw=False):
+        calls.append((assets, currencies))
+        return [{'exchange': exchange, 'asset': asset, 'currency': currency,
+                 'price': 1.0} for asset in assets for currency in currencies]
+
+    events = []
+    for symbol in symbols:
+        subscription = client.listen(symbol, get_prices_async, interval=10,
+                                     asset=symbol[:3], currency=symbol[3:])
+        subscription.event_stream.sink(events.append)
+    return events
+
+
+def test_due_subscriptions_are_polled_in_batches():
+    async def main():
+        client = CryptoCompareRestClient()
+        client._batch_limits = (7, 100)
+        calls = []
+        events = subscribe(client, calls, 'BTCUSD', 'ETHUSD', 'LTCUSD',
+                           'BTCEUR')
+        await asyncio.sleep(0.01)
+        client._poller.cancel()
+        assert calls==[(['BTC', 'ETH'], ['EUR', 'USD']),
+                       (['LTC'], ['EUR', 'USD'])]
+        # the unsubscribed ETHEUR and LTCEUR prices are dropped
+        assert sorted(event.symbol for event in events) == \
+            ['BTCEUR', 'BTCUSD', 'ETHUSD', 'LTCUSD']
+        assert all(isinstance(event, PriceUpdate) for event in events)
+    run(main())
+
+
+def test_without_batch_limits_every_subscription_is_polled_alone():
+    async def main():
+        client = CryptoCompareRestClient()
+        client._batch_limits = None
+        calls = []
+        events = subscribe(client, calls, 'BTCUSD', 'ETHUSD')
+        await asyncio.sleep(0.01)
+        client._poller.cancel()
+        assert calls==[(['BTC'], ['USD']), (['ETH'], ['USD'])]
+        assert [event.symbol for event in events]==['BTCUSD', 'ETHUSD']
+    run(main())
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from numismatic.feeds.bitfinex import BitfinexWebsocketClient
+from numismatic.feeds.luno import LunoWebsocketClient
+from numismatic.libs.queues import PacketQueue
+
+from .fakes import FakeWebsocket, run
+
+
+async def drain(queue):
+    return [await queue.get() for _ in range(len(queue))]
+
+
+def test_block_waits_for_space():
+    async def main():
+        queue = PacketQueue(maxsize=1)
+        await queue.put(1)
+        put = asyncio.ensure_future(queue.put(2))
+        await asyncio.sleep(0)
+        assert not put.done()
+        assert await queue.get()==1
+        await put
+        assert await drain(queue)==[2]
+        assert queue.stats['blocked']==1
+    run(main())
+
+
+def test_drop_oldest():
+    async def main():
+        queue = PacketQueue(maxsize=2, overflow='drop_oldest')
+        for item in range(4):
+            await queue.put(item)
+        assert await drain(queue)==[2, 3]
+        assert queue.stats['dropped']==2
+    run(main())
+
+
+def test_conflate_replaces_keyed_items_in_place():
+    async def main():
+        queue = PacketQueue(maxsize=2, overflow='conflate')
+        await queue.put('ticker 1', key='ticker')
+        await queue.put('trade 1')
+        await queue.put('ticker 2', key='ticker')
+        assert queue.stats['conflated']==1
+        # unkeyed items are never conflated, the oldest is dropped instead
+        await queue.put('trade 2')
+        assert await drain(queue)==['trade 1', 'trade 2']
+        assert queue.stats['dropped']==1
+        await queue.put('ticker 3', key='ticker')
+        await queue.put('trade 3')
+        await queue.put('ticker 4', key='ticker')
+        assert await drain(queue)==['ticker 4', 'trade 3']
+        assert queue.stats['conflated']==2
+    run(main())
+
+
+def test_invalid_overflow():
+    with pytest.raises(ValueError):
+        PacketQueue(overflow='bogus')
+
+
+def test_sequenced_clients_refuse_conflate():
+    async def main():
+        with pytest.raises(ValueError):
+            LunoWebsocketClient(websocket=FakeWebsocket(), api_key_id='id',
+                                api_key_secret='secret', overflow='conflate')
+    run(main())
+
+
+def test_only_tickers_are_conflated():
+    async def main():
+        client = BitfinexWebsocketClient(websocket=FakeWebsocket(),
+                                         overflow='conflate')
+        client.close()
+        ticker = client.listen('BTCUSD', 'TICKER')
+        trades = client.listen('ETHUSD', 'TRADES')
+        client._register_channel(1, ticker)
+        client._register_channel(2, trades)
+        assert client._get_conflation_key([1, [7000, 1, 7001, 1]])==1
+        assert client._get_conflation_key([1, 'hb']) is None
+        assert client._get_conflation_key([2, 'tu', [1, 2, 3, 4]]) is None
+        assert client._get_conflation_key({'event': 'info'}) is None
+        # a malformed packet is skipped rather than stopping the listener
+        await client._enqueue('{not json')
+        await client._enqueue('[1, [7000, 1, 7001, 1]]')
+        assert len(client._queue)==1
+    run(main())
+
+
+def test_drop_oldest_under_load_delivers_the_newest_trades():
+    async def main():
+        websocket = FakeWebsocket()
+        client = BitfinexWebsocketClient(websocket=websocket,
+                                         subscribe_window=0, queue_size=10,
+                                         overflow='drop_oldest')
+        subscription = client.listen('BTCUSD', 'TRADES')
+        events = []
+        subscription.event_stream.sink(events.append)
+        await asyncio.sleep(0.01)
+        websocket.feed({'event': 'subscribed', 'channel': 'trades',
+                        'chanId': 10, 'pair': 'BTCUSD'})
+        await asyncio.sleep(0.01)
+        # faster than the consumer, which only runs once the reader yields
+        for index in range(1000):
+            await client._enqueue(json.dumps(
+                [10, 'tu', [index, 1500000000000+index, 0.5, 4000+index]]))
+        assert client.queue_stats['depth']==10
+        assert client.queue_stats['dropped']==990
+        await asyncio.sleep(0.01)
+        client.close()
+        assert [event.price for event in events]==list(range(4990, 5000))
+    run(main())
+
+
+def test_conflate_under_load_keeps_the_latest_of_each_key():
+    async def main():
+        queue = PacketQueue(maxsize=50, overflow='conflate')
+        rng = random.Random(0)
+        latest = {}
+        unkeyed = []
+        for index in range(10000):
+            key = rng.choice([None, 'a', 'b', 'c', 'd'])
+            if key is None:
+                unkeyed.append(index)
+            else:
+                latest[key] = index
+            await queue.put((key, index), key=key)
+        items = await drain(queue)
+        stats = queue.stats
+        assert len(items)==50
+        assert stats['put']+stats['conflated']==10000
+        assert stats['put']-stats['dropped']==50
+        # the newest update of every key survives in its queued place
+        assert {key: index for key, index in items if key} == latest
+        # and the newest unkeyed items are kept in order
+        kept = [index for key, index in items if key is None]
+        assert kept==unkeyed[-len(kept):]
+    run(main())
@@ -0,0 +1,51 @@
+from configparser import ConfigParser
+
+from numismatic.libs.ratelimit import RateLimits, TokenBucket
+
+
+def test_bursts_then_refills_at_the_rate():
+    bucket = TokenBucket(rate=2, burst=3, updated=0.0)
+    assert [bucket.reserve(now=0) for _ in range(5)]==[0, 0, 0, 0.5, 1.0]
+    # the two reservations in debt are paid off after a second
+    assert bucket.reserve(now=1.0)==0.5
+    assert bucket.reserve(now=2.5)==0
+
+
+def test_idle_buckets_only_refill_to_the_burst():
+    bucket = TokenBucket(rate=10, burst=2, updated=0.0)
+    assert [bucket.reserve(now=3600) for _ in range(4)]==[0, 0, 0.1, 0.2]
+
+
+def test_limits_are_read_from_config():
+    config = ConfigParser()
+    config.read_string('''
+[DEFAULT]
+rate_limit = 0
+rate_burst = 1
+
+[RateLimits]
+min-api.cryptocompare.com = 15, 5
+api.mybitx.com = 1
+''')
+    rate_limits = RateLimits.from_config(config)
+    assert rate_limits.limits=={'min-api.cryptocompare.com': (15, 5),
+                                'api.mybitx.com': (1, 1)}
+    assert rate_limits.default==(0, 1)
+    bucket = rate_limits.get_bucket('min-api.cryptocompare.com')
+    assert (bucket.rate, bucket.burst)==(15, 5)
+    # each host has one shared bucket
+    assert rate_limits.get_bucket('min-api.cryptocompare.com') is bucket
+    # hosts without a limit are unlimited by default
+    assert rate_limits.get_bucket('api.gdax.com') is None
+    assert rate_limits.reserve('api.gdax.com')==0
+
+
+def test_acquire_waits_out_the_reservation(monkeypatch):
+    slept = []
+    monkeypatch.setattr('numismatic.libs.ratelimit.time.sleep', slept.append)
+    rate_limits = RateLimits(limits={'api.mybitx.com': (1, 1)})
+    for _ in range(3):
+        rate_limits.acquire_sync('api.mybitx.com')
+    rate_limits.acquire_sync('api.gdax.com')
+    assert len(slept)==2
+    assert 0.9<slept[0]<=1 and 1.9<slept[1]<=2
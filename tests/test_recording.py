@@ -0,0 +1,60 @@
+import asyncio
+import gzip
+
+import pytest
+
+from numismatic.feeds.bitfinex import BitfinexWebsocketClient
+from numismatic.recording import Recorder, Replayer, read_recording
+
+from .fakes import FakeWebsocket, run
+
+
+def record(path):
+    async def main():
+        websocket = FakeWebsocket()
+        client = BitfinexWebsocketClient(websocket=websocket,
+                                         subscribe_window=0)
+        subscription = client.listen('BTCUSD', 'TRADES')
+        recorder = Recorder(path=path, clients=[client])
+        events = []
+        subscription.event_stream.sink(events.append)
+        await asyncio.sleep(0.01)
+        websocket.feed({'event': 'subscribed', 'channel': 'trades',
+                        'chanId': 10, 'pair': 'BTCUSD'})
+        websocket.feed([10, 'tu', [1, 1500000000000, 0.5, 4000]])
+        websocket.feed([10, 'tu', [2, 1500000001000, -0.25, 4001]])
+        await asyncio.sleep(0.01)
+        client.close()
+        recorder.close()
+        return recorder.frames, events
+    return run(main())
+
+
+def test_replay_emits_the_recorded_events(tmp_path):
+    path = str(tmp_path / 'btcusd.rec.gz')
+    frames, recorded = record(path)
+    assert frames==3
+    header, packets = read_recording(path)
+    assert header['clients'][0]['subscriptions']==[['BTCUSD', 'TRADES']]
+    assert [client_id for recv_time, client_id, packet in packets]==[0, 0, 0]
+
+    async def main():
+        replayer = Replayer(path=path, speed=0)
+        events = []
+        replayer.subscriptions['Bitfinex--BTCUSD--TRADES'].event_stream.sink(
+            events.append)
+        stats = await replayer.run()
+        return stats, events
+    stats, replayed = run(main())
+    assert stats['frames']==3
+    assert len(recorded)==2
+    assert [(event.id, event.price, event.volume) for event in replayed] == \
+        [(event.id, event.price, event.volume) for event in recorded]
+
+
+def test_other_files_are_not_recordings(tmp_path):
+    path = str(tmp_path / 'other.gz')
+    with gzip.open(path, 'wb') as file:
+        file.write(b'{"not": "a recording"}\n')
+    with pytest.raises(ValueError):
+        read_recording(path)
@@ -0,0 +1,275 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from numismatic.requesters import (AsyncRequester, CachingRequester,
+                                   Requester, Response)
+
+from .fakes import run
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+
+requires_aiohttp = pytest.mark.skipif(not AsyncRequester.available(),
+                                      reason='aiohttp is not installed')
+
+
+async def serve(handler):
+    '''Serves handler on a free local port, returns the runner and url'''
+    app = web.Application()
+    app.router.add_get('/{path:.*}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://127.0.0.1:{port}/'
+
+
+async def echo(request):
+    await asyncio.sleep(0.01)
+    return web.json_response(dict(path=request.path,
+                                  query=dict(request.query)))
+
+
+@requires_aiohttp
+def test_async_get():
+    async def main():
+        runner, url = await serve(echo)
+        requester = AsyncRequester()
+        try:
+            response = await requester.get_async(
+                url+'price', params={'fsym': 'BTC', 'e': None, 'limit': 5})
+        finally:
+            await requester.close()
+            await runner.cleanup()
+        assert response.ok
+        # None params are dropped as requests would
+        assert response.json()=={'path': '/price',
+                                 'query': {'fsym': 'BTC', 'limit': '5'}}
+    run(main())
+
+
+@requires_aiohttp
+def test_concurrent_requests_are_bounded():
+    in_flight = []
+    peak = []
+
+    async def handler(request):
+        in_flight.append(request)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.02)
+        in_flight.remove(request)
+        return web.json_response({})
+
+    async def main():
+        runner, url = await serve(handler)
+        requester = AsyncRequester(max_concurrency=2)
+        try:
+            responses = await asyncio.gather(*[
+                requester.get_async(url, params={'page': page})
+                for page in range(6)])
+        finally:
+            await requester.close()
+            await runner.cleanup()
+        assert all(response.ok for response in responses)
+        assert max(peak)==2
+    run(main())
+
+
+@requires_aiohttp
+def test_blocking_get_runs_on_the_private_loop():
+    async def main():
+        runner, url = await serve(echo)
+        requester = AsyncRequester()
+        loop = asyncio.get_event_loop()
+        try:
+            # as called from a worker thread
+            responses = await asyncio.gather(*[
+                loop.run_in_executor(None, requester.get, url+str(page))
+                for page in range(3)])
+            assert {loop for loop, host in requester._sessions} == \
+                {requester._loop}
+        finally:
+            requester.shutdown()
+            await runner.cleanup()
+        assert [response.json()['path'] for response in responses] == \
+            ['/0', '/1', '/2']
+        assert requester._sessions=={}
+    run(main())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1500000000.0]
+    monkeypatch.setattr('numismatic.requesters.time.time', lambda: now[0])
+    return now
+
+
+def caching_requester(tmp_path, **kwargs):
+    requester = CachingRequester(cache_dir=tmp_path, **dict(
+        dict(default_ttl=60, memory_size=10, max_disk_size=1), **kwargs))
+    requester.requested = []
+
+    def get(url, params=None, headers=None):
+        requester.requested.append(requester._get_url(url, params))
+        return Response(url=requester._get_url(url, params), status_code=200,
+                        content=b'{"BTC": {"USD": 4000}}'+b' '*1000)
+
+    requester._get = get
+    return requester
+
+
+API_URL = 'https://min-api.cryptocompare.com/data/'
+
+
+def test_responses_are_cached_for_the_ttl_of_their_endpoint(tmp_path, clock):
+    requester = caching_requester(tmp_path)
+    params = {'fsyms': 'BTC', 'tsyms': 'USD'}
+    assert requester.get(API_URL+'pricemulti', params).json() == \
+        {'BTC': {'USD': 4000}}
+    requester.get(API_URL+'pricemulti', params)
+    requester.get(API_URL+'coinlist')
+    clock[0] += 5
+    requester.get(API_URL+'pricemulti', params)
+    requester.get(API_URL+'coinlist')
+    assert len(requester.requested)==3
+    assert requester.stats['memory_hits']==2
+    assert requester.stats['expired']==1
+    # the disk copy expires with the memory copy
+    requester._memory.clear()
+    requester.get(API_URL+'coinlist')
+    requester.get(API_URL+'coinlist', use_cache=False)
+    assert requester.stats['disk_hits']==1
+    assert len(requester.requested)==4
+
+
+def test_closed_candles_are_cached_forever(tmp_path, clock):
+    requester = caching_requester(tmp_path)
+    closed = {'fsym': 'BTC', 'tsym': 'USD', 'toTs': clock[0]-2*60*60}
+    current = {'fsym': 'BTC', 'tsym': 'USD', 'toTs': clock[0]}
+    for params in (closed, current):
+        requester.get(API_URL+'histohour', params)
+    # past the ttl but before the current candle closes
+    clock[0] += 61
+    for params in (closed, current):
+        requester.get(API_URL+'histohour', params)
+    assert requester.stats['memory_hits']==1
+    assert len(requester.requested)==3
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, clock):
+    requester = caching_requester(tmp_path, memory_size=2)
+    for endpoint in ('a', 'b', 'a', 'c'):
+        requester.get(API_URL+endpoint)
+    assert requester.stats['memory_evictions']==1
+    assert [response.url for saved_at, response
+            in requester._memory.values()]==[API_URL+'a', API_URL+'c']
+    # b is still on disk
+    requester.get(API_URL+'b')
+    assert requester.stats['disk_hits']==1
+    assert len(requester.requested)==3
+
+
+def test_disk_is_capped(tmp_path, clock):
+    # the compressed responses are around 30 bytes
+    requester = caching_requester(tmp_path, max_disk_size=100/2**20)
+    for endpoint in 'abcdef':
+        clock[0] += 1
+        requester.get(API_URL+endpoint)
+    assert requester.stats['disk_evictions']>0
+    assert requester.store.size<=100
+    assert API_URL+'f' in [response.url for saved_at, response
+                          in requester._memory.values()]
+    assert requester.store.get(requester._get_key(API_URL+'a')) is None
+
+
+def test_concurrent_identical_requests_share_one_request():
+    requester = Requester()
+    release = threading.Event()
+    requested = []
+
+    def get(url, params=None, headers=None):
+        requested.append((url, params))
+        release.wait(1)
+        if params.get('fail'):
+            raise ValueError('bad request')
+        return Response(url=url, status_code=200)
+
+    requester._get = get
+    url = API_URL+'pricemulti'
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        futures = [executor.submit(requester.get, url, params)
+                   for params in [{'fsyms': 'BTC'}]*3 + [{'fsyms': 'ETH'}] +
+                                 [{'fsyms': 'BTC', 'fail': 1}]*2]
+        deadline = time.time()+1
+        while requester.stats['coalesced']<3 and time.time()<deadline:
+            time.sleep(0.001)
+        release.set()
+        responses = [future.result() for future in futures[:4]]
+        errors = [future.exception() for future in futures[4:]]
+    assert len(requested)==3
+    assert responses[0] is responses[1] is responses[2]
+    assert responses[3] is not responses[0]
+    assert [type(error) for error in errors]==[ValueError, ValueError]
+    # nothing is left in flight, so a new request is made
+    requester.get(url, {'fsyms': 'BTC'})
+    assert len(requested)==4
+
+
+def test_concurrent_identical_async_requests_share_one_request():
+    requester = Requester()
+    requested = []
+
+    async def get_async(url, params=None, headers=None):
+        requested.append(url)
+        await asyncio.sleep(0.01)
+        return Response(url=url, status_code=200)
+
+    requester._get_async = get_async
+
+    async def main():
+        first = asyncio.ensure_future(requester.get_async(API_URL+'a'))
+        rest = [asyncio.ensure_future(requester.get_async(API_URL+'a'))
+                for _ in range(2)]
+        await asyncio.sleep(0)
+        # the first caller giving up leaves the request to the others
+        first.cancel()
+        responses = await asyncio.gather(*rest)
+        assert responses[0] is responses[1]
+        assert requested==[API_URL+'a']
+        assert requester.stats['coalesced']==2
+        assert requester._in_flight_tasks=={}
+    run(main())
+
+
+
+class SlowDict(OrderedDict):
+    """Switches threads between checking for a key and getting it"""
+
+    def __getitem__(self, key):
+        time.sleep(0.0001)
+        return super().__getitem__(key)
+
+
+def test_caching_requester_is_thread_safe(tmp_path):
+    requester = caching_requester(tmp_path, memory_size=2)
+    requester._memory = SlowDict()
+    urls = [API_URL+str(index) for index in range(4)]
+    calls = 2000
+
+    def get(index):
+        return requester.get(urls[index%len(urls)]).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert set(executor.map(get, range(calls)))=={200}
+    stats = requester.stats
+    assert stats['memory_hits']+stats['disk_hits']+stats['misses']==calls
+    assert len(requester._memory)<=2
@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from numismatic.libs.utils import parse_timestamp
+
+
+NOON = datetime(2017, 10, 16, 12, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize('timestamp, expected', [
+    ('2017-10-16T12:00:00Z', NOON),
+    ('2017-10-16T12:00:00', NOON),
+    ('2017-10-16 12:00:00', NOON),
+    ('2017-10-16T12:00:00.5Z', NOON+0.5),
+    ('2017-10-16T12:00:00.000250Z', NOON+0.00025),
+    ('2017-10-16T12:34:56.789Z', NOON+34*60+56.789),
+    ('2017-10-16T23:59:59.9999Z', NOON+12*3600-1e-4),
+    # other layouts go through dateutil
+    ('2017-10-16T13:00:00+01:00', NOON),
+    ('2017-10-16', NOON-12*3600),
+    ('16 Oct 2017 12:00', NOON),
+])
+def test_parse_timestamp(timestamp, expected):
+    assert parse_timestamp(timestamp)==pytest.approx(expected, rel=0,
+                                                      abs=1e-6)
+
+
+def test_parse_timestamp_is_utc_across_dates():
+    for day in range(1, 32):
+        dt = datetime(2017, 12, day, 6, 30, tzinfo=timezone.utc)
+        assert parse_timestamp(dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')) == \
+            dt.timestamp()
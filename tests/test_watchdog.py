@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+
+from numismatic.events import Heartbeat, Trade
+from numismatic.feeds.bitfinex import BitfinexWebsocketClient
+from numismatic.feeds.gdax import GDAXWebsocketClient
+from numismatic.libs.watchdog import Watchdog
+
+from .fakes import FakeWebsocket, run
+
+
+def watched(timeout=10):
+    client = BitfinexWebsocketClient(websocket=FakeWebsocket())
+    client.close()
+    resyncs = []
+
+    async def resync(subscription):
+        resyncs.append(subscription)
+    client._resync = resync
+    subscription = client.listen('BTCUSD', 'TRADES')
+    watchdog = Watchdog(timeout=timeout)
+    watch = watchdog.watch(subscription)
+    watchdog._task.cancel()
+    return client, subscription, watchdog, watch, resyncs
+
+
+def test_heartbeats_count_as_liveness_not_data():
+    async def main():
+        client, subscription, watchdog, watch, resyncs = watched()
+        last_message = watch.last_message
+        subscription.event_stream.emit(Heartbeat(exchange='Bitfinex',
+                                                 symbol='BTCUSD'))
+        assert watch.last_message==last_message
+        assert watch.last_seen==watch.last_heartbeat>last_message
+        subscription.event_stream.emit(Trade(exchange='Bitfinex',
+                                             symbol='BTCUSD', price=1,
+                                             volume=1))
+        assert watch.last_message>last_message
+    run(main())
+
+
+def test_quiet_channel_with_heartbeats_is_never_resynced(monkeypatch):
+    async def main():
+        client, subscription, watchdog, watch, resyncs = watched(timeout=10)
+        now = watch.last_message
+        monkeypatch.setattr(time, 'time', lambda: now)
+        for tick in range(100):
+            now += 1
+            if tick%5==0:
+                subscription.event_stream.emit(
+                    Heartbeat(exchange='Bitfinex', symbol='BTCUSD'))
+            watchdog._advance(now)
+        await asyncio.sleep(0)
+        assert resyncs==[]
+        assert client.websocket.closed==0
+        assert not watchdog.stats
+    run(main())
+
+
+def test_silent_subscription_is_resynced_then_reconnected():
+    async def main():
+        client, subscription, watchdog, watch, resyncs = watched()
+        now = watch.last_message+10
+        watchdog._on_stale(watch, now)
+        watchdog._on_stale(watch, now+10)
+        await asyncio.sleep(0)
+        assert len(resyncs)==1
+        assert client.websocket.closed==1
+        assert dict(watchdog.stats)=={'resyncs': 1, 'reconnects': 1}
+    run(main())
+
+
+def test_a_live_connection_is_not_reconnected():
+    async def main():
+        client, subscription, watchdog, watch, resyncs = watched()
+        other = watchdog.watch(client.listen('ETHUSD', 'TRADES'))
+        watchdog._task.cancel()
+        now = watch.last_message+10
+        watchdog._on_stale(watch, now)
+        # another channel on the same socket still gets heartbeats
+        other.last_heartbeat = now+5
+        watchdog._on_stale(watch, now+10)
+        await asyncio.sleep(0)
+        # the channel is silent but the socket is alive so only resync
+        assert len(resyncs)==2
+        assert client.websocket.closed==0
+    run(main())
+
+
+def test_bitfinex_resync_stops_routing_the_old_channel():
+    async def main():
+        websocket = FakeWebsocket()
+        client = BitfinexWebsocketClient(websocket=websocket,
+                                         subscribe_window=0)
+        subscription = client.listen('BTCUSD', 'TRADES')
+        await asyncio.sleep(0.01)
+        websocket.feed({'event': 'subscribed', 'channel': 'trades',
+                        'chanId': 10, 'pair': 'BTCUSD'})
+        await asyncio.sleep(0.01)
+        assert client._channels=={10: subscription}
+        await client._resync(subscription)
+        client.close()
+        assert client._channels=={}
+    run(main())
+
+
+def test_gdax_resync_keeps_the_shared_heartbeat():
+    async def main():
+        websocket = FakeWebsocket()
+        client = GDAXWebsocketClient(websocket=websocket, subscribe_window=0)
+        trades = client.listen('BTC-USD', 'TRADES')
+        ticker = client.listen('BTC-USD', 'TICKER')
+        await asyncio.sleep(0.01)
+        websocket.feed({'type': 'subscriptions', 'channels': [
+            {'name': 'matches', 'product_ids': ['BTC-USD']},
+            {'name': 'ticker', 'product_ids': ['BTC-USD']},
+            {'name': 'heartbeat', 'product_ids': ['BTC-USD']}]})
+        await asyncio.sleep(0.01)
+        websocket.sent.clear()
+        await client._unsubscribe(trades)
+        client.close()
+        assert json.loads(websocket.sent[0]) == \
+            {'type': 'unsubscribe',
+             'channels': [{'name': 'matches', 'product_ids': ['BTC-USD']}]}
+    run(main())
@@ -0,0 +1,98 @@
+import pytest
+
+from numismatic import workers
+from numismatic.workers import WorkerPool
+
+
+class FakeProcess:
+
+    def __init__(self, target, args, daemon):
+        self.args = args
+        self.alive = True
+        self.exitcode = None
+        self.pid = 0
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+
+@pytest.fixture
+def processes(monkeypatch):
+    processes = []
+
+    def process(**kwargs):
+        processes.append(FakeProcess(**kwargs))
+        return processes[-1]
+    monkeypatch.setattr(workers._context, 'Process', process)
+    monkeypatch.setattr(workers, 'READY_TIMEOUT', 3)
+    return processes
+
+
+def test_workers_get_the_requester_and_cache_dir(processes, monkeypatch):
+    pool = WorkerPool(feed='bitfinex', workers=2, requester='caching',
+                      cache_dir='/tmp/cache')
+    monkeypatch.setattr(pool, '_listener', lambda backlog: None)
+    monkeypatch.setattr(workers.asyncio, 'ensure_future', lambda coro: None)
+    real_queue = workers._context.Queue
+
+    def queue():
+        ready = real_queue()
+        for shard in range(2):
+            ready.put(('ready', shard, []))
+        return ready
+    monkeypatch.setattr(workers._context, 'Queue', queue)
+    assert pool.subscribe('BTC', 'USD', 'trades')=={}
+    assert [process.args[-3:] for process in processes] == \
+        [('caching', '/tmp/cache', ('event_stream',))]*2
+
+
+def test_workers_only_send_raw_packets_if_asked():
+    assert WorkerPool(feed='bitfinex', workers=2).streams==('event_stream',)
+    assert WorkerPool(feed='bitfinex', workers=2, raw=True).streams == \
+        ('event_stream', 'raw_stream')
+
+
+def test_dead_worker_fails_the_handshake(processes):
+    pool = WorkerPool(feed='bitfinex', workers=2)
+    pool.processes = [FakeProcess(None, (), True) for _ in range(2)]
+    pool._check_startup(set(), deadline=float('inf'))
+    pool.processes[0].alive = False
+    # a worker with no markets exits once it has reported
+    pool._check_startup({0}, deadline=float('inf'))
+    pool.processes[1].alive = False
+    pool.processes[1].exitcode = 1
+    with pytest.raises(RuntimeError, match='Worker 1 exited with code 1'):
+        pool._check_startup({0}, deadline=float('inf'))
+
+
+def test_slow_workers_fail_the_handshake(processes):
+    pool = WorkerPool(feed='bitfinex', workers=2)
+    pool.processes = [FakeProcess(None, (), True) for _ in range(2)]
+    with pytest.raises(RuntimeError, match=r'Workers \[1\] did not'):
+        pool._check_startup({0}, deadline=0)
+    assert not any(process.alive for process in pool.processes)
+
+
+def test_workers_that_die_while_listening_are_reported(processes, caplog):
+    pool = WorkerPool(feed='bitfinex', workers=2)
+    pool.processes = [FakeProcess(None, (), True) for _ in range(2)]
+    pool._listening = {0: ['Bitfinex--BTCUSD--TRADES'],
+                       1: ['Bitfinex--ETHUSD--TRADES']}
+    pool._check_workers()
+    assert not caplog.records
+    pool.processes[1].alive = False
+    pool.processes[1].exitcode = -9
+    pool._check_workers()
+    pool._check_workers()
+    assert [record.getMessage() for record in caplog.records] == \
+        ['Worker 1 exited with code -9, no more events for '
+         'Bitfinex--ETHUSD--TRADES']
+    pool.processes[0].alive = False
+    with pytest.raises(RuntimeError, match='All workers have exited'):
+        pool._check_workers()